@@ -0,0 +1,55 @@
+"""
+Gunicorn settings of the two server pools, chosen by SITAPEA_POOL:
+
+kiosk    the kiosk page, taps and /health/: many short requests, served
+         by threads that keep their connections to nginx open.
+reports  reports, the API, timesheets and the admin: few long requests,
+         by sync workers with a long timeout.
+
+nginx sends each path to its pool, so that report requests never hold a
+worker a tap is waiting for. Each setting of a pool can be overridden
+with SITAPEA_<POOL>_<SETTING>, e.g. SITAPEA_KIOSK_WORKER_CLASS=gevent
+once gevent is installed, or SITAPEA_REPORTS_WORKERS=4.
+
+    gunicorn -c ../config/gunicorn.conf.py sitapea.wsgi
+"""
+import os
+
+POOLS = {
+    'kiosk': {
+        'bind': 'localhost:8000',
+        'workers': 2,
+        'worker_class': 'gthread',
+        'threads': 16,
+        'timeout': 30,
+        'keepalive': 75,
+    },
+    'reports': {
+        'bind': 'localhost:8001',
+        'workers': 2,
+        'worker_class': 'sync',
+        'threads': 1,
+        'timeout': 600,
+        'keepalive': 2,
+    },
+}
+
+pool = os.environ.get('SITAPEA_POOL', 'kiosk')
+if pool not in POOLS:
+    raise RuntimeError('SITAPEA_POOL must be one of {}, not {!r}'.format(', '.join(sorted(POOLS)), pool))
+
+
+def setting(name):
+    default = POOLS[pool][name]
+    value = os.environ.get('SITAPEA_{}_{}'.format(pool.upper(), name.upper()))
+    return type(default)(value) if value else default
+
+
+bind = setting('bind')
+workers = setting('workers')
+worker_class = setting('worker_class')
+threads = setting('threads')
+timeout = setting('timeout')
+keepalive = setting('keepalive')
+proc_name = 'sitapea-{}'.format(pool)
+raw_env = ['DJANGO_SETTINGS_MODULE=sitapea.settings']
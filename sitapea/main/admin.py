@@ -1,8 +1,193 @@
-from django.contrib import admin
+import hashlib
+from datetime import timedelta
+
+from django import forms
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
 from django.core.urlresolvers import reverse
-from django.db.models.functions import Coalesce
+from django.db import connections
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.utils.dateparse import parse_date
 from django.utils.safestring import mark_safe
-from .models import Employee, Department, CheckIn
+from .helpers import EPOCH, start_of_day, to_epoch_us
+from .anomalies import scan_anomalies
+from .models import Employee, Department, CheckIn, CheckInAnomaly
+from .roster import RosterError, read_roster, sync_roster
+
+CURSOR_VAR = 'cursor'
+COUNT_CACHE_TIMEOUT = 60
+COUNT_ESTIMATE_MIN = 100000
+AUTOCOMPLETE_LIMIT = 20
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Counts once a minute per query. Unfiltered tables on PostgreSQL are not
+    counted at all above COUNT_ESTIMATE_MIN rows, the planner's estimate is
+    used instead.
+    """
+    def _get_count(self):
+        if self._count is None:
+            self._count = self.estimate_count()
+            if self._count is None:
+                query = self.object_list.query
+                key = 'main:admin-count:' + hashlib.md5(str(query).encode('utf-8')).hexdigest()
+                self._count = cache.get_or_set(key, self.object_list.count, COUNT_CACHE_TIMEOUT)
+        return self._count
+    count = property(_get_count)
+
+    def estimate_count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql' or query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [query.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= COUNT_ESTIMATE_MIN:
+            return int(row[0])
+
+
+class EffectiveDateRangeFilter(admin.ListFilter):
+    """[date_from, date_to) in local days, as a range on the indexed effective_timestamp."""
+    title = 'дате'
+    template = 'admin/main/checkin/date_range_filter.html'
+    parameters = ('date_from', 'date_to')
+
+    def __init__(self, request, params, model, model_admin):
+        super(EffectiveDateRangeFilter, self).__init__(request, params, model, model_admin)
+        for name in self.parameters:
+            if params.get(name):
+                self.used_parameters[name] = params.pop(name)
+            else:
+                params.pop(name, None)
+        for name, value in self.used_parameters.items():
+            try:
+                date = parse_date(value)
+            except ValueError:
+                date = None
+            if date is None:
+                raise IncorrectLookupParameters('Bad date: {}'.format(value))
+            # parse_date() takes 2017-1-2, the report URLs only 2017-01-02.
+            self.used_parameters[name] = date.isoformat()
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return list(self.parameters)
+
+    def queryset(self, request, queryset):
+        if 'date_from' in self.used_parameters:
+            queryset = queryset.filter(effective_timestamp__gte=start_of_day(self.used_parameters['date_from']))
+        if 'date_to' in self.used_parameters:
+            queryset = queryset.filter(effective_timestamp__lt=start_of_day(self.used_parameters['date_to']))
+        return queryset
+
+    def choices(self, cl):
+        ignored = self.parameters + (PAGE_VAR, CURSOR_VAR)
+        yield {
+            'date_from': self.used_parameters.get('date_from', ''),
+            'date_to': self.used_parameters.get('date_to', ''),
+            'hidden_params': sorted((name, value) for name, value in cl.params.items() if name not in ignored),
+            'reset_query_string': cl.get_query_string(remove=ignored),
+        }
+
+
+class AutocompleteFilter(admin.ListFilter):
+    """Filter by one related object, picked from a list the browser loads as the user types."""
+    template = 'admin/main/checkin/autocomplete_filter.html'
+    related_model = None
+    parameter_name = None
+    lookup = None
+
+    def __init__(self, request, params, model, model_admin):
+        super(AutocompleteFilter, self).__init__(request, params, model, model_admin)
+        if self.parameter_name in params:
+            self.used_parameters[self.parameter_name] = params.pop(self.parameter_name)
+        if self.value() is not None and not self.value().isdigit():
+            raise IncorrectLookupParameters('Bad {}: {}'.format(self.parameter_name, self.value()))
+
+    def value(self):
+        return self.used_parameters.get(self.parameter_name)
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(**{self.lookup: self.value()})
+
+    def choices(self, cl):
+        yield {
+            'selected': self.related_model.objects.filter(pk=self.value()).first() if self.value() else None,
+            'all_query_string': cl.get_query_string(remove=[self.parameter_name, PAGE_VAR, CURSOR_VAR]),
+            'autocomplete_url': reverse('admin:main_checkin_autocomplete',
+                                        kwargs={'model_name': self.related_model._meta.model_name}),
+            'parameter_name': self.parameter_name,
+        }
+
+
+class EmployeeFilter(AutocompleteFilter):
+    title = 'сотруднику'
+    related_model = Employee
+    parameter_name = 'employee'
+    lookup = 'employee_id'
+
+
+class DepartmentFilter(AutocompleteFilter):
+    title = 'отделу'
+    related_model = Department
+    parameter_name = 'department'
+    lookup = 'employee__department_id'
+
+
+class CheckInChangeList(ChangeList):
+    """
+    In the default order pages after the first are addressed by the last
+    (effective_timestamp, pk) seen rather than by an offset, and the shift
+    columns of a page are computed in one batch.
+    """
+    def get_filters_params(self, params=None):
+        lookup_params = super(CheckInChangeList, self).get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        super(CheckInChangeList, self).get_results(request)
+        self.cursor = None
+        self.next_cursor_url = None
+        keyset = ORDER_VAR not in self.params and not self.show_all
+        if keyset and self.params.get(CURSOR_VAR):
+            try:
+                epoch_us, pk = (int(part) for part in self.params[CURSOR_VAR].split(':'))
+                effective_timestamp = EPOCH + timedelta(microseconds=epoch_us)
+            except (ValueError, OverflowError):
+                pass
+            else:
+                self.cursor = self.params[CURSOR_VAR]
+                self.result_list = self.queryset.filter(
+                    Q(effective_timestamp__lt=effective_timestamp) |
+                    Q(effective_timestamp=effective_timestamp, pk__lt=pk)
+                )[:self.list_per_page]
+
+        CheckIn.prime_shift(self.result_list)
+        if keyset and len(self.result_list) == self.list_per_page:
+            last = self.result_list[len(self.result_list) - 1]
+            if last.effective_timestamp is not None:
+                self.next_cursor_url = self.get_query_string(
+                    {CURSOR_VAR: '{}:{}'.format(to_epoch_us(last.effective_timestamp), last.pk)}, [PAGE_VAR])
 
 
 class EmployeeInline(admin.TabularInline):
@@ -18,10 +203,48 @@ class DepartmentAdmin(admin.ModelAdmin):
     ]
 
 
+class RosterUploadForm(forms.Form):
+    roster = forms.FileField(label='Список сотрудников (CSV или XLSX)',
+                             help_text='Столбцы: Код, Фамилия, Имя, Отчество, Отдел')
+    dry_run = forms.BooleanField(label='Только проверить, без изменений', required=False)
+
+
 @admin.register(Employee)
 class EmployeeAdmin(admin.ModelAdmin):
     list_display = ('surname', 'name', 'patronym', 'code', )
 
+    def get_urls(self):
+        return [
+            url(r'^roster/$', self.admin_site.admin_view(self.roster_view), name='main_employee_roster'),
+        ] + super(EmployeeAdmin, self).get_urls()
+
+    def roster_view(self, request):
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        form = RosterUploadForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            roster = form.cleaned_data['roster']
+            try:
+                summary = sync_roster(read_roster(roster.file, roster.name), dry_run=form.cleaned_data['dry_run'])
+            except RosterError as e:
+                form.add_error('roster', str(e))
+            else:
+                messages.success(request, '{}Добавлено: {s.created}, изменено: {s.updated} (в другой отдел: '
+                                          '{s.moved}), без изменений: {s.unchanged}, новых отделов: '
+                                          '{s.departments_created}. Нет в списке: {s.missing}.'.format(
+                                              'Проверка. ' if form.cleaned_data['dry_run'] else '', s=summary))
+                for line, error in summary.errors[:20]:
+                    messages.warning(request, 'Строка {}: {}'.format(line, error))
+                if len(summary.errors) > 20:
+                    messages.warning(request, 'И ещё ошибок: {}'.format(len(summary.errors) - 20))
+                return redirect('admin:main_employee_changelist')
+        return TemplateResponse(request, 'admin/main/employee/roster.html', dict(
+            self.admin_site.each_context(request),
+            title='Загрузка списка сотрудников',
+            opts=self.model._meta,
+            form=form,
+        ))
+
 
 @admin.register(CheckIn)
 class CheckInAdmin(admin.ModelAdmin):
@@ -29,21 +252,60 @@ class CheckInAdmin(admin.ModelAdmin):
                     'arrival_timestamp_with_custom_sort', 'leaving_timestamp',
                     'workday_duration_raw', 'dinners_duration', 'coffee_duration',
                     'night_shift_bonus', 'workday_duration', 'comment', )
-    list_filter = ('employee', )
+    list_filter = (EffectiveDateRangeFilter, EmployeeFilter, DepartmentFilter, )
+    list_select_related = ('employee__department', )
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+    class Media:
+        js = ('main/js/admin_filters.js', )
+
+    def get_changelist(self, request, **kwargs):
+        return CheckInChangeList
+
+    def get_urls(self):
+        return [
+            url(r'^autocomplete/(?P<model_name>employee|department)/$',
+                self.admin_site.admin_view(self.autocomplete_view), name='main_checkin_autocomplete'),
+        ] + super(CheckInAdmin, self).get_urls()
+
+    def autocomplete_view(self, request, model_name):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        term = request.GET.get('term', '').strip()
+        if model_name == 'employee':
+            qs = Employee.objects\
+                .filter(Q(surname__istartswith=term) | Q(name__istartswith=term) | Q(code__startswith=term))\
+                .order_by('surname', 'name')
+        else:
+            qs = Department.objects\
+                .filter(Q(name__istartswith=term) | Q(acronym__istartswith=term))\
+                .order_by('name')
+        return JsonResponse({
+            'results': [{'id': obj.pk, 'text': str(obj)} for obj in qs[:AUTOCOMPLETE_LIMIT]],
+        })
 
     def get_queryset(self, request):
         qs = super(CheckInAdmin, self).get_queryset(request)
-        qs = qs.annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp'))\
-            .order_by('-arrival_or_leaving')
+        qs = qs.order_by('-effective_timestamp')
         return qs
 
+    def save_model(self, request, obj, form, change):
+        # Recorded in the CheckInChange log by the signal handlers.
+        obj._change_author = request.user.get_username()
+        super(CheckInAdmin, self).save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        obj._change_author = request.user.get_username()
+        super(CheckInAdmin, self).delete_model(request, obj)
+
     def department(self, obj):
         return obj.employee.department.acronym
     department.short_description = 'Отдел'
 
     def arrival_timestamp_with_custom_sort(self, obj):
         return obj.arrival_timestamp
-    arrival_timestamp_with_custom_sort.admin_order_field = 'arrival_or_leaving'
+    arrival_timestamp_with_custom_sort.admin_order_field = 'effective_timestamp'
     arrival_timestamp_with_custom_sort.short_description = 'Время прибытия'
 
     def report_link(self, obj):
@@ -54,3 +316,55 @@ class CheckInAdmin(admin.ModelAdmin):
                     date,
             ))
     report_link.short_description = 'Скачать отчёт'
+
+
+class CheckInAnomalyChangeList(ChangeList):
+    def get_results(self, request):
+        super(CheckInAnomalyChangeList, self).get_results(request)
+        # Archived check-ins have no change page; one query for the page.
+        live = set(CheckIn.objects.filter(pk__in=[anomaly.checkin_id for anomaly in self.result_list])
+                   .values_list('pk', flat=True))
+        for anomaly in self.result_list:
+            anomaly.checkin_is_live = anomaly.checkin_id in live
+
+
+@admin.register(CheckInAnomaly)
+class CheckInAnomalyAdmin(admin.ModelAdmin):
+    """Report of the anomalies found by the scan_anomalies command, which can also be run from here."""
+    list_display = ('employee', 'department', 'kind', 'effective_timestamp', 'checkin_link', 'found', )
+    list_filter = ('kind', EmployeeFilter, DepartmentFilter, )
+    list_select_related = ('employee__department', )
+    ordering = ('-effective_timestamp', )
+    readonly_fields = ('checkin_id', 'employee', 'kind', 'effective_timestamp', 'related_checkin_id', 'found', )
+
+    class Media:
+        js = ('main/js/admin_filters.js', )
+
+    def get_urls(self):
+        return [
+            url(r'^scan/$', self.admin_site.admin_view(self.scan_view), name='main_checkinanomaly_scan'),
+        ] + super(CheckInAnomalyAdmin, self).get_urls()
+
+    def scan_view(self, request):
+        if request.method != 'POST' or not self.has_change_permission(request):
+            raise PermissionDenied
+        scan = scan_anomalies()
+        messages.success(request, 'Проверка завершена, найдено ошибок: {}.'.format(scan.found))
+        return redirect('admin:main_checkinanomaly_changelist')
+
+    def get_changelist(self, request, **kwargs):
+        return CheckInAnomalyChangeList
+
+    def has_add_permission(self, request):
+        return False
+
+    def department(self, obj):
+        return obj.employee.department.acronym
+    department.short_description = 'Отдел'
+
+    def checkin_link(self, obj):
+        if obj.checkin_is_live:
+            return mark_safe('<a href="{}">{}</a>'.format(
+                reverse('admin:main_checkin_change', args=[obj.checkin_id]), obj.checkin_id))
+        return '{} (в архиве)'.format(obj.checkin_id)
+    checkin_link.short_description = 'Отметка'
@@ -0,0 +1,152 @@
+"""
+Check-in anomaly scanner.
+
+One ordered pass over the live and archived check-ins of each employee,
+with window functions giving every row its neighbours, flags:
+
+- a leaving without an arrival;
+- an arrival without a leaving, followed by another check-in or older
+  than WORKDAY_MAX_DURATION;
+- a shift longer than WORKDAY_MAX_DURATION;
+- an arrival before the leaving of the previous check-in.
+
+Scans are incremental: the next one only rechecks the employees with
+entries in the CheckInChange log after the seq of the last AnomalyScan,
+from shortly before the earliest changed timestamp, plus the open
+check-ins that outgrew the limit since. Window functions need SQLite
+3.25 or PostgreSQL.
+"""
+from functools import partial, reduce
+from itertools import islice
+from operator import or_
+
+from django.db import connections, router, transaction
+from django.db.models import DateTimeField, Max, Q, Value
+from django.utils import timezone
+
+from main.models import (WORKDAY_MAX_DURATION, AnomalyScan, ArchivedCheckIn, CheckIn, CheckInAnomaly,
+                         CheckInChange)
+
+EMPLOYEES_PER_QUERY = 200
+
+WINDOW_SQL = '''
+SELECT id, employee_id, arrival_timestamp, leaving_timestamp, effective_timestamp,
+       LAG(id) OVER (PARTITION BY employee_id ORDER BY effective_timestamp, id),
+       LAG(leaving_timestamp) OVER (PARTITION BY employee_id ORDER BY effective_timestamp, id),
+       LEAD(id) OVER (PARTITION BY employee_id ORDER BY effective_timestamp, id)
+FROM (SELECT * FROM ({}) live UNION ALL SELECT * FROM ({}) archived) checkins
+ORDER BY employee_id, effective_timestamp, id
+'''
+
+
+def checkin_rows(connection, condition):
+    """Rows of WINDOW_SQL for the check-ins matching a Q, datetimes converted."""
+    subqueries = [model.objects.filter(condition, effective_timestamp__isnull=False).order_by()
+                  .values_list('id', 'employee_id', 'arrival_timestamp', 'leaving_timestamp',
+                               'effective_timestamp').query.sql_with_params()
+                  for model in (CheckIn, ArchivedCheckIn)]
+    expression = Value(None, output_field=DateTimeField())
+    converters = connection.ops.get_db_converters(expression)
+
+    def to_datetime(value):
+        for converter in converters:
+            value = converter(value, expression, connection, {})
+        return value
+
+    with connection.cursor() as cursor:
+        cursor.execute(WINDOW_SQL.format(subqueries[0][0], subqueries[1][0]),
+                       subqueries[0][1] + subqueries[1][1])
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for pk, employee_id, arrival, leaving, effective, previous_id, previous_leaving, next_id in rows:
+                yield (pk, employee_id, to_datetime(arrival), to_datetime(leaving), to_datetime(effective),
+                       previous_id, to_datetime(previous_leaving), next_id)
+
+
+def find_anomalies(rows, horizon, starts=None):
+    """CheckInAnomaly objects of the rows, skipping those before the start of their employee."""
+    for pk, employee_id, arrival, leaving, effective, previous_id, previous_leaving, next_id in rows:
+        if starts is not None and effective < starts[employee_id]:
+            continue
+        anomaly = partial(CheckInAnomaly, checkin_id=pk, employee_id=employee_id, effective_timestamp=effective)
+        if arrival is None:
+            yield anomaly(kind=CheckInAnomaly.MISSING_ARRIVAL)
+        elif leaving is None and (next_id is not None or arrival < horizon):
+            yield anomaly(kind=CheckInAnomaly.MISSING_LEAVING)
+        if arrival and leaving and leaving - arrival > WORKDAY_MAX_DURATION:
+            yield anomaly(kind=CheckInAnomaly.OVERLONG)
+        if arrival and previous_leaving and previous_leaving > arrival:
+            yield anomaly(kind=CheckInAnomaly.OVERLAP, related_checkin_id=previous_id)
+
+
+def changed_starts(last_scan, seq, horizon):
+    """Earliest timestamp to recheck by employee id since the last scan."""
+    starts, changed = {}, set()
+
+    def include(employee_id, timestamp):
+        if timestamp and (employee_id not in starts or timestamp < starts[employee_id]):
+            starts[employee_id] = timestamp
+
+    changes = CheckInChange.objects.filter(seq__gt=last_scan.seq, seq__lte=seq)\
+        .values_list('checkin_id', 'employee_id', 'arrival_timestamp', 'leaving_timestamp')
+    for checkin_id, employee_id, arrival, leaving in changes.iterator():
+        changed.add(checkin_id)
+        include(employee_id, arrival)
+        include(employee_id, leaving)
+    # Anomalies found at the old timestamps of changed check-ins.
+    changed = iter(changed)
+    while True:
+        chunk = list(islice(changed, 500))
+        if not chunk:
+            break
+        for employee_id, effective in CheckInAnomaly.objects\
+                .filter(Q(checkin_id__in=chunk) | Q(related_checkin_id__in=chunk))\
+                .values_list('employee_id', 'effective_timestamp'):
+            include(employee_id, effective)
+    for employee_id, effective in CheckIn.objects\
+            .filter(effective_timestamp__gte=last_scan.horizon, effective_timestamp__lt=horizon,
+                    leaving_timestamp__isnull=True)\
+            .values_list('employee_id', 'effective_timestamp'):
+        include(employee_id, effective)
+    # A changed row may end or start the shift of its neighbour.
+    return {employee_id: timestamp - WORKDAY_MAX_DURATION for employee_id, timestamp in starts.items()}
+
+
+def scan_anomalies(full=False, now=None):
+    """Rescan what changed since the last scan, or everything; the AnomalyScan created."""
+    now = now or timezone.now()
+    horizon = now - WORKDAY_MAX_DURATION
+    connection = connections[router.db_for_read(CheckIn)]
+    # Taken before reading the check-ins: later changes wait for the next scan.
+    seq = CheckInChange.objects.aggregate(seq=Max('seq'))['seq'] or 0
+    last_scan = AnomalyScan.objects.order_by('-pk').first()
+    found = 0
+
+    if full or last_scan is None:
+        with transaction.atomic():
+            CheckInAnomaly.objects.all().delete()
+            anomalies = find_anomalies(checkin_rows(connection, Q()), horizon)
+            while True:
+                chunk = list(islice(anomalies, 2000))
+                if not chunk:
+                    break
+                CheckInAnomaly.objects.bulk_create(chunk)
+                found += len(chunk)
+        return AnomalyScan.objects.create(seq=seq, horizon=horizon, employees=None, found=found)
+
+    starts = changed_starts(last_scan, seq, horizon)
+    employee_ids = sorted(starts)
+    for i in range(0, len(employee_ids), EMPLOYEES_PER_QUERY):
+        chunk = {employee_id: starts[employee_id] for employee_id in employee_ids[i:i + EMPLOYEES_PER_QUERY]}
+        # The rows just before a start give its first row its neighbours.
+        condition = reduce(or_, [Q(employee_id=employee_id, effective_timestamp__gte=start - WORKDAY_MAX_DURATION)
+                                 for employee_id, start in chunk.items()])
+        anomalies = list(find_anomalies(checkin_rows(connection, condition), horizon, chunk))
+        with transaction.atomic():
+            CheckInAnomaly.objects.filter(reduce(or_, [Q(employee_id=employee_id, effective_timestamp__gte=start)
+                                                       for employee_id, start in chunk.items()])).delete()
+            CheckInAnomaly.objects.bulk_create(anomalies)
+        found += len(anomalies)
+    return AnomalyScan.objects.create(seq=seq, horizon=horizon, employees=len(employee_ids), found=found)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class MainConfig(AppConfig):
     name = 'main'
+
+    def ready(self):
+        import main.signals  # noqa
+        from main.workrules import get_work_rules
+        # Compiled once per process, a bad WORK_RULES fails at startup.
+        get_work_rules()
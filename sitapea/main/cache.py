@@ -0,0 +1,73 @@
+"""
+Per-worker cache of kiosk employee codes.
+
+Every gunicorn worker keeps its own size-bounded LRU of code -> employee
+record. Changes to employees replace a version stamp kept in Django's
+'versions' cache; a worker seeing a new stamp drops all of its entries, so the
+workers stay coherent. Unknown codes are remembered for a short time so
+that pad mashing does not reach the database on every attempt.
+"""
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+EmployeeRecord = namedtuple('EmployeeRecord', ['id', 'name', 'surname'])
+
+VERSION_CACHE = 'versions'
+
+
+def version_cache():
+    """The cache of version stamps, which culling of the default cache does not reach."""
+    return caches[VERSION_CACHE if VERSION_CACHE in settings.CACHES else DEFAULT_CACHE_ALIAS]
+
+
+class EmployeeCodeCache(object):
+    version_key = 'main:employee-code-cache-version'
+
+    def __init__(self, max_size=4096, negative_ttl=30):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = Lock()
+
+    def get(self, code):
+        version = version_cache().get(self.version_key)
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            entry = self.entries.get(code)
+            if entry is not None:
+                record, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(code)
+                    return record
+                del self.entries[code]
+
+        record = self.load(code)
+        with self.lock:
+            if version == self.version:
+                self.entries[code] = (record, None if record else time.monotonic() + self.negative_ttl)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return record
+
+    def load(self, code):
+        from main.models import Employee
+        row = Employee.objects.filter(code=code).values_list('id', 'name', 'surname').first()
+        if row:
+            return EmployeeRecord(*row)
+
+    def invalidate(self):
+        version_cache().set(self.version_key, uuid4().hex, None)
+        with self.lock:
+            self.entries.clear()
+
+
+employee_cache = EmployeeCodeCache()
+
@@ -1,10 +1,19 @@
-from datetime import datetime as dt, time
+import calendar
+from bisect import bisect_right
+from datetime import datetime as dt, time, timedelta
 from collections import namedtuple
+from functools import lru_cache
 
-from django.utils.timezone import make_aware
+from django.utils.dateparse import parse_date
+from django.utils.timezone import get_current_timezone, make_aware, utc
 
 Range = namedtuple('Range', ['start', 'end'])
 
+US_PER_SECOND = 10 ** 6
+US_PER_MINUTE = 60 * US_PER_SECOND
+US_PER_DAY = 24 * 60 * US_PER_MINUTE
+EPOCH = dt(1970, 1, 1, tzinfo=utc)
+
 
 def minutes_to_hhmm(minutes_total):
     hours = minutes_total // 60
@@ -12,6 +21,12 @@ def minutes_to_hhmm(minutes_total):
     return "%d:%02d" % (hours, minutes)
 
 
+def start_of_day(date):
+    if isinstance(date, str):
+        date = parse_date(date)
+    return make_aware(dt.combine(date, time.min))
+
+
 def morning_shift(date):
     return Range(
         start=make_aware(dt.combine(date, time.min)),
@@ -27,18 +42,119 @@ def evening_shift(date):
 
 
 def get_each_day_in_range(datetime_range):
-    if datetime_range.start.day == datetime_range.end.day:
+    """Split an aware range into one range per local calendar day."""
+    tz = datetime_range.start.tzinfo
+    days = local_days(get_current_timezone())
+    pieces = days.split(to_epoch_us(datetime_range.start), to_epoch_us(datetime_range.end))
+    if len(pieces) < 2:
         return [datetime_range]
-    else:
-        return [
-            Range(start=datetime_range.start,
-                  end=make_aware(dt.combine(datetime_range.start.date(), time.max))),
-            Range(start=make_aware(dt.combine(datetime_range.end.date(), time.min)),
-                  end=datetime_range.end),
-        ]
+    # Every piece but the last ends at the last microsecond of its day.
+    return [Range(start=from_epoch_us(start, tz), end=from_epoch_us(end - (i < len(pieces) - 1), tz))
+            for i, (day, start, end) in enumerate(pieces)]
 
 
 def get_overlap_of_ranges(r1, r2):
     latest_start = max(r1.start, r2.start)
     earliest_end = min(r1.end, r2.end)
-    return round((earliest_end - latest_start).seconds / 60) if earliest_end > latest_start else 0
+    return round(int((earliest_end - latest_start).total_seconds()) / 60) if earliest_end > latest_start else 0
+
+
+def to_epoch_us(value):
+    """Aware datetime to integer microseconds since the epoch, exactly."""
+    if value is not None:
+        return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class UtcOffsets(object):
+    """
+    Callable returning the UTC offset (in microseconds) of a timezone at
+    the given epoch microsecond. pytz transition tables are bisected, so
+    no datetime is built per lookup.
+    """
+    def __init__(self, tz):
+        self.tz = tz
+        transition_times = getattr(tz, '_utc_transition_times', None)
+        if transition_times:
+            self.starts = [calendar.timegm(t.timetuple()) * US_PER_SECOND for t in transition_times]
+            self.offsets = [int(info[0].total_seconds()) * US_PER_SECOND for info in tz._transition_info]
+        elif tz.utcoffset(None) is not None:
+            self.starts = [0]
+            self.offsets = [int(tz.utcoffset(None).total_seconds()) * US_PER_SECOND]
+        else:
+            self.starts = None
+
+    def __call__(self, epoch_us):
+        if self.starts is None:
+            value = EPOCH + timedelta(microseconds=epoch_us)
+            return int(value.astimezone(self.tz).utcoffset().total_seconds()) * US_PER_SECOND
+        return self.offsets[max(bisect_right(self.starts, epoch_us) - 1, 0)]
+
+    def next_change(self, epoch_us):
+        """First offset change after epoch_us, or epoch_us if unknown."""
+        if self.starts is not None:
+            i = bisect_right(self.starts, epoch_us)
+            if i < len(self.starts):
+                return self.starts[i]
+        return epoch_us
+
+
+@lru_cache(maxsize=None)
+def utc_offsets(tz):
+    return UtcOffsets(tz)
+
+
+def from_epoch_us(epoch_us, tz=utc):
+    return (EPOCH + timedelta(microseconds=epoch_us)).astimezone(tz)
+
+
+class LocalDays(object):
+    """
+    Local calendar days of a timezone in integer arithmetic. Day numbers
+    count from 1970-01-01 and times are epoch microseconds, so a range of
+    any length is split without building a datetime per day. Days are
+    taken from the UTC offsets in force, which makes them 23 or 25 hours
+    long around DST changes.
+    """
+    def __init__(self, tz):
+        self.offset = utc_offsets(tz)
+        self.starts = {}
+
+    def local_day(self, epoch_us):
+        return (epoch_us + self.offset(epoch_us)) // US_PER_DAY
+
+    def to_epoch(self, local_us):
+        """
+        Epoch microseconds of a local wall clock time, given in microseconds
+        since 1970-01-01 local. Repeated times map to their first instance,
+        times skipped by a DST change to the change itself.
+        """
+        offsets = {self.offset(local_us - US_PER_DAY), self.offset(local_us + US_PER_DAY)}
+        candidates = [local_us - offset for offset in offsets
+                      if self.offset(local_us - offset) == offset]
+        if candidates:
+            return min(candidates)
+        return self.offset.next_change(local_us - max(offsets))
+
+    def day_start(self, day):
+        start = self.starts.get(day)
+        if start is None:
+            start = self.starts[day] = self.to_epoch(day * US_PER_DAY)
+        return start
+
+    def split(self, start, end):
+        """Half-open [start, end) as (day, start, end) pieces, one per local day."""
+        if end <= start:
+            return [(self.local_day(start), start, end)]
+        pieces = []
+        day, last_day = self.local_day(start), self.local_day(end - 1)
+        while day < last_day:
+            next_start = self.day_start(day + 1)
+            pieces.append((day, start, next_start))
+            day, start = day + 1, next_start
+        pieces.append((day, start, end))
+        return pieces
+
+
+@lru_cache(maxsize=None)
+def local_days(tz):
+    return LocalDays(tz)
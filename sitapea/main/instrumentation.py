@@ -0,0 +1,219 @@
+"""
+Opt-in request instrumentation.
+
+With settings.INSTRUMENTATION_ENABLED, InstrumentationMiddleware times
+every request and counts the queries, their time and the rows fetched on
+the default database. Requests slower than settings.SLOW_REQUEST_MS are
+logged with their SQL. Samples are kept per view name in each worker and
+written to the shared cache every FLUSH_INTERVAL seconds, where the
+metrics view merges the workers into Prometheus summaries.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorDebugWrapper
+
+logger = logging.getLogger(__name__)
+
+SERIES = (
+    ('seconds', 'Request wall time'),
+    ('db_seconds', 'Time spent in database queries'),
+    ('queries', 'Database queries'),
+    ('rows', 'Rows fetched from the database'),
+)
+QUANTILES = (0.5, 0.9, 0.99)
+SAMPLES_PER_VIEW = 1000
+SLOW_LOG_QUERIES = 100
+FLUSH_INTERVAL = 10
+WORKER_TIMEOUT = 300
+WORKERS_KEY = 'main:metrics:workers'
+WORKER_KEY = 'main:metrics:{}'
+
+
+class ProbeCursor(CursorDebugWrapper):
+    """Debug cursor that also reports to a RequestProbe, counting fetched rows."""
+    def __init__(self, cursor, db, probe):
+        super(ProbeCursor, self).__init__(cursor, db)
+        self.probe = probe
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super(ProbeCursor, self).execute(sql, params)
+        finally:
+            self.probe.query(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super(ProbeCursor, self).executemany(sql, param_list)
+        finally:
+            self.probe.query(sql, None, time.perf_counter() - start)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        self.probe.rows += row is not None
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        self.probe.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.probe.rows += len(rows)
+        return rows
+
+
+class RequestProbe(object):
+    """Measures one request from its start until finish()."""
+    def __init__(self):
+        self.queries, self.db_seconds, self.rows = 0, 0.0, 0
+        self.sql = []
+        # A streamed response closed before being read leaves its probe
+        # unfinished; the next one takes over its saved state.
+        self.connection = connection = connections[DEFAULT_DB_ALIAS]
+        stale = connection.__dict__.get('request_probe')
+        self.force_debug_cursor = stale.force_debug_cursor if stale else connection.force_debug_cursor
+        connection.request_probe = self
+        connection.force_debug_cursor = True
+        connection.make_debug_cursor = lambda cursor: ProbeCursor(cursor, connection, self)
+        self.start = time.perf_counter()
+
+    def query(self, sql, params, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        if len(self.sql) < SLOW_LOG_QUERIES:
+            self.sql.append((seconds, sql, params))
+
+    def finish(self, request):
+        seconds = time.perf_counter() - self.start
+        if self.connection.__dict__.get('request_probe') is self:
+            self.connection.force_debug_cursor = self.force_debug_cursor
+            del self.connection.request_probe, self.connection.make_debug_cursor
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        slow = seconds * 1000 >= settings.SLOW_REQUEST_MS
+        metrics.record(view, (seconds, self.db_seconds, self.queries, self.rows), slow)
+        if slow:
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, %d rows\n%s',
+                request.method, request.get_full_path(), view, seconds * 1000, self.queries,
+                self.db_seconds * 1000, self.rows,
+                '\n'.join('  {:.1f} ms: {} {}'.format(query_seconds * 1000, sql, params or '')
+                          for query_seconds, sql, params in self.sql),
+            )
+
+
+class InstrumentationMiddleware(object):
+    def __init__(self):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request._probe = RequestProbe()
+
+    def process_response(self, request, response):
+        probe = getattr(request, '_probe', None)
+        if probe is None:
+            return response
+        del request._probe
+        if response.streaming:
+            # Reports are built while they are sent.
+            response.streaming_content = self.streamed(response.streaming_content, probe, request)
+        else:
+            probe.finish(request)
+        return response
+
+    def streamed(self, content, probe, request):
+        try:
+            for chunk in content:
+                yield chunk
+        finally:
+            probe.finish(request)
+
+
+class Metrics(object):
+    """Samples of this worker by view name."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.flushed = 0
+
+    def record(self, view, values, slow):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {'count': 0, 'slow': 0, 'sums': [0] * len(SERIES),
+                                            'samples': deque(maxlen=SAMPLES_PER_VIEW)}
+            stats['count'] += 1
+            stats['slow'] += slow
+            stats['sums'] = [total + value for total, value in zip(stats['sums'], values)]
+            stats['samples'].append(values)
+        self.flush()
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.flushed < FLUSH_INTERVAL:
+            return
+        with self.lock:
+            self.flushed = now
+            snapshot = {view: dict(stats, samples=list(stats['samples'])) for view, stats in self.views.items()}
+        pid = os.getpid()
+        cache.set(WORKER_KEY.format(pid), snapshot, WORKER_TIMEOUT)
+        workers = cache.get(WORKERS_KEY) or []
+        if pid not in workers:
+            cache.set(WORKERS_KEY, workers + [pid], None)
+
+
+metrics = Metrics()
+
+
+def quantile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def render_metrics():
+    """Prometheus text exposition of the requests of all live workers."""
+    metrics.flush(force=True)
+    workers = cache.get(WORKERS_KEY) or []
+    snapshots = cache.get_many([WORKER_KEY.format(pid) for pid in workers])
+    if len(snapshots) < len(workers):
+        cache.set(WORKERS_KEY, [pid for pid in workers if WORKER_KEY.format(pid) in snapshots], None)
+
+    views = {}
+    for snapshot in snapshots.values():
+        for view, stats in snapshot.items():
+            merged = views.setdefault(view, {'count': 0, 'slow': 0, 'sums': [0] * len(SERIES), 'samples': []})
+            merged['count'] += stats['count']
+            merged['slow'] += stats['slow']
+            merged['sums'] = [total + value for total, value in zip(merged['sums'], stats['sums'])]
+            merged['samples'] += stats['samples']
+
+    lines = []
+    for i, (name, help_text) in enumerate(SERIES):
+        metric = 'sitapea_request_{}'.format(name)
+        lines += ['# HELP {} {}.'.format(metric, help_text), '# TYPE {} summary'.format(metric)]
+        for view, stats in sorted(views.items()):
+            values = sorted(sample[i] for sample in stats['samples'])
+            for q in QUANTILES:
+                lines.append('{}{{view="{}",quantile="{}"}} {}'.format(metric, view, q, quantile(values, q)))
+            lines.append('{}_sum{{view="{}"}} {}'.format(metric, view, stats['sums'][i]))
+            lines.append('{}_count{{view="{}"}} {}'.format(metric, view, stats['count']))
+    lines += ['# HELP sitapea_slow_requests_total Requests slower than SLOW_REQUEST_MS.',
+              '# TYPE sitapea_slow_requests_total counter']
+    lines += ['sitapea_slow_requests_total{{view="{}"}} {}'.format(view, stats['slow'])
+              for view, stats in sorted(views.items())]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from main.helpers import start_of_day
+from main.models import ArchivedCheckIn, CheckIn
+from main.signals import checkin_signals_muted
+
+
+def first_of_month(date, months_back=0):
+    month = date.year * 12 + date.month - 1 - months_back
+    return date.replace(year=month // 12, month=month % 12 + 1, day=1)
+
+
+class Command(BaseCommand):
+    help = ('Moves the check-ins effective before a date (by default the first day of the previous month) '
+            'into the archive table. Reports, the rollup and the summaries keep reading them there; the '
+            'API and the change feed only serve the live table. The current month is never archived.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('before', nargs='?', help='YYYY-MM-DD, exclusive')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        today = timezone.localtime(timezone.now()).date()
+        before = parse_date(options['before']) if options['before'] else first_of_month(today, 1)
+        if before is None:
+            raise CommandError('Bad date: {}'.format(options['before']))
+        if before > first_of_month(today):
+            raise CommandError('Check-ins of the current month can not be archived.')
+
+        pks = CheckIn.objects.filter(effective_timestamp__lt=start_of_day(before))\
+            .order_by('pk').values_list('pk', flat=True)
+        archived = 0
+        while True:
+            chunk = list(pks[:options['batch_size']])
+            if not chunk:
+                break
+            with transaction.atomic(), checkin_signals_muted():
+                # The rows keep their ids and modification times; deleting
+                # them is no change to log or to roll up.
+                ArchivedCheckIn.objects.bulk_create([
+                    ArchivedCheckIn(id=pk, employee_id=employee_id, arrival_timestamp=arrival,
+                                    leaving_timestamp=leaving, effective_timestamp=effective,
+                                    comment=comment, modified=modified)
+                    for pk, employee_id, arrival, leaving, effective, comment, modified
+                    in CheckIn.objects.filter(pk__in=chunk).values_list(
+                        'pk', 'employee_id', 'arrival_timestamp', 'leaving_timestamp', 'effective_timestamp',
+                        'comment', 'modified')
+                ])
+                CheckIn.objects.filter(pk__in=chunk).delete()
+            archived += len(chunk)
+        self.stdout.write('Archived {} check-ins effective before {}.'.format(archived, before))
@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from main.models import CheckInChange
+
+
+class Command(BaseCommand):
+    help = ('Writes the check-in changes after a seq as JSON lines, oldest first. Pass the seq of the last '
+            'line to the next run to get only what changed since.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('after', nargs='?', type=int, default=0, help='Last seq already seen')
+        parser.add_argument('--limit', type=int, help='At most this many changes')
+
+    def handle(self, *args, **options):
+        changes = CheckInChange.objects.after(options['after'])
+        if options['limit']:
+            changes = changes[:options['limit']]
+        for change in changes.iterator():
+            self.stdout.write(json.dumps(dict(zip(CheckInChange.FEED_FIELDS, change.feed_row())),
+                                         ensure_ascii=False))
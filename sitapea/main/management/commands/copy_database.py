@@ -0,0 +1,104 @@
+import hashlib
+from contextlib import contextmanager
+from itertools import islice
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers import sort_dependencies
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+SOURCE_ALIAS = 'copy_source'
+
+
+def copied_models():
+    """Every concrete model, each after the ones it references, then the m2m tables."""
+    app_list = [(app_config, None) for app_config in apps.get_app_configs() if app_config.models_module]
+    models = [model for model in sort_dependencies(app_list)
+              if model._meta.managed and not model._meta.proxy]
+    through = [field.remote_field.through for model in models for field in model._meta.local_many_to_many
+               if field.remote_field.through._meta.auto_created]
+    return models + through
+
+
+@contextmanager
+def raw_timestamps(model):
+    # bulk_create() would stamp auto_now fields with the current time.
+    fields = [field for field in model._meta.local_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def table_checksum(model, using):
+    digest = hashlib.md5()
+    count = 0
+    fields = [field.attname for field in model._meta.concrete_fields]
+    rows = model._base_manager.using(using).order_by('pk').values_list(*fields).iterator()
+    for row in rows:
+        digest.update(repr(tuple(str(value) for value in row)).encode('utf-8'))
+        count += 1
+    return count, digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = ('Copies every table from a source database (an alias or the path of an SQLite file) into the '
+            'target database, e.g. from the SQLite file into PostgreSQL. The target must be migrated; its '
+            'data is flushed first. Rows keep their primary keys. Afterwards the tables are compared.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Database alias or SQLite file path')
+        parser.add_argument('--target', default=DEFAULT_DB_ALIAS, help='Target database alias')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--verify-only', action='store_true', help='Only compare the two databases')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', default=True)
+
+    def handle(self, *args, **options):
+        source, target = options['source'], options['target']
+        if source not in connections.databases:
+            connections.databases[SOURCE_ALIAS] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': source}
+            connections.ensure_defaults(SOURCE_ALIAS)
+            source = SOURCE_ALIAS
+        if source == target or target not in connections.databases:
+            raise CommandError('Bad target database: {}'.format(target))
+        models = copied_models()
+
+        if not options['verify_only']:
+            if options['interactive'] and input(
+                    'All data in the "{}" database will be replaced. Type "yes" to continue: '.format(target)) != 'yes':
+                raise CommandError('Cancelled.')
+            # post_migrate would recreate content types and permissions
+            # that are about to be copied with their keys.
+            call_command('flush', database=target, interactive=False, inhibit_post_migrate=True, verbosity=0)
+            for model in models:
+                copied = self.copy_table(model, source, target, options['batch_size'])
+                self.stdout.write('{}: {} rows'.format(model._meta.label, copied))
+            with connections[target].cursor() as cursor:
+                for sql in connections[target].ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+        mismatched = [model._meta.label for model in models
+                      if table_checksum(model, source) != table_checksum(model, target)]
+        if mismatched:
+            raise CommandError('Tables differ: {}'.format(', '.join(mismatched)))
+        self.stdout.write('All {} tables match.'.format(len(models)))
+
+    def copy_table(self, model, source, target, batch_size):
+        rows = model._base_manager.using(source).order_by('pk').iterator()
+        copied = 0
+        with raw_timestamps(model):
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic(using=target):
+                    model._base_manager.using(target).bulk_create(batch)
+                copied += len(batch)
+        return copied
@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.views import BATCH_REPORTS_MAX, parse_report_specs, write_batch_archive
+
+
+def year_reports(year):
+    months = [datetime.date(year, month, 1) for month in range(1, 13)] + [datetime.date(year + 1, 1, 1)]
+    reports = ['summary:{}:{}'.format(date_from, date_to) for date_from, date_to in zip(months, months[1:])]
+    reports.append('detailed:{}:{}'.format(months[0], months[-1]))
+    return reports
+
+
+class Command(BaseCommand):
+    help = ('Writes several reports into one ZIP from a single pass over the data. Reports are given as '
+            'kind:YYYY-MM-DD:YYYY-MM-DD with kind one of detailed, summary, wo_night_shift.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('reports', nargs='*', metavar='report')
+        parser.add_argument('--year', type=int,
+                            help='Adds the 12 monthly summary reports and the detailed report of the year')
+        parser.add_argument('--output', required=True, help='ZIP file to write')
+
+    def handle(self, *args, **options):
+        specs = options['reports'] + (year_reports(options['year']) if options['year'] else [])
+        try:
+            reports = parse_report_specs(specs)
+        except ValueError as e:
+            raise CommandError(e)
+        if not reports:
+            raise CommandError('No reports given.')
+        if len(reports) > BATCH_REPORTS_MAX:
+            raise CommandError('At most {} reports at once.'.format(BATCH_REPORTS_MAX))
+
+        with open(options['output'], 'wb') as fileobj:
+            write_batch_archive(fileobj, reports)
+        self.stdout.write('Wrote {} reports to {}.'.format(len(reports), options['output']))
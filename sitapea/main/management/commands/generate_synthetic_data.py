@@ -0,0 +1,88 @@
+import datetime
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from main.models import CheckIn, DailyWorktime, Department, Employee
+from main.timesheets import invalidate_timesheets
+
+SURNAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Михайлов',
+            'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров', 'Павлов')
+NAMES = ('Иван', 'Пётр', 'Сидор', 'Алексей', 'Сергей', 'Андрей', 'Дмитрий', 'Михаил', 'Николай', 'Олег')
+PATRONYMS = ('Иванович', 'Петрович', 'Сергеевич', 'Андреевич', 'Николаевич', 'Олегович', None)
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic departments, employees and check-ins, including overnight '
+            'shifts, missing arrivals and missing leavings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departments', type=int, default=10)
+        parser.add_argument('--employees', type=int, default=200)
+        parser.add_argument('--days', type=int, default=365, help='Days of check-ins up to yesterday')
+        parser.add_argument('--night-share', type=float, default=0.15, help='Share of overnight shifts')
+        parser.add_argument('--missing-share', type=float, default=0.02,
+                            help='Share of shifts without an arrival, and separately without a leaving')
+        parser.add_argument('--code-start', type=int, default=100000, help='First employee code')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            departments = [Department.objects.create(name='Отдел {}'.format(i), acronym='О{}'.format(i))
+                           for i in range(1, options['departments'] + 1)]
+
+            # SQLite does not return the keys of bulk inserted rows.
+            last_pk = Employee.objects.aggregate(Max('pk'))['pk__max'] or 0
+            Employee.objects.bulk_create([
+                Employee(surname=rng.choice(SURNAMES), name=rng.choice(NAMES), patronym=rng.choice(PATRONYMS),
+                         code=str(code), department=rng.choice(departments))
+                for code in range(options['code_start'], options['code_start'] + options['employees'])
+            ])
+            employee_ids = list(Employee.objects.filter(pk__gt=last_pk).values_list('pk', flat=True))
+
+            checkins = 0
+            batch = []
+            for checkin in self.checkins(rng, employee_ids, options):
+                batch.append(checkin)
+                if len(batch) == 5000:
+                    CheckIn.objects.bulk_create(batch)
+                    checkins += len(batch)
+                    batch = []
+            CheckIn.objects.bulk_create(batch)
+            checkins += len(batch)
+            DailyWorktime.objects.rebuild()
+        invalidate_timesheets()
+
+        self.stdout.write('Created {} departments, {} employees and {} check-ins.'.format(
+            len(departments), len(employee_ids), checkins))
+
+    def checkins(self, rng, employee_ids, options):
+        today = timezone.localtime(timezone.now()).date()
+        for days_ago in range(options['days'], 0, -1):
+            date = today - datetime.timedelta(days=days_ago)
+            for employee_id in employee_ids:
+                if date.weekday() >= 5 and rng.random() < 0.8:
+                    continue
+                if rng.random() < options['night_share']:
+                    arrival = datetime.datetime.combine(date, datetime.time(20)) + rand_minutes(rng, 120)
+                    leaving = arrival + datetime.timedelta(hours=10) + rand_minutes(rng, 90)
+                else:
+                    arrival = datetime.datetime.combine(date, datetime.time(8)) + rand_minutes(rng, 120)
+                    leaving = arrival + datetime.timedelta(hours=8) + rand_minutes(rng, 180)
+                arrival, leaving = timezone.make_aware(arrival), timezone.make_aware(leaving)
+                missing = rng.random()
+                if missing < options['missing_share']:
+                    arrival = None
+                elif missing < 2 * options['missing_share']:
+                    leaving = None
+                # bulk_create() skips save(), which keeps effective_timestamp.
+                yield CheckIn(employee_id=employee_id, arrival_timestamp=arrival, leaving_timestamp=leaving,
+                              effective_timestamp=arrival or leaving)
+
+
+def rand_minutes(rng, limit):
+    return datetime.timedelta(minutes=rng.randrange(limit))
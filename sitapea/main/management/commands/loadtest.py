@@ -0,0 +1,141 @@
+import datetime
+import http.client
+import json
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.instrumentation import quantile
+from main.models import Employee
+
+
+def connect(url):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.hostname, parts.port, timeout=60)
+
+
+class Command(BaseCommand):
+    help = ('Posts kiosk taps from concurrent clients to a running server, first alone and then while other '
+            'clients keep requesting a report, and compares the tap latencies. The taps are real: run it '
+            'against a development database. With the deployment profile, point --kiosk-url and '
+            '--report-url at the two pools, e.g. runserver on ports 8000 and 8001.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kiosk-url', default='http://localhost:8000')
+        parser.add_argument('--report-url', help='Server of the report requests, by default --kiosk-url')
+        parser.add_argument('--report-path', help='Report request, by default the check-ins of the last year '
+                                                  'from the CSV API')
+        parser.add_argument('--kiosks', type=int, default=10, help='Concurrent kiosk clients')
+        parser.add_argument('--taps', type=int, default=20, help='Taps of each kiosk client per phase')
+        parser.add_argument('--report-clients', type=int, default=2, help='Concurrent report clients')
+        parser.add_argument('--max-slowdown', type=float,
+                            help='Fail when the p95 tap latency under report load exceeds this many times the '
+                                 'one without')
+
+    def handle(self, *args, **options):
+        codes = list(Employee.objects.order_by('pk').values_list('code', flat=True)[:options['kiosks']])
+        if not codes:
+            raise CommandError('No employees to tap as, see the generate_synthetic_data command.')
+        report_path = options['report_path']
+        if not report_path:
+            today = timezone.localtime(timezone.now()).date()
+            report_path = '/api/checkins.csv?date_from={}&date_to={}'.format(
+                today - datetime.timedelta(days=365), today + datetime.timedelta(days=1))
+
+        alone = self.run_taps(options['kiosk_url'], codes, options)
+        self.write_phase('Taps alone', alone)
+
+        stop = threading.Event()
+        reports = []
+        report_threads = [threading.Thread(target=self.request_reports,
+                                           args=(options['report_url'] or options['kiosk_url'], report_path,
+                                                 stop, reports))
+                          for _ in range(options['report_clients'])]
+        for thread in report_threads:
+            thread.start()
+        try:
+            loaded = self.run_taps(options['kiosk_url'], codes, options)
+        finally:
+            stop.set()
+            for thread in report_threads:
+                thread.join()
+        self.write_phase('Taps under report load', loaded)
+        if reports:
+            self.stdout.write('Reports: {} in {:.0f} ms median, {} failed'.format(
+                len(reports), quantile(sorted(seconds for seconds, ok in reports), 0.5) * 1000,
+                sum(not ok for seconds, ok in reports)))
+
+        slowdown = quantile(loaded['latencies'], 0.95) / quantile(alone['latencies'], 0.95)
+        self.stdout.write('p95 slowdown under report load: {:.2f}x'.format(slowdown))
+        if options['max_slowdown'] and slowdown > options['max_slowdown']:
+            raise CommandError('Report load slowed taps down {:.2f}x, more than {}x'.format(
+                slowdown, options['max_slowdown']))
+
+    def run_taps(self, url, codes, options):
+        latencies, errors = [], []
+        threads = [threading.Thread(target=self.tap, args=(url, codes[i % len(codes)], options['taps'],
+                                                           latencies, errors))
+                   for i in range(options['kiosks'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not latencies:
+            raise CommandError('No tap succeeded: {}'.format(errors[0] if errors else 'no taps'))
+        return {'latencies': sorted(latencies), 'errors': errors}
+
+    def tap(self, url, code, taps, latencies, errors):
+        # One connection per kiosk, kept open between taps like the page does.
+        connection = connect(url)
+        try:
+            for i in range(taps):
+                body = json.dumps({'events': [{
+                    'id': 'loadtest-{}'.format(uuid.uuid4().hex),
+                    'code': code,
+                    'action': 'arrival' if i % 2 == 0 else 'leaving',
+                    'timestamp': int(time.time() * 1000),
+                }]})
+                start = time.perf_counter()
+                try:
+                    connection.request('POST', '/checkin/batch/', body, {'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    errors.append(str(e))
+                    continue
+                if response.status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors.append('HTTP {}'.format(response.status))
+        finally:
+            connection.close()
+
+    def request_reports(self, url, path, stop, reports):
+        connection = connect(url)
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    reports.append((time.perf_counter() - start, False))
+                    stop.wait(0.1)
+                    continue
+                reports.append((time.perf_counter() - start, response.status == 200))
+        finally:
+            connection.close()
+
+    def write_phase(self, title, phase):
+        latencies = phase['latencies']
+        self.stdout.write('{}: {} taps, p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms, {} failed'.format(
+            title, len(latencies), *[quantile(latencies, q) * 1000 for q in (0.5, 0.95, 0.99)],
+            latencies[-1] * 1000, len(phase['errors'])))
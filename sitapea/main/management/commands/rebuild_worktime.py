@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.models import DailyWorktime
+from main.timesheets import invalidate_timesheets
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily worktime rollup from check-ins, for all dates or for [date_from, date_to).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('date_from', nargs='?', help='YYYY-MM-DD, inclusive')
+        parser.add_argument('date_to', nargs='?', help='YYYY-MM-DD, exclusive')
+
+    def handle(self, *args, **options):
+        days = DailyWorktime.objects.rebuild(options['date_from'], options['date_to'])
+        invalidate_timesheets()
+        self.stdout.write('Rebuilt {} employee days.'.format(days))
@@ -0,0 +1,33 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.reports import work
+
+
+class Command(BaseCommand):
+    help = 'Builds queued reports in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue polls')
+        parser.add_argument('--once', action='store_true', help='Build the queued reports in this process and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            work(once=True)
+            return
+
+        # Forked workers must open database connections of their own.
+        connections.close_all()
+        processes = [multiprocessing.Process(target=work, args=(options['poll_interval'], ))
+                     for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
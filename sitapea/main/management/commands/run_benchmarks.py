@@ -0,0 +1,113 @@
+import datetime
+import json
+import random
+import statistics
+import tempfile
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.models import CheckIn, Department, Employee
+from main.views import REPORT_VIEWS
+from main.xlsx import save_workbook
+
+REPORT_WINDOWS = (
+    ('day', 1),
+    ('month', 30),
+    ('year', 365),
+)
+
+
+def measure(function, runs):
+    timings, queries = [], []
+    for run in range(runs):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            function(run)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context))
+    return {
+        'runs': runs,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Times and counts the queries of the kiosk check-in, get_last_checkin, the report builds and the '
+            'CheckIn changelist, and writes the results as JSON. Every write is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20, help='Runs of the fast benchmarks')
+        parser.add_argument('--report-runs', type=int, default=3, help='Runs of each report build')
+        parser.add_argument('--label', default='', help='Stored with the results, e.g. a version')
+        parser.add_argument('--output', help='File for the JSON results instead of stdout')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not CheckIn.objects.exists():
+            raise CommandError('No check-ins to benchmark, see the generate_synthetic_data command.')
+
+        with transaction.atomic():
+            results = self.run_benchmarks(random.Random(options['seed']), options['runs'], options['report_runs'])
+            transaction.set_rollback(True)
+
+        output = json.dumps({
+            'label': options['label'],
+            'created': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': {
+                'departments': Department.objects.count(),
+                'employees': Employee.objects.count(),
+                'checkins': CheckIn.objects.count(),
+            },
+            'results': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_benchmarks(self, rng, runs, report_runs):
+        results = {}
+        employees = list(Employee.objects.order_by('?').values_list('pk', 'code')[:runs])
+        employees = [employees[i % len(employees)] for i in range(runs)]
+        client = Client()
+
+        def tap(action):
+            def run(i):
+                url = reverse('checkin-view', kwargs={'code': employees[i][1], 'action': action})
+                client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            return run
+        results['checkin_arrival'] = measure(tap('arrival'), runs)
+        results['checkin_leaving'] = measure(tap('leaving'), runs)
+        results['get_last_checkin'] = measure(lambda i: Employee(pk=employees[i][0]).get_last_checkin(), runs)
+
+        last_date = timezone.localtime(CheckIn.objects.aggregate(Max('effective_timestamp'))
+                                       ['effective_timestamp__max']).date()
+        date_to = last_date + datetime.timedelta(days=1)
+        for window, days in REPORT_WINDOWS:
+            date_from = str(date_to - datetime.timedelta(days=days))
+            for kind, view in sorted(REPORT_VIEWS.items()):
+                def build(i):
+                    with tempfile.TemporaryFile() as fileobj:
+                        save_workbook(view().build_workbook(date_from, str(date_to)), fileobj)
+                results['report_{}_{}'.format(kind, window)] = measure(build, report_runs)
+
+        user = User.objects.create_superuser('benchmark', 'benchmark@example.com', None)
+        client.force_login(user)
+        url = reverse('admin:main_checkin_changelist')
+        results['admin_checkin_changelist'] = measure(lambda i: client.get(url), runs)
+        return results
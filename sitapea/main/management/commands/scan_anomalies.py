@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from main.anomalies import scan_anomalies
+from main.models import CheckInAnomaly
+
+
+class Command(BaseCommand):
+    help = ('Flags check-ins missing their arrival or leaving, overlapping the previous one or longer than '
+            'the workday limit. Only what changed since the last scan is rechecked, unless --full.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rescan all check-ins')
+
+    def handle(self, *args, **options):
+        scan = scan_anomalies(full=options['full'])
+        self.stdout.write('Scanned up to change {}{}: {} anomalies found, {} in total.'.format(
+            scan.seq, '' if scan.employees is None else ' ({} employees)'.format(scan.employees),
+            scan.found, CheckInAnomaly.objects.count()))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.roster import RosterError, read_roster, sync_roster
+
+
+class Command(BaseCommand):
+    help = ('Creates and updates employees from a CSV or XLSX roster with code, surname, name, patronym and '
+            'department columns. Employees missing from the roster are reported, not deleted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help='Path of a .csv or .xlsx file')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without applying them')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['roster'], 'rb') as f:
+                summary = sync_roster(read_roster(f, options['roster']), dry_run=options['dry_run'])
+        except (OSError, RosterError) as e:
+            raise CommandError(e)
+        for line, error in summary.errors:
+            self.stderr.write('Line {}: {}'.format(line, error))
+        self.stdout.write(
+            '{}Created {s.created}, updated {s.updated} ({s.moved} moved to another department), unchanged '
+            '{s.unchanged} employees; created {s.departments_created} departments. {s.missing} employees are '
+            'not in the roster, {errors} rows skipped.'.format('Dry run. ' if options['dry_run'] else '',
+                                                               s=summary, errors=len(summary.errors)))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 14:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_effective_timestamp(apps, schema_editor):
+    CheckIn = apps.get_model('main', 'CheckIn')
+    CheckIn.objects.using(schema_editor.connection.alias).update(effective_timestamp=Coalesce('arrival_timestamp', 'leaving_timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkin',
+            name='effective_timestamp',
+            field=models.DateTimeField(db_index=True, editable=False, null=True, verbose_name='Время отметки'),
+        ),
+        migrations.RunPython(backfill_effective_timestamp, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='checkin',
+            index_together=set([('employee', 'effective_timestamp')]),
+        ),
+    ]
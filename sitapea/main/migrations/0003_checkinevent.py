@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 14:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_checkin_effective_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckInEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True, verbose_name='Идентификатор события')),
+                ('code', models.CharField(max_length=20, verbose_name='Код сотрудника')),
+                ('action', models.CharField(max_length=20, verbose_name='Действие')),
+                ('timestamp', models.DateTimeField(verbose_name='Время на киоске')),
+                ('result', models.TextField(verbose_name='Результат')),
+                ('received', models.DateTimeField(auto_now_add=True, verbose_name='Получено')),
+            ],
+            options={
+                'verbose_name': 'Событие киоска',
+                'verbose_name_plural': 'События киоска',
+            },
+        ),
+    ]
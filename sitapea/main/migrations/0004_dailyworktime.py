@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 14:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_checkinevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWorktime',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Дата')),
+                ('raw_minutes', models.IntegerField(verbose_name='Отработано минут')),
+                ('dinners_minutes', models.IntegerField(verbose_name='Обеды')),
+                ('coffee_minutes', models.IntegerField(verbose_name='Перерывы')),
+                ('night_minutes', models.IntegerField(verbose_name='Ночных минут')),
+                ('night_bonus_minutes', models.IntegerField(verbose_name='Бонус за ночную смену')),
+                ('net_minutes', models.IntegerField(verbose_name='Чистая разница')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Employee')),
+            ],
+            options={
+                'verbose_name': 'Рабочее время за день',
+                'verbose_name_plural': 'Рабочее время по дням',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyworktime',
+            unique_together=set([('employee', 'date')]),
+        ),
+        # Filled by the rebuild_worktime command rather than here: the
+        # rules of the rollup live in the app code and change over time.
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 15:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_dailyworktime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('detailed', 'Отчёт'), ('summary', 'Суммарный отчёт'), ('wo_night_shift', 'Суммарный отчёт без учета ночных бонусов')], max_length=20, verbose_name='Тип отчёта')),
+                ('date_from', models.CharField(max_length=10, verbose_name='Начало периода')),
+                ('date_to', models.CharField(blank=True, max_length=10, verbose_name='Конец периода')),
+                ('data_version', models.CharField(max_length=32, verbose_name='Версия данных')),
+                ('name', models.CharField(max_length=100, verbose_name='Имя файла')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Формируется'), ('done', 'Готов'), ('failed', 'Ошибка')], db_index=True, default='pending', max_length=10, verbose_name='Состояние')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Начат')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершён')),
+            ],
+            options={
+                'verbose_name': 'Отчёт',
+                'verbose_name_plural': 'Отчёты',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='reportjob',
+            unique_together=set([('kind', 'date_from', 'date_to', 'data_version')]),
+        ),
+        migrations.AddField(
+            model_name='checkin',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменено'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменено'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменено'),
+            preserve_default=False,
+        ),
+    ]
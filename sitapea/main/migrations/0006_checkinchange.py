@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def log_existing_checkins(apps, schema_editor):
+    # Existing check-ins enter the log as created, so that a consumer
+    # starting from seq 0 gets the whole history.
+    CheckIn = apps.get_model('main', 'CheckIn')
+    CheckInChange = apps.get_model('main', 'CheckInChange')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for checkin in CheckIn.objects.using(db_alias).order_by('pk').iterator():
+        batch.append(CheckInChange(checkin_id=checkin.pk, employee_id=checkin.employee_id, action='created',
+                                   arrival_timestamp=checkin.arrival_timestamp,
+                                   leaving_timestamp=checkin.leaving_timestamp, comment=checkin.comment))
+        if len(batch) == 5000:
+            CheckInChange.objects.using(db_alias).bulk_create(batch)
+            batch = []
+    CheckInChange.objects.using(db_alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckInChange',
+            fields=[
+                ('seq', models.AutoField(primary_key=True, serialize=False, verbose_name='Номер')),
+                ('checkin_id', models.IntegerField(db_index=True, verbose_name='Отметка')),
+                ('employee_id', models.IntegerField(verbose_name='Сотрудник')),
+                ('action', models.CharField(choices=[('created', 'Создана'), ('updated', 'Изменена'), ('deleted', 'Удалена')], max_length=10, verbose_name='Действие')),
+                ('arrival_timestamp', models.DateTimeField(null=True, verbose_name='Время прибытия')),
+                ('leaving_timestamp', models.DateTimeField(null=True, verbose_name='Время ухода')),
+                ('comment', models.TextField(null=True, verbose_name='Комментарий')),
+                ('author', models.CharField(blank=True, max_length=150, verbose_name='Автор')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Время изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение отметки',
+                'verbose_name_plural': 'Изменения отметок',
+            },
+        ),
+        migrations.RunPython(log_existing_checkins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_checkinchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCheckIn',
+            fields=[
+                ('arrival_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='Время прибытия')),
+                ('leaving_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='Время ухода')),
+                ('effective_timestamp', models.DateTimeField(db_index=True, editable=False, null=True, verbose_name='Время отметки')),
+                ('comment', models.TextField(blank=True, null=True, verbose_name='Комментарий')),
+                ('id', models.IntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('modified', models.DateTimeField(verbose_name='Изменено')),
+                ('archived', models.DateTimeField(auto_now_add=True, verbose_name='Перенесено в архив')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Employee')),
+            ],
+            options={
+                'verbose_name': 'Архивная отметка',
+                'verbose_name_plural': 'Архивные отметки',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedcheckin',
+            index_together=set([('employee', 'effective_timestamp')]),
+        ),
+    ]
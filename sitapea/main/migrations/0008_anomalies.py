@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_archivedcheckin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalyScan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.IntegerField(verbose_name='Последнее изменение')),
+                ('horizon', models.DateTimeField(verbose_name='Граница незакрытых отметок')),
+                ('employees', models.IntegerField(null=True, verbose_name='Проверено сотрудников')),
+                ('found', models.IntegerField(verbose_name='Найдено ошибок')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Время проверки')),
+            ],
+            options={
+                'verbose_name': 'Проверка отметок',
+                'verbose_name_plural': 'Проверки отметок',
+            },
+        ),
+        migrations.CreateModel(
+            name='CheckInAnomaly',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkin_id', models.IntegerField(db_index=True, verbose_name='Отметка')),
+                ('kind', models.CharField(choices=[('missing_arrival', 'Нет прихода'), ('missing_leaving', 'Нет ухода'), ('overlap', 'Пересекается с предыдущей'), ('overlong', 'Слишком длинная смена')], max_length=20, verbose_name='Ошибка')),
+                ('effective_timestamp', models.DateTimeField(db_index=True, verbose_name='Время отметки')),
+                ('related_checkin_id', models.IntegerField(blank=True, db_index=True, null=True, verbose_name='Предыдущая отметка')),
+                ('found', models.DateTimeField(auto_now_add=True, verbose_name='Обнаружено')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Employee')),
+            ],
+            options={
+                'verbose_name': 'Ошибка отметки',
+                'verbose_name_plural': 'Ошибки отметок',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='checkinanomaly',
+            unique_together=set([('checkin_id', 'kind')]),
+        ),
+    ]
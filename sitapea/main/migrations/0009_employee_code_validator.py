@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_anomalies'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='employee',
+            name='code',
+            field=models.CharField(max_length=20, unique=True, validators=[django.core.validators.RegexValidator('^\\d{1,6}$', 'Код сотрудника — от 1 до 6 цифр')], verbose_name='Код сотрудника'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_employee_code_validator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='specs',
+            field=models.TextField(blank=True, default='', verbose_name='Отчёты архива'),
+        ),
+        migrations.AlterField(
+            model_name='reportjob',
+            name='kind',
+            field=models.CharField(choices=[('detailed', 'Отчёт'), ('summary', 'Суммарный отчёт'), ('wo_night_shift', 'Суммарный отчёт без учета ночных бонусов'), ('batch', 'Архив отчётов')], max_length=20, verbose_name='Тип отчёта'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reportjob',
+            unique_together=set([('kind', 'date_from', 'date_to', 'specs', 'data_version')]),
+        ),
+    ]
@@ -1,15 +1,29 @@
 import datetime
-from itertools import chain
+import hashlib
+import heapq
+import os
+from collections import namedtuple
+from itertools import chain, groupby, islice
+from operator import itemgetter
 
-from django.db import models
-from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.validators import RegexValidator
+from django.db import connections, models, router, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.signals import post_save
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from main.helpers import (minutes_to_hhmm, Range, morning_shift, evening_shift,
-                          get_each_day_in_range, get_overlap_of_ranges)
+from main.helpers import minutes_to_hhmm, Range, start_of_day, to_epoch_us
+from main.shiftmath import daily_totals, shift_columns, shift_rows
+from main.workrules import get_work_rules
 
 WORKDAY_MAX_DURATION = datetime.timedelta(minutes=26*60)
 
+# The kiosk PIN pad only types digits, at most six of them.
+validate_employee_code = RegexValidator(r'^\d{1,6}$', 'Код сотрудника — от 1 до 6 цифр')
+
 
 class Department(models.Model):
     class Meta:
@@ -18,6 +32,7 @@ class Department(models.Model):
 
     name = models.CharField('Название', max_length=100)
     acronym = models.CharField('Сокращенно', max_length=20)
+    modified = models.DateTimeField('Изменено', auto_now=True)
 
     def __str__(self):
         return self.name
@@ -31,80 +46,140 @@ class Employee(models.Model):
     surname = models.CharField('Фамилия', max_length=50)
     name = models.CharField('Имя', max_length=50)
     patronym = models.CharField('Отчество', max_length=50, null=True, blank=True)
-    code = models.CharField('Код сотрудника', max_length=20, unique=True)
+    code = models.CharField('Код сотрудника', max_length=20, unique=True, validators=[validate_employee_code])
     department = models.ForeignKey(Department)
+    modified = models.DateTimeField('Изменено', auto_now=True)
 
     def __str__(self):
         return '{} {} {}'.format(self.surname, self.name, self.patronym)
 
     def get_last_checkin(self):
-        last_checkin = self.checkin_set\
-            .annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp'))\
-            .order_by('-arrival_or_leaving')[:1]
+        last_checkin = self.checkin_set.order_by('-effective_timestamp')[:1]
         if last_checkin:
             return last_checkin[0]
 
-    def arrive(self):
-        leaving = self.get_last_checkin()
-        self.checkin_set.create(arrival_timestamp=timezone.now())
-        if not leaving.leaving_timestamp:
+    def lock(self):
+        # Serializes the taps of one employee on backends with row locks.
+        # SQLite takes its database-wide write lock at the first write of
+        # the transaction instead, see arrive() and leave().
+        connection = connections[router.db_for_write(Employee)]
+        if connection.features.has_select_for_update:
+            list(Employee.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+
+    def arrive(self, now=None):
+        now = now or timezone.now()
+        with transaction.atomic():
+            self.lock()
+            arrival = self.checkin_set.create(arrival_timestamp=now)
+            # A queued tap may come after later ones: look at the check-in
+            # before it, not at the newest one.
+            leaving = self.checkin_set.exclude(pk=arrival.pk).filter(effective_timestamp__lte=now)\
+                .order_by('-effective_timestamp').first()
+        if leaving and not leaving.leaving_timestamp:
             raise ValueError('forgot_to_leave')
 
-    def leave(self):
-        arrival = self.get_last_checkin()
-        if not arrival.leaving_timestamp and \
-                ((arrival.arrival_timestamp - timezone.now()) < WORKDAY_MAX_DURATION):
-            arrival.leaving_timestamp = timezone.now()
-            arrival.save()
-        else:
-            self.checkin_set.create(leaving_timestamp=timezone.now())
+    def leave(self, now=None):
+        now = now or timezone.now()
+        with transaction.atomic():
+            self.lock()
+            closed = self.checkin_set.close_last(now)
+            if not closed:
+                self.checkin_set.create(leaving_timestamp=now)
+        if not closed:
             raise ValueError('forgot_to_leave_and_arrive')
-        if not arrival.arrival_timestamp:
-            raise ValueError('forgot_to_arrive')
+
+    def working_time_in_date_range(self, date_from, date_to):
+        # A period may span check-ins already moved to the archive.
+        times = [checkins.working_time_by_employee(date_from, date_to).get(self.pk, WorkingTime(0, 0))
+                 for checkins in (self.checkin_set, self.archivedcheckin_set)]
+        return WorkingTime(*map(sum, zip(*times)))
 
     def working_hours_summary_in_date_range(self, date_from, date_to):
-        checkin_set = self.checkin_set\
-            .annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp'))\
-            .filter(arrival_timestamp__date__gte=date_from)\
-            .filter(leaving_timestamp__date__lt=date_to)
-        last_nights_checkin_set = self.checkin_set \
-            .annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp')) \
-            .filter(arrival_timestamp__date__lt=date_to)\
-            .filter(leaving_timestamp__date__gte=date_to)
-        checkin_set = list(chain(checkin_set, last_nights_checkin_set))
-        result = 0
-        for checkin in checkin_set:
-            result += checkin.workday_duration if checkin.workday_duration else 0
-        result = minutes_to_hhmm(result)
-        return result
+        return minutes_to_hhmm(self.working_time_in_date_range(date_from, date_to).total)
 
     def working_hours_wo_night_shift_in_date_range(self, date_from, date_to):
-        checkin_set = self.checkin_set\
-            .annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp'))\
-            .filter(arrival_timestamp__date__gte=date_from)\
-            .filter(leaving_timestamp__date__lt=date_to)
-        last_nights_checkin_set = self.checkin_set \
-            .annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp')) \
-            .filter(arrival_timestamp__date__lt=date_to)\
-            .filter(leaving_timestamp__date__gte=date_to)
-        checkin_set = list(chain(checkin_set, last_nights_checkin_set))
-        result = 0
-        for checkin in checkin_set:
-            result += checkin.workday_wo_night_shift_bonus if checkin.workday_wo_night_shift_bonus else 0
-        result = minutes_to_hhmm(result)
+        return minutes_to_hhmm(self.working_time_in_date_range(date_from, date_to).wo_night_shift_bonus)
+
+
+WorkingTime = namedtuple('WorkingTime', ['total', 'wo_night_shift_bonus'])
+
+
+class CheckInQuerySet(models.QuerySet):
+    def in_date_range(self, date_from, date_to):
+        # Finished check-ins arriving inside the range, whenever they end:
+        # a shift counts on its arrival date, as in DailyWorktime, so that
+        # the rollup and the check-ins give the same totals.
+        start, end = start_of_day(date_from), start_of_day(date_to)
+        return self.filter(arrival_timestamp__gte=start, arrival_timestamp__lt=end, leaving_timestamp__isnull=False)
+
+    def effective_in_date_range(self, date_from, date_to=None):
+        start = start_of_day(date_from)
+        end = start_of_day(date_to) if date_to else start_of_day(start.date() + datetime.timedelta(days=1))
+        return self.filter(effective_timestamp__gte=start, effective_timestamp__lt=end)
+
+    def working_time_by_employee(self, date_from, date_to):
+        by_department = get_work_rules().by_department
+        fields = ('employee_id', 'arrival_timestamp', 'leaving_timestamp')
+        rows = list(self.in_date_range(date_from, date_to)
+                    .order_by('employee_id', 'arrival_timestamp')
+                    .values_list(*fields + (('employee__department_id', ) if by_department else ())))
+        employee_ids = [row[0] for row in rows]
+        columns = shift_columns([to_epoch_us(row[1]) for row in rows],
+                                [to_epoch_us(row[2]) for row in rows],
+                                [row[3] for row in rows] if by_department else None)
+        result = {}
+        for employee_id, group in groupby(zip(employee_ids, columns.workday_duration,
+                                              columns.workday_wo_night_shift_bonus),
+                                          key=itemgetter(0)):
+            group = list(group)
+            result[employee_id] = WorkingTime(total=sum(row[1] for row in group),
+                                              wo_night_shift_bonus=sum(row[2] for row in group))
         return result
 
+    def close_last(self, leaving_timestamp):
+        # A single compare-and-set statement: of two racing taps only one
+        # closes the check-in. Being the first write of the transaction it
+        # also takes the SQLite write lock before anything is read. The
+        # last check-in is the one before the leaving, which for a queued
+        # tap need not be the newest.
+        last = self.filter(effective_timestamp__lte=leaving_timestamp).order_by('-effective_timestamp').values('pk')[:1]
+        closed = self.model.objects.filter(
+            pk__in=last,
+            leaving_timestamp__isnull=True,
+            arrival_timestamp__gt=leaving_timestamp - WORKDAY_MAX_DURATION,
+            arrival_timestamp__lte=leaving_timestamp,
+        ).update(leaving_timestamp=leaving_timestamp, modified=timezone.now())
+        if closed and post_save.has_listeners(self.model):
+            checkin = self.filter(leaving_timestamp=leaving_timestamp).order_by('-effective_timestamp').first()
+            post_save.send(sender=self.model, instance=checkin, created=False, raw=False, using=self.db,
+                           update_fields=frozenset(['leaving_timestamp', 'modified']))
+        return bool(closed)
+
+    def iterator_with_shift(self, chunk_size=2000):
+        checkins = self.iterator()
+        while True:
+            chunk = list(islice(checkins, chunk_size))
+            if not chunk:
+                break
+            self.model.prime_shift(chunk)
+            for checkin in chunk:
+                yield checkin
 
-class CheckIn(models.Model):
+
+class CheckInRecord(models.Model):
+    """Fields and shift columns shared by live and archived check-ins."""
     class Meta:
-        verbose_name = 'Отметка'
-        verbose_name_plural = 'Отметки'
+        abstract = True
 
     employee = models.ForeignKey(Employee)
     arrival_timestamp = models.DateTimeField('Время прибытия', null=True, blank=True)
     leaving_timestamp = models.DateTimeField('Время ухода', null=True, blank=True)
+    # Arrival, or leaving if the arrival is missing; kept up to date on save.
+    effective_timestamp = models.DateTimeField('Время отметки', null=True, editable=False, db_index=True)
     comment = models.TextField('Комментарий', null=True, blank=True)
 
+    objects = CheckInQuerySet.as_manager()
+
     def __str__(self):
         return '{} ({} - {})'.format(
             self.employee, self.arrival_timestamp, self.leaving_timestamp
@@ -115,57 +190,495 @@ class CheckIn(models.Model):
         return Range(start=timezone.localtime(self.arrival_timestamp),
                      end=timezone.localtime(self.leaving_timestamp))
 
+    @property
+    def shift(self):
+        key = (self.arrival_timestamp, self.leaving_timestamp)
+        cached = getattr(self, '_shift_cache', None)
+        if cached is None or cached[0] != key:
+            self.prime_shift([self])
+            cached = self._shift_cache
+        return cached[1]
+
+    @staticmethod
+    def prime_shift(checkins):
+        checkins = list(checkins)
+        departments = None
+        if get_work_rules().by_department:
+            departments = [checkin.employee.department_id if checkin.employee_id else None for checkin in checkins]
+        rows = shift_rows([to_epoch_us(checkin.arrival_timestamp) for checkin in checkins],
+                          [to_epoch_us(checkin.leaving_timestamp) for checkin in checkins],
+                          departments)
+        for checkin, row in zip(checkins, rows):
+            checkin._shift_cache = ((checkin.arrival_timestamp, checkin.leaving_timestamp), row)
+
     @property
     def workday_duration_raw(self):
-        if self.leaving_timestamp and self.arrival_timestamp:
-            worktime_timedelta = self.leaving_timestamp - self.arrival_timestamp
-            return int(worktime_timedelta.total_seconds() // 60)
+        return self.shift.workday_duration_raw
 
     @property
     def dinners_duration(self):
-        raw = self.workday_duration_raw
-        if raw:
-            dinners_count = (raw + 7*60) // 12 // 60
-            return dinners_count * 60
+        return self.shift.dinners_duration
 
     @property
     def coffee_duration(self):
-        raw = self.workday_duration_raw
-        if raw:
-            div = raw // (12*60) * 7*60
-            mod = max(raw % (12*60) - 5*60, 0)
-            coffee_breaks_count = (div + mod) // 135
-            return coffee_breaks_count * 15
+        return self.shift.coffee_duration
 
     @property
     def night_shift_minutes(self):
-        result = 0
-        if self.workday_duration_raw and self.arrival_timestamp > timezone.make_aware(datetime.datetime(2017, 1, 1)):
-            for day in get_each_day_in_range(self.working_time_range):
-                assert day.start.day == day.end.day
-                result += get_overlap_of_ranges(day, morning_shift(day.start.date()))
-                result += get_overlap_of_ranges(day, evening_shift(day.start.date()))
-        return result
+        return self.shift.night_shift_minutes
 
     @property
     def night_shift_bonus(self):
-        return int(self.night_shift_minutes * 0.5)
+        return self.shift.night_shift_bonus
 
     @property
     def workday_duration(self):
-        raw = self.workday_duration_raw
-        if raw:
-            return raw - self.dinners_duration - self.coffee_duration + self.night_shift_bonus
-        return 0
+        return self.shift.workday_duration
 
     @property
     def workday_wo_night_shift_bonus(self):
-        raw = self.workday_duration_raw
-        if raw:
-            return raw - self.dinners_duration - self.coffee_duration
-        return 0
+        return self.shift.workday_wo_night_shift_bonus
 
     @property
     def workday_duration_in_hhmm(self):
         if self.workday_duration:
             return minutes_to_hhmm(self.workday_duration)
+
+
+class CheckIn(CheckInRecord):
+    class Meta:
+        verbose_name = 'Отметка'
+        verbose_name_plural = 'Отметки'
+        index_together = [
+            ('employee', 'effective_timestamp'),
+        ]
+
+    modified = models.DateTimeField('Изменено', auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(CheckIn, cls).from_db(db, field_names, values)
+        instance.remember_state()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(CheckIn, self).refresh_from_db(*args, **kwargs)
+        self.remember_state()
+
+    def remember_state(self):
+        self._loaded_state = (self.__dict__.get('employee_id'),
+                              self.__dict__.get('arrival_timestamp'),
+                              self.__dict__.get('leaving_timestamp'))
+
+    def states(self):
+        current = (self.employee_id, self.arrival_timestamp, self.leaving_timestamp)
+        return [current, getattr(self, '_loaded_state', current)]
+
+    def worktime_days(self):
+        """(employee_id, date) rollup days this check-in counts in, now or as loaded."""
+        return {(employee_id, timezone.localtime(arrival).date())
+                for employee_id, arrival, leaving in self.states() if arrival and leaving}
+
+    def timesheet_months(self):
+        """(employee_id, first day of the month) timesheets this check-in shows in, now or as loaded."""
+        return {(employee_id, timezone.localtime(arrival or leaving).date().replace(day=1))
+                for employee_id, arrival, leaving in self.states() if employee_id and (arrival or leaving)}
+
+    def save(self, *args, **kwargs):
+        self.effective_timestamp = self.arrival_timestamp or self.leaving_timestamp
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'effective_timestamp', 'modified'}
+        super(CheckIn, self).save(*args, **kwargs)
+
+
+class ArchivedCheckIn(CheckInRecord):
+    """
+    A check-in of a closed period, moved out of CheckIn by the
+    archive_checkins command with its id and modification time.
+    """
+    class Meta:
+        verbose_name = 'Архивная отметка'
+        verbose_name_plural = 'Архивные отметки'
+        index_together = [
+            ('employee', 'effective_timestamp'),
+        ]
+
+    id = models.IntegerField('ID', primary_key=True)
+    modified = models.DateTimeField('Изменено')
+    archived = models.DateTimeField('Перенесено в архив', auto_now_add=True)
+
+
+def effective_checkins(date_from, date_to=None):
+    """
+    Live and archived check-ins with an effective timestamp in the range,
+    in the order of the detailed report and with their shift columns.
+    """
+    # Both tables come sorted by the collation of the database, which need
+    # not sort names like Python does: they are merged by the position of
+    # the employee in that same order instead of by the names.
+    ranks = {pk: rank for rank, pk in enumerate(Employee.objects.order_by('surname', 'name', 'pk')
+                                                .values_list('pk', flat=True))}
+
+    def key(checkin):
+        return ranks.get(checkin.employee_id, len(ranks)), checkin.employee_id, checkin.effective_timestamp
+
+    return heapq.merge(*[
+        model.objects
+        .effective_in_date_range(date_from, date_to)
+        .order_by('employee__surname', 'employee__name', 'employee_id', 'effective_timestamp')
+        .select_related('employee', 'employee__department')
+        .iterator_with_shift()
+        for model in (CheckIn, ArchivedCheckIn)
+    ], key=key)
+
+
+class CheckInEvent(models.Model):
+    class Meta:
+        verbose_name = 'Событие киоска'
+        verbose_name_plural = 'События киоска'
+
+    event_id = models.CharField('Идентификатор события', max_length=64, unique=True)
+    code = models.CharField('Код сотрудника', max_length=20)
+    action = models.CharField('Действие', max_length=20)
+    timestamp = models.DateTimeField('Время на киоске')
+    result = models.TextField('Результат')
+    received = models.DateTimeField('Получено', auto_now_add=True)
+
+    def __str__(self):
+        return '{} {} {}'.format(self.code, self.action, self.timestamp)
+
+
+# Any fixed number, the key of the PostgreSQL advisory lock of the log.
+CHECKIN_CHANGE_LOCK_ID = 0x5174ea
+
+
+class CheckInChangeQuerySet(models.QuerySet):
+    def record(self, checkin, action, author=''):
+        using = router.db_for_write(self.model)
+        # The lock lasts until the end of the transaction of the change.
+        with transaction.atomic(using=using, savepoint=False):
+            self.lock_log(using)
+            return self.create(checkin_id=checkin.pk, employee_id=checkin.employee_id, action=action,
+                               arrival_timestamp=checkin.arrival_timestamp,
+                               leaving_timestamp=checkin.leaving_timestamp,
+                               comment=checkin.comment, author=author)
+
+    def lock_log(self, using):
+        # Consumers keep the highest seq they have seen, so seqs must become
+        # visible in order: a writer waits for the transaction of the last
+        # one to end before taking its seq. SQLite serializes writers anyway.
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CHECKIN_CHANGE_LOCK_ID])
+        elif connection.vendor != 'sqlite':
+            raise ImproperlyConfigured('The check-in change log needs SQLite or PostgreSQL, not {}'.format(
+                connection.vendor))
+
+    def after(self, seq):
+        return self.filter(seq__gt=seq).order_by('seq')
+
+
+class CheckInChange(models.Model):
+    """
+    Append-only log of check-in saves and deletes, written by signals.
+    Consumers keep the last seq they have seen and read what follows it.
+    Queryset updates and bulk inserts bypass the log.
+    """
+    class Meta:
+        verbose_name = 'Изменение отметки'
+        verbose_name_plural = 'Изменения отметок'
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = (
+        (CREATED, 'Создана'),
+        (UPDATED, 'Изменена'),
+        (DELETED, 'Удалена'),
+    )
+
+    seq = models.AutoField('Номер', primary_key=True)
+    # Plain ids rather than foreign keys: the log outlives deleted rows.
+    checkin_id = models.IntegerField('Отметка', db_index=True)
+    employee_id = models.IntegerField('Сотрудник')
+    action = models.CharField('Действие', max_length=10, choices=ACTIONS)
+    arrival_timestamp = models.DateTimeField('Время прибытия', null=True)
+    leaving_timestamp = models.DateTimeField('Время ухода', null=True)
+    comment = models.TextField('Комментарий', null=True)
+    author = models.CharField('Автор', max_length=150, blank=True)
+    created = models.DateTimeField('Время изменения', auto_now_add=True)
+
+    objects = CheckInChangeQuerySet.as_manager()
+
+    FEED_FIELDS = ('seq', 'action', 'checkin_id', 'employee_id', 'arrival', 'leaving', 'comment', 'author', 'created')
+
+    def __str__(self):
+        return '{} {} {}'.format(self.seq, self.action, self.checkin_id)
+
+    def feed_row(self):
+        return (
+            self.seq,
+            self.action,
+            self.checkin_id,
+            self.employee_id,
+            timezone.localtime(self.arrival_timestamp).isoformat() if self.arrival_timestamp else None,
+            timezone.localtime(self.leaving_timestamp).isoformat() if self.leaving_timestamp else None,
+            self.comment,
+            self.author,
+            timezone.localtime(self.created).isoformat(),
+        )
+
+
+class CheckInAnomaly(models.Model):
+    """A check-in found wrong by main.anomalies.scan_anomalies()."""
+    class Meta:
+        verbose_name = 'Ошибка отметки'
+        verbose_name_plural = 'Ошибки отметок'
+        unique_together = [
+            ('checkin_id', 'kind'),
+        ]
+
+    MISSING_ARRIVAL = 'missing_arrival'
+    MISSING_LEAVING = 'missing_leaving'
+    OVERLAP = 'overlap'
+    OVERLONG = 'overlong'
+    KINDS = (
+        (MISSING_ARRIVAL, 'Нет прихода'),
+        (MISSING_LEAVING, 'Нет ухода'),
+        (OVERLAP, 'Пересекается с предыдущей'),
+        (OVERLONG, 'Слишком длинная смена'),
+    )
+
+    # Live or archived check-in.
+    checkin_id = models.IntegerField('Отметка', db_index=True)
+    employee = models.ForeignKey(Employee)
+    kind = models.CharField('Ошибка', max_length=20, choices=KINDS)
+    effective_timestamp = models.DateTimeField('Время отметки', db_index=True)
+    related_checkin_id = models.IntegerField('Предыдущая отметка', null=True, blank=True, db_index=True)
+    found = models.DateTimeField('Обнаружено', auto_now_add=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.get_kind_display(), self.checkin_id)
+
+
+class AnomalyScan(models.Model):
+    """A run of the anomaly scanner; the last one is where the next starts."""
+    class Meta:
+        verbose_name = 'Проверка отметок'
+        verbose_name_plural = 'Проверки отметок'
+
+    seq = models.IntegerField('Последнее изменение')
+    # Open check-ins arriving before this are missing their leaving.
+    horizon = models.DateTimeField('Граница незакрытых отметок')
+    employees = models.IntegerField('Проверено сотрудников', null=True)
+    found = models.IntegerField('Найдено ошибок')
+    created = models.DateTimeField('Время проверки', auto_now_add=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.created, self.seq)
+
+
+class DailyWorktimeQuerySet(models.QuerySet):
+    def working_time_by_employee(self, date_from, date_to):
+        rows = self.filter(date__gte=date_from, date__lt=date_to)\
+            .order_by()\
+            .values('employee_id')\
+            .annotate(total=Sum('net_minutes'), night_shift_bonus=Sum('night_bonus_minutes'))
+        return {
+            row['employee_id']: WorkingTime(total=row['total'],
+                                            wo_night_shift_bonus=row['total'] - row['night_shift_bonus'])
+            for row in rows
+        }
+
+    def working_time_by_period(self, periods):
+        """
+        working_time_by_employee() of each (date_from, date_to) period, from
+        one scan of their union. Shifts count on their arrival date, like
+        CheckInQuerySet.in_date_range().
+        """
+        periods = [(parse_date(date_from), parse_date(date_to)) for date_from, date_to in periods]
+        totals = [{} for _ in periods]
+        rows = self.filter(date__gte=min(period[0] for period in periods),
+                           date__lt=max(period[1] for period in periods))\
+            .order_by()\
+            .values_list('employee_id', 'date', 'net_minutes', 'night_bonus_minutes')
+        for employee_id, date, net, bonus in rows.iterator():
+            for (date_from, date_to), period_totals in zip(periods, totals):
+                if date_from <= date < date_to:
+                    total, night_shift_bonus = period_totals.get(employee_id, (0, 0))
+                    period_totals[employee_id] = (total + net, night_shift_bonus + bonus)
+        return [
+            {employee_id: WorkingTime(total=total, wo_night_shift_bonus=total - night_shift_bonus)
+             for employee_id, (total, night_shift_bonus) in period_totals.items()}
+            for period_totals in totals
+        ]
+
+    def refresh(self, employee_id, date):
+        sources = [CheckIn]
+        if date < timezone.localtime(timezone.now()).date().replace(day=1):
+            # Only days before the current month may have archived check-ins.
+            sources.append(ArchivedCheckIn)
+        checkins = chain(*[
+            model.objects
+            .filter(employee_id=employee_id,
+                    arrival_timestamp__gte=start_of_day(date),
+                    arrival_timestamp__lt=start_of_day(date + datetime.timedelta(days=1)))
+            .values_list('employee_id', 'arrival_timestamp', 'leaving_timestamp')
+            for model in sources
+        ])
+        departments = None
+        if get_work_rules().by_department:
+            departments = dict(Employee.objects.filter(pk=employee_id).values_list('pk', 'department_id'))
+        values = daily_totals(checkins, departments=departments).get((employee_id, date))
+        days = self.filter(employee_id=employee_id, date=date)
+        if values is None:
+            days.delete()
+        elif not days.update(**values):
+            self.create(employee_id=employee_id, date=date, **values)
+
+    def rebuild(self, date_from=None, date_to=None):
+        tables = [model.objects.filter(arrival_timestamp__isnull=False, leaving_timestamp__isnull=False)
+                  for model in (CheckIn, ArchivedCheckIn)]
+        days = self.all()
+        if date_from:
+            tables = [checkins.filter(arrival_timestamp__gte=start_of_day(date_from)) for checkins in tables]
+            days = days.filter(date__gte=date_from)
+        if date_to:
+            tables = [checkins.filter(arrival_timestamp__lt=start_of_day(date_to)) for checkins in tables]
+            days = days.filter(date__lt=date_to)
+        with transaction.atomic():
+            days.delete()
+            departments = None
+            if get_work_rules().by_department:
+                departments = dict(Employee.objects.values_list('pk', 'department_id'))
+            totals = daily_totals(chain(*[checkins.order_by()
+                                          .values_list('employee_id', 'arrival_timestamp', 'leaving_timestamp')
+                                          .iterator() for checkins in tables]), departments=departments)
+            self.bulk_create([DailyWorktime(employee_id=employee_id, date=date, **values)
+                              for (employee_id, date), values in totals.items()])
+        return len(totals)
+
+
+class DailyWorktime(models.Model):
+    """Check-in minutes of an employee summed by local arrival date."""
+    class Meta:
+        verbose_name = 'Рабочее время за день'
+        verbose_name_plural = 'Рабочее время по дням'
+        unique_together = [
+            ('employee', 'date'),
+        ]
+
+    employee = models.ForeignKey(Employee)
+    date = models.DateField('Дата', db_index=True)
+    raw_minutes = models.IntegerField('Отработано минут')
+    dinners_minutes = models.IntegerField('Обеды')
+    coffee_minutes = models.IntegerField('Перерывы')
+    night_minutes = models.IntegerField('Ночных минут')
+    night_bonus_minutes = models.IntegerField('Бонус за ночную смену')
+    net_minutes = models.IntegerField('Чистая разница')
+
+    objects = DailyWorktimeQuerySet.as_manager()
+
+    def __str__(self):
+        return '{} {}'.format(self.employee, self.date)
+
+
+REPORT_JOB_TIMEOUT = datetime.timedelta(minutes=30)
+
+
+class ReportJobQuerySet(models.QuerySet):
+    def data_state(self, date_from, date_to=None):
+        """(version, time of the last change) of the data of a period."""
+        # Any insert, edit or delete of a check-in of the period, any
+        # change to employees or departments, and any change to the work
+        # rules yields another version.
+        # Deletes change the version only, not the time.
+        versions = [
+            CheckIn.objects.effective_in_date_range(date_from, date_to).aggregate(Count('pk'), Max('modified')),
+            ArchivedCheckIn.objects.effective_in_date_range(date_from, date_to)
+            .aggregate(Count('pk'), Max('modified')),
+            Employee.objects.aggregate(Count('pk'), Max('modified')),
+            Department.objects.aggregate(Count('pk'), Max('modified')),
+        ]
+        state = ';'.join(['{pk__count}:{modified__max}'.format(**version) for version in versions] +
+                         [get_work_rules().digest])
+        modified = [version['modified__max'] for version in versions if version['modified__max']]
+        return hashlib.md5(state.encode('utf-8')).hexdigest(), max(modified) if modified else None
+
+    def data_version(self, date_from, date_to=None):
+        return self.data_state(date_from, date_to)[0]
+
+    def request(self, kind, date_from, date_to, name, specs=''):
+        """The job for the current data of the period, queued if it has no usable artifact."""
+        job, created = self.get_or_create(kind=kind, date_from=date_from, date_to=date_to or '', specs=specs,
+                                          data_version=self.data_version(date_from, date_to),
+                                          defaults={'name': name})
+        if job.status == ReportJob.FAILED or job.status == ReportJob.DONE and not job.artifact_exists():
+            self.filter(pk=job.pk, status=job.status).update(status=ReportJob.PENDING, error='')
+            job.refresh_from_db()
+        return job
+
+    def claim(self):
+        # Compare-and-set, so that of several workers only one takes a job.
+        # Jobs of a worker that died are taken over after REPORT_JOB_TIMEOUT.
+        now = timezone.now()
+        claimable = Q(status=ReportJob.PENDING) | Q(status=ReportJob.RUNNING, started__lt=now - REPORT_JOB_TIMEOUT)
+        for pk in self.filter(claimable).order_by('created').values_list('pk', flat=True)[:10]:
+            if self.filter(claimable, pk=pk).update(status=ReportJob.RUNNING, started=now):
+                return self.get(pk=pk)
+
+
+class ReportJob(models.Model):
+    class Meta:
+        verbose_name = 'Отчёт'
+        verbose_name_plural = 'Отчёты'
+        unique_together = [
+            ('kind', 'date_from', 'date_to', 'specs', 'data_version'),
+        ]
+
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Формируется'),
+        (DONE, 'Готов'),
+        (FAILED, 'Ошибка'),
+    )
+    KINDS = (
+        ('detailed', 'Отчёт'),
+        ('summary', 'Суммарный отчёт'),
+        ('wo_night_shift', 'Суммарный отчёт без учета ночных бонусов'),
+        ('batch', 'Архив отчётов'),
+    )
+
+    kind = models.CharField('Тип отчёта', max_length=20, choices=KINDS)
+    date_from = models.CharField('Начало периода', max_length=10)
+    date_to = models.CharField('Конец периода', max_length=10, blank=True)
+    # The reports of a batch, one kind:date_from:date_to per line; the
+    # period is then their union.
+    specs = models.TextField('Отчёты архива', blank=True, default='')
+    data_version = models.CharField('Версия данных', max_length=32)
+    name = models.CharField('Имя файла', max_length=100)
+    status = models.CharField('Состояние', max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создан', auto_now_add=True)
+    started = models.DateTimeField('Начат', null=True, blank=True)
+    finished = models.DateTimeField('Завершён', null=True, blank=True)
+
+    objects = ReportJobQuerySet.as_manager()
+
+    def __str__(self):
+        return '{} {} {}'.format(self.get_kind_display(), self.date_from, self.date_to)
+
+    @property
+    def artifact_path(self):
+        if self.specs:
+            return os.path.join(settings.REPORTS_ROOT, '{}_{}_{}_{}_{}.zip'.format(
+                self.kind, self.date_from, self.date_to, hashlib.md5(self.specs.encode('utf-8')).hexdigest()[:12],
+                self.data_version))
+        return os.path.join(settings.REPORTS_ROOT, '{}_{}_{}_{}.xlsx'.format(
+            self.kind, self.date_from, self.date_to or self.date_from, self.data_version))
+
+    def artifact_exists(self):
+        return os.path.exists(self.artifact_path)
@@ -0,0 +1,71 @@
+"""
+Background report generation.
+
+The report views only queue a ReportJob. report_worker processes claim the
+jobs, build the workbooks, or the ZIP of a batch, and keep the finished
+files under REPORTS_ROOT, one per report kind, period, batch and data
+version.
+"""
+import os
+import tempfile
+import time
+import traceback
+
+from django.conf import settings
+from django.utils import timezone
+
+from main.models import ReportJob
+from main.views import REPORT_VIEWS, parse_report_specs, write_batch_archive
+from main.xlsx import save_workbook
+
+
+def write_artifact(job, fileobj):
+    if job.specs:
+        write_batch_archive(fileobj, parse_report_specs(job.specs.splitlines()))
+    else:
+        save_workbook(REPORT_VIEWS[job.kind]().build_workbook(job.date_from, job.date_to or None), fileobj)
+
+
+def build_artifact(job):
+    os.makedirs(settings.REPORTS_ROOT, exist_ok=True)
+    fileobj = tempfile.NamedTemporaryFile(dir=settings.REPORTS_ROOT, suffix='.tmp', delete=False)
+    try:
+        with fileobj:
+            write_artifact(job, fileobj)
+        os.replace(fileobj.name, job.artifact_path)
+    except:
+        os.remove(fileobj.name)
+        raise
+
+
+def run_job(job):
+    try:
+        build_artifact(job)
+    except Exception:
+        ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.FAILED, error=traceback.format_exc(),
+                                                   finished=timezone.now())
+        return False
+    ReportJob.objects.filter(pk=job.pk).update(status=ReportJob.DONE, finished=timezone.now())
+
+    # Only finished jobs requested before this one: a job queued since may
+    # be for newer data and still be polled.
+    superseded = ReportJob.objects\
+        .filter(kind=job.kind, date_from=job.date_from, date_to=job.date_to, specs=job.specs,
+                status__in=(ReportJob.DONE, ReportJob.FAILED), created__lt=job.created)\
+        .exclude(data_version=job.data_version)
+    for old_job in superseded:
+        if old_job.artifact_exists():
+            os.remove(old_job.artifact_path)
+        old_job.delete()
+    return True
+
+
+def work(poll_interval=1.0, once=False):
+    while True:
+        job = ReportJob.objects.claim()
+        if job is not None:
+            run_job(job)
+        elif once:
+            return
+        else:
+            time.sleep(poll_interval)
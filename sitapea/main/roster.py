@@ -0,0 +1,157 @@
+"""
+Employee roster import.
+
+A roster is a CSV or XLSX file with a header row and one employee per
+row: code, surname, name, patronym and department (acronym or name).
+Codes must be ones the kiosk can take, see validate_employee_code.
+Rows are read one at a time and applied in chunks, each in its own
+transaction: unknown codes are inserted, known ones updated when they
+differ. Employees missing from the roster are only counted, never
+deleted, since their check-ins would go with them.
+"""
+import csv
+import io
+from collections import namedtuple
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, CharField, IntegerField, Value, When
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from main.cache import employee_cache
+from main.models import Department, Employee, validate_employee_code
+
+ROSTER_COLUMNS = {
+    'code': ('code', 'код', 'код сотрудника'),
+    'surname': ('surname', 'фамилия'),
+    'name': ('name', 'имя'),
+    'patronym': ('patronym', 'отчество'),
+    'department': ('department', 'отдел'),
+    'department_name': ('department_name', 'название отдела'),
+}
+REQUIRED_COLUMNS = ('code', 'surname', 'name', 'department')
+EMPLOYEE_FIELDS = ('surname', 'name', 'patronym', 'department_id')
+
+RosterSummary = namedtuple('RosterSummary', ['created', 'updated', 'moved', 'unchanged', 'departments_created',
+                                             'missing', 'errors'])
+
+
+class RosterError(ValueError):
+    pass
+
+
+def read_roster(fileobj, filename):
+    """(line number, row dict) of a roster file opened in binary mode."""
+    if filename.lower().endswith('.xlsx'):
+        rows = (tuple(cell.value for cell in row)
+                for row in load_workbook(fileobj, read_only=True).active.iter_rows())
+    elif filename.lower().endswith('.csv'):
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+        try:
+            dialect = csv.Sniffer().sniff(text.readline(), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        text.seek(0)
+        rows = csv.reader(text, dialect)
+    else:
+        raise RosterError('Roster must be a .csv or .xlsx file')
+
+    header = next(rows, None) or ()
+    aliases = {alias: column for column, names in ROSTER_COLUMNS.items() for alias in names}
+    columns = [aliases.get(str(title or '').strip().lower()) for title in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise RosterError('Roster has no {} column'.format(', '.join(missing)))
+    for line, row in enumerate(rows, 2):
+        values = {column: cell_text(value) for column, value in zip(columns, row) if column}
+        if any(values.values()):
+            yield line, values
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Codes typed into spreadsheets come back as numbers.
+        value = int(value)
+    return str(value).strip()
+
+
+def case(pk_values, output_field):
+    return Case(*[When(pk=pk, then=Value(value)) for pk, value in pk_values], output_field=output_field)
+
+
+def sync_roster(rows, dry_run=False, chunk_size=500):
+    """Apply (line, row) pairs of read_roster() and return a RosterSummary."""
+    # A blank patronym is '' from the admin and NULL from older imports.
+    existing = {code: (pk, surname, name, patronym or '', department_id)
+                for code, pk, surname, name, patronym, department_id
+                in Employee.objects.values_list('code', 'pk', *EMPLOYEE_FIELDS)}
+    departments = {}
+    for pk, name, acronym in Department.objects.order_by('-pk').values_list('pk', 'name', 'acronym'):
+        departments[name.lower()] = departments[acronym.lower()] = pk
+    seen, errors = set(), []
+    counts = dict.fromkeys(('created', 'updated', 'moved', 'unchanged', 'departments_created'), 0)
+
+    def department_id(row):
+        key = row['department'].lower()
+        if key not in departments:
+            counts['departments_created'] += 1
+            if dry_run:
+                departments[key] = -counts['departments_created']
+            else:
+                name = row.get('department_name') or row['department']
+                departments[key] = Department.objects.create(name=name[:100], acronym=row['department'][:20]).pk
+        return departments[key]
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        created, updated = [], []
+        with transaction.atomic():
+            for line, row in chunk:
+                code = row.get('code', '')
+                missing = [column for column in REQUIRED_COLUMNS if not row.get(column)]
+                if missing:
+                    errors.append((line, 'empty {}'.format(', '.join(missing))))
+                    continue
+                try:
+                    validate_employee_code(code)
+                except ValidationError:
+                    errors.append((line, 'bad code {}: the kiosk takes 1 to 6 digits'.format(code)))
+                    continue
+                if code in seen:
+                    errors.append((line, 'duplicate code {}'.format(code)))
+                    continue
+                seen.add(code)
+                values = (row['surname'][:50], row['name'][:50], row.get('patronym', '')[:50],
+                          department_id(row))
+                current = existing.get(code)
+                if current is None:
+                    created.append(Employee(code=code, **dict(zip(EMPLOYEE_FIELDS, values))))
+                elif tuple(current[1:]) != values:
+                    updated.append((current[0], values))
+                    counts['moved'] += current[-1] != values[-1]
+                else:
+                    counts['unchanged'] += 1
+            counts['created'] += len(created)
+            counts['updated'] += len(updated)
+            if not dry_run and created:
+                Employee.objects.bulk_create(created)
+            if not dry_run and updated:
+                # One statement per chunk in place of a row by row save().
+                Employee.objects.filter(pk__in=[pk for pk, values in updated]).update(
+                    modified=timezone.now(),
+                    **{field: case([(pk, values[i]) for pk, values in updated],
+                                   IntegerField() if field == 'department_id' else CharField())
+                       for i, field in enumerate(EMPLOYEE_FIELDS)}
+                )
+
+    if not dry_run and (counts['created'] or counts['updated']):
+        # bulk_create() and update() send no signals.
+        employee_cache.invalidate()
+    return RosterSummary(missing=len(set(existing) - seen), errors=errors, **counts)
@@ -0,0 +1,135 @@
+"""
+Batch shift arithmetic.
+
+Every derived CheckIn column is computed for whole arrays of arrival and
+leaving timestamps at once. Timestamps are integer microseconds since the
+epoch (see helpers.to_epoch_us), so the results are exactly the ones the
+datetime based code used to give, while the per-row work is plain integer
+arithmetic over local day offsets. A range is split by every local day it
+touches (see helpers.LocalDays), so long and DST crossing shifts count the
+night windows of all their days.
+"""
+from collections import namedtuple
+from itertools import islice, repeat
+
+from django.utils import timezone
+
+from main.helpers import US_PER_DAY, US_PER_MINUTE, US_PER_SECOND, local_days, to_epoch_us
+from main.workrules import get_work_rules
+
+SHIFT_COLUMNS = (
+    'workday_duration_raw',
+    'dinners_duration',
+    'coffee_duration',
+    'night_shift_minutes',
+    'night_shift_bonus',
+    'workday_duration',
+    'workday_wo_night_shift_bonus',
+)
+
+ShiftColumns = namedtuple('ShiftColumns', SHIFT_COLUMNS)
+ShiftRow = namedtuple('ShiftRow', SHIFT_COLUMNS)
+
+
+class NightWindows(object):
+    """Night shift windows of local days, memoized by rule and local day number."""
+    def __init__(self):
+        self.days = local_days(timezone.get_current_timezone())
+        self.windows = {}
+
+    def split(self, start, end):
+        return self.days.split(start, end)
+
+    def night(self, rule, day):
+        key = (id(rule), day)
+        windows = self.windows.get(key)
+        if windows is None:
+            midnight = day * US_PER_DAY
+            windows = self.windows[key] = [(self.days.to_epoch(midnight + start), self.days.to_epoch(midnight + end))
+                                           for start, end in rule.night_offsets]
+        return windows
+
+
+def overlap_minutes(start, end, window_start, window_end):
+    latest_start = max(start, window_start)
+    earliest_end = min(end, window_end)
+    if earliest_end > latest_start:
+        return round((earliest_end - latest_start) // US_PER_SECOND / 60)
+    return 0
+
+
+def night_shift_minutes(arrival, leaving, windows, rule):
+    if not rule.night_windows:
+        return 0
+    result = 0
+    for day, start, end in windows.split(arrival, leaving):
+        for window_start, window_end in windows.night(rule, day):
+            result += overlap_minutes(start, end, window_start, window_end)
+    return result
+
+
+def shift_columns(arrivals, leavings, departments=None, rules=None):
+    """
+    Derive every shift column from arrays of arrival and leaving epoch
+    microseconds (None for a missing timestamp). The work rules of each row
+    are picked by its arrival and, given an array of department ids, by
+    its department.
+    """
+    rules = rules or get_work_rules()
+    if departments is None:
+        departments = repeat(None)
+    raw = [(leaving - arrival) // US_PER_MINUTE if arrival is not None and leaving is not None else None
+           for arrival, leaving in zip(arrivals, leavings)]
+    row_rules = [rules.rule_at(department, arrival) if r else None
+                 for r, arrival, department in zip(raw, arrivals, departments)]
+    dinners = [rule.dinners(r) if r else None for r, rule in zip(raw, row_rules)]
+    coffee = [rule.coffee_breaks(r) if r else None for r, rule in zip(raw, row_rules)]
+
+    windows = NightWindows()
+    night = [night_shift_minutes(arrival, leaving, windows, rule) if r else 0
+             for r, rule, arrival, leaving in zip(raw, row_rules, arrivals, leavings)]
+    bonus = [rule.night_bonus(n) if rule else 0 for n, rule in zip(night, row_rules)]
+
+    wo_night_shift_bonus = [r - d - c if r else 0 for r, d, c in zip(raw, dinners, coffee)]
+    workday = [w + b if r else 0 for r, w, b in zip(raw, wo_night_shift_bonus, bonus)]
+    return ShiftColumns(raw, dinners, coffee, night, bonus, workday, wo_night_shift_bonus)
+
+
+def shift_rows(arrivals, leavings, departments=None):
+    return [ShiftRow(*row) for row in zip(*shift_columns(arrivals, leavings, departments))]
+
+
+DAILY_COLUMNS = (
+    'raw_minutes',
+    'dinners_minutes',
+    'coffee_minutes',
+    'night_minutes',
+    'night_bonus_minutes',
+    'net_minutes',
+)
+
+
+def daily_totals(rows, chunk_size=5000, departments=None):
+    """
+    Sum the shift columns of (employee_id, arrival, leaving) rows by
+    employee and local arrival date. Rows without a duration add nothing.
+    departments maps employee ids to department ids for department rules.
+    """
+    totals = {}
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        chunk = [row for row in chunk if row[1] is not None and row[2] is not None]
+        columns = shift_columns([to_epoch_us(row[1]) for row in chunk], [to_epoch_us(row[2]) for row in chunk],
+                                [departments.get(row[0]) for row in chunk] if departments is not None else None)
+        for (employee_id, arrival, leaving), *values in zip(
+                chunk, columns.workday_duration_raw, columns.dinners_duration, columns.coffee_duration,
+                columns.night_shift_minutes, columns.night_shift_bonus, columns.workday_duration):
+            if not values[0]:
+                continue
+            day = totals.setdefault((employee_id, timezone.localtime(arrival).date()), [0] * len(DAILY_COLUMNS))
+            for i, value in enumerate(values):
+                day[i] += value
+    return {key: dict(zip(DAILY_COLUMNS, values)) for key, values in totals.items()}
@@ -0,0 +1,64 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from main.cache import employee_cache
+from main.models import CheckIn, CheckInChange, DailyWorktime, Employee
+from main.timesheets import invalidate_timesheets
+
+_muted = threading.local()
+
+
+@contextmanager
+def checkin_signals_muted():
+    """Skip the rollup refresh and the change log of check-ins saved or deleted inside."""
+    previous = getattr(_muted, 'checkins', False)
+    _muted.checkins = True
+    try:
+        yield
+    finally:
+        _muted.checkins = previous
+
+
+def checkin_signals_live():
+    return not getattr(_muted, 'checkins', False)
+
+
+@receiver([post_save, post_delete], sender=Employee)
+def invalidate_employee_cache(sender, **kwargs):
+    employee_cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=CheckIn)
+def refresh_daily_worktime(sender, instance, **kwargs):
+    if not checkin_signals_live():
+        return
+    for employee_id, date in instance.worktime_days():
+        DailyWorktime.objects.refresh(employee_id, date)
+    invalidate_timesheets(instance.timesheet_months())
+    instance.remember_state()
+
+
+@receiver(post_save, sender=CheckIn)
+def log_checkin_save(sender, instance, created, raw=False, **kwargs):
+    if not raw and checkin_signals_live():
+        CheckInChange.objects.record(instance, CheckInChange.CREATED if created else CheckInChange.UPDATED,
+                                     getattr(instance, '_change_author', ''))
+
+
+@receiver(post_delete, sender=CheckIn)
+def log_checkin_delete(sender, instance, **kwargs):
+    if checkin_signals_live():
+        CheckInChange.objects.record(instance, CheckInChange.DELETED, getattr(instance, '_change_author', ''))
+
+
+@receiver(connection_created)
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in getattr(settings, 'SQLITE_PRAGMAS', ()):
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
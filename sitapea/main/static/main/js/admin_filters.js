@@ -0,0 +1,46 @@
+// Options of the autocomplete filters of the CheckIn changelist are
+// requested as the user types, instead of rendering every employee.
+(function($) {
+    var delay = 250;
+
+    function filter_url(parameter, value) {
+        var params = [];
+        $.each(window.location.search.replace(/^\?/, '').split('&'), function(i, pair) {
+            var name = decodeURIComponent(pair.split('=')[0]);
+            if (pair && name !== parameter && name !== 'p' && name !== 'cursor') {
+                params.push(pair);
+            }
+        });
+        params.push(encodeURIComponent(parameter) + '=' + encodeURIComponent(value));
+        return '?' + params.join('&');
+    }
+
+    $(function() {
+        $('input.autocomplete-filter').each(function() {
+            var input = $(this);
+            var results = input.closest('ul').next('ul.autocomplete-filter-results');
+            var timer = null;
+            var request = null;
+
+            input.on('input', function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    var term = $.trim(input.val());
+                    if (request) {
+                        request.abort();
+                    }
+                    results.empty();
+                    if (!term) {
+                        return;
+                    }
+                    request = $.getJSON(input.data('url'), {term: term}, function(data) {
+                        $.each(data.results, function(i, item) {
+                            var link = $('<a>').text(item.text).attr('href', filter_url(input.data('parameter'), item.id));
+                            results.append($('<li>').append(link));
+                        });
+                    });
+                }, delay);
+            });
+        });
+    });
+})(django.jQuery);
@@ -1,135 +1,304 @@
-$('.mode-selector button').click(function() {
-    pinpad_show(this);
-});
+(function() {
+    var pinform = document.getElementById('PINform');
+    var pincode = document.getElementById('PINcode');
+    var footer = document.getElementById('footer');
+    var result_div = footer.querySelector('.result');
+    var mode_buttons = document.querySelectorAll('.mode-selector button');
 
-$('#hide-pinpad-button').click(function() {
-    pinpad_hide();
-});
-
-$('.PINbutton.clear').click(function() {
-    pincode_clear();
-    pinpad_timeout();
-});
+    function each(list, callback) {
+        for (var i = 0; i < list.length; i++) {
+            callback(list[i], i);
+        }
+    }
 
+    function on_tap(element, callback) {
+        // Touch tablets wait for a double tap before sending click.
+        element.addEventListener('touchend', function(event) {
+            event.preventDefault();
+            callback.call(element);
+        });
+        element.addEventListener('click', callback);
+    }
 
-$('.PINbutton.number').click(function() {
-    var pincode = $('#PINcode');
-    if (pincode.val().length < pincode.attr('maxlength')) {
-        pincode.val(pincode.val() + this.value);
+    function request(method, url, body, headers, done, fail) {
+        var xhr = new XMLHttpRequest();
+        xhr.open(method, url);
+        xhr.timeout = 15*1000;
+        for (var name in headers) {
+            xhr.setRequestHeader(name, headers[name]);
+        }
+        xhr.onload = function() {
+            if (xhr.status >= 200 && xhr.status < 400) {
+                done(xhr);
+            } else {
+                fail(xhr);
+            }
+        };
+        xhr.onerror = xhr.ontimeout = function() {
+            fail(xhr);
+        };
+        xhr.send(body);
     }
-    pinpad_timeout();
-});
 
-$('.PINbutton.enter').click(function() {
-    var pincode = $('#PINcode');
-    var pinform = $('#PINform');
-    if (pincode.val() && pinform.data('action')) {
+    each(mode_buttons, function(button) {
+        on_tap(button, function() {
+            pinpad_show(this);
+        });
+    });
+
+    on_tap(document.getElementById('hide-pinpad-button'), function() {
         pinpad_hide();
-        console.log(pinform.data('action'));
-        console.log(pincode.val());
-
-        var url = '/checkin/' + pincode.val()
-                + '/' + pinform.data('action') + '/';
-
-        $.post(
-            url,
-            '',
-            function(result) {
-                console.log(result);
-                show_notification(result);
+    });
+
+    each(document.querySelectorAll('.PINbutton.clear'), function(button) {
+        on_tap(button, function() {
+            pincode_clear();
+            pinpad_timeout();
+        });
+    });
+
+    each(document.querySelectorAll('.PINbutton.number'), function(button) {
+        on_tap(button, function() {
+            if (pincode.value.length < pincode.maxLength) {
+                pincode.value += this.value;
             }
+            pinpad_timeout();
+        });
+    });
 
-        )
-        .fail(function(result) {
-            console.log(result)
+    each(document.querySelectorAll('.PINbutton.enter'), function(button) {
+        on_tap(button, function() {
+            var action = pinform.getAttribute('data-action');
+            if (pincode.value && action) {
+                var tap = {
+                    id: new_event_id(),
+                    code: pincode.value,
+                    action: action,
+                    timestamp: Date.now()
+                };
+                pinpad_hide();
+                acknowledge(tap);
+                tap_queue.push(tap);
+            }
         });
+    });
 
+    // A ping to the kiosk pool every minute keeps the connection to the
+    // server open, so that a tap does not wait for a new one.
+    var keepalive = {
+        url: '/health/',
+        interval: 60*1000,
+
+        start: function() {
+            setInterval(function() {
+                request('GET', keepalive.url, null, {}, function(xhr) {}, function(xhr) {});
+            }, this.interval);
+        }
     };
 
-});
-
-function pincode_clear() {
-    $('#PINcode').val('');
-}
-
-function pinpad_show(button) {
-    pinpad_hide();
-    var pinform = $('#PINform');
-    pinform.data('action', button.id);
-    $('.mode-selector-buttons .button button').removeClass('selected');
-    $(button).addClass('selected');
-    pincode_clear();
-    pinform.animate({
-        top: "50%",
-    }, 250, function() {
-        // Animation complete.
-    });
-    pinpad_timeout();
-}
-
-function pinpad_hide() {
-    $('.mode-selector-buttons .button button').removeClass('selected');
-    $('#PINform').animate({
-        top: "-50%",
-    }, 250, function() {
-        // Animation complete.
-    })
-}
-
-var pinpad_timer;
-function pinpad_timeout() {
-    clearTimeout(pinpad_timer);
-    pinpad_timer = setTimeout(pinpad_hide, 30*1000);
-}
-
-var notification_timer;
-function show_notification(result) {
-    clearTimeout(notification_timer);
-    var footer = $('#footer');
-    var result_div = footer.find('.result');
-    var checkin_result = '';
-    result_div.attr('class', 'result');
-    if (result['error'] == 'employee_does_not_exist') {
-        checkin_result = 'Неправильный код сотрудника';
-        result_div.addClass('error');
+    // The tap is acknowledged at once without a name: the kiosk does not
+    // know the codes. The greeting comes with the server answer.
+    function acknowledge(tap) {
+        show_notification({acknowledged: true, action: tap.action});
     }
 
-    if (result['employee_name'] && result ['employee_surname']) {
-        if (result['action'] == 'arrival') {
-            checkin_result = result['employee_name'] + ' ' + result['employee_surname'] + ', добро пожаловать!'
-        }
-        if (result['action'] == 'leaving') {
-            checkin_result = 'До свидания, ' + result['employee_name'] + ' ' + result['employee_surname'] + '!'
+    // Taps are kept in IndexedDB until the server has applied them, and sent
+    // in batches to /checkin/batch/. The server answers events it has already
+    // seen with their stored result, so resending after a failure is safe.
+    var tap_queue = {
+        batch_size: 50,
+        retry_interval: 10*1000,
+        db: null,
+        memory: [],
+        flushing: false,
+        notify: null,
+
+        open: function() {
+            var queue = this;
+            if (!window.indexedDB) {
+                return;
+            }
+            var request = window.indexedDB.open('sitapea', 1);
+            request.onupgradeneeded = function() {
+                request.result.createObjectStore('taps', {keyPath: 'seq', autoIncrement: true});
+            };
+            request.onsuccess = function() {
+                queue.db = request.result;
+                var pending = queue.memory;
+                queue.memory = [];
+                each(pending, function(tap) {
+                    queue.store(tap);
+                });
+                queue.flush();
+            };
+            request.onerror = function() {
+                console.log(request.error);
+            };
+        },
+
+        push: function(tap) {
+            this.notify = tap;
+            this.store(tap);
+            this.flush();
+        },
+
+        store: function(tap) {
+            var stored = {id: tap.id, code: tap.code, action: tap.action, timestamp: tap.timestamp};
+            if (this.db) {
+                this.db.transaction('taps', 'readwrite').objectStore('taps').add(stored);
+            } else {
+                this.memory.push(stored);
+            }
+        },
+
+        pending: function(callback) {
+            var queue = this;
+            if (!this.db) {
+                callback(this.memory.slice(0, this.batch_size));
+                return;
+            }
+            var taps = [];
+            var request = this.db.transaction('taps').objectStore('taps').openCursor();
+            request.onsuccess = function() {
+                var cursor = request.result;
+                if (cursor && taps.length < queue.batch_size) {
+                    taps.push(cursor.value);
+                    cursor.continue();
+                } else {
+                    callback(taps);
+                }
+            };
+        },
+
+        remove: function(taps) {
+            if (this.db) {
+                var store = this.db.transaction('taps', 'readwrite').objectStore('taps');
+                each(taps, function(tap) {
+                    store.delete(tap.seq);
+                });
+            } else {
+                this.memory.splice(0, taps.length);
+            }
+        },
+
+        flush: function() {
+            var queue = this;
+            if (this.flushing) {
+                return;
+            }
+            this.flushing = true;
+            this.pending(function(taps) {
+                if (!taps.length) {
+                    queue.flushing = false;
+                    return;
+                }
+                var events = [];
+                each(taps, function(tap) {
+                    events.push({id: tap.id, code: tap.code, action: tap.action, timestamp: tap.timestamp});
+                });
+                request('POST', '/checkin/batch/', JSON.stringify({events: events}),
+                        {'Content-Type': 'application/json'}, function(xhr) {
+                    queue.remove(taps);
+                    each(JSON.parse(xhr.responseText).results, function(result) {
+                        if (queue.notify && result.id == queue.notify.id) {
+                            show_notification(result);
+                            queue.notify = null;
+                        }
+                    });
+                    queue.flushing = false;
+                    queue.flush();
+                }, function(xhr) {
+                    console.log(xhr.status);
+                    queue.flushing = false;
+                    if (queue.notify) {
+                        show_notification({queued: true});
+                        queue.notify = null;
+                    }
+                });
+            });
         }
+    };
+
+    function new_event_id() {
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
     }
 
-    result_div.html(checkin_result);
-    footer.css('bottom', '-120px');
-    footer.animate({
-        bottom: "0",
-    }, 250, function() {
-        // Animation complete.
-    });
-    notification_timer = setTimeout(function() {
-        footer.animate({
-        bottom: "-120px",
-    }, 250, function() {
-        // Animation complete.
-    });
-    }, 5000 );
+    function pincode_clear() {
+        pincode.value = '';
+    }
 
+    function pinpad_show(button) {
+        pinpad_hide();
+        pinform.setAttribute('data-action', button.id);
+        button.classList.add('selected');
+        pincode_clear();
+        pinform.classList.add('shown');
+        pinpad_timeout();
+    }
 
-}
+    function pinpad_hide() {
+        each(mode_buttons, function(button) {
+            button.classList.remove('selected');
+        });
+        pinform.classList.remove('shown');
+    }
 
-function updateTime() {
-    var currentTime = new Date();
-    var hours = currentTime.getHours();
-    var minutes = currentTime.getMinutes();
-    if (minutes < 10){
-    minutes = "0" + minutes;
+    var pinpad_timer;
+    function pinpad_timeout() {
+        clearTimeout(pinpad_timer);
+        pinpad_timer = setTimeout(pinpad_hide, 30*1000);
     }
-    var v = hours + ":" + minutes;
-    setTimeout("updateTime()",1000);
-    $('#clock').html(v);
-}
-updateTime();
\ No newline at end of file
+
+    var notification_timer;
+    function show_notification(result) {
+        clearTimeout(notification_timer);
+        var checkin_result = '';
+        result_div.className = 'result';
+        if (result.error == 'employee_does_not_exist') {
+            checkin_result = 'Неправильный код сотрудника';
+            result_div.classList.add('error');
+        }
+
+        if (result.acknowledged) {
+            checkin_result = result.action == 'arrival' ? 'Приход отмечается…' : 'Уход отмечается…';
+        }
+
+        if (result.queued) {
+            checkin_result = 'Отметка сохранена и будет отправлена позже';
+            result_div.classList.add('warning');
+        }
+
+        if (result.employee_name && result.employee_surname) {
+            if (result.action == 'arrival') {
+                checkin_result = result.employee_name + ' ' + result.employee_surname + ', добро пожаловать!';
+            }
+            if (result.action == 'leaving') {
+                checkin_result = 'До свидания, ' + result.employee_name + ' ' + result.employee_surname + '!';
+            }
+        }
+
+        result_div.textContent = checkin_result;
+        footer.classList.add('shown');
+        notification_timer = setTimeout(function() {
+            footer.classList.remove('shown');
+        }, 5000);
+    }
+
+    var clock = document.getElementById('clock');
+    function update_time() {
+        var now = new Date();
+        var minutes = now.getMinutes();
+        clock.textContent = now.getHours() + ':' + (minutes < 10 ? '0' + minutes : minutes);
+        setTimeout(update_time, 60*1000 - now.getSeconds()*1000 - now.getMilliseconds());
+    }
+
+    update_time();
+    keepalive.start();
+    tap_queue.open();
+    setInterval(function() {
+        tap_queue.flush();
+    }, tap_queue.retry_interval);
+    window.addEventListener('online', function() {
+        tap_queue.flush();
+    });
+})();
@@ -0,0 +1,15 @@
+from django.contrib.staticfiles import storage
+
+
+class ManifestStaticFilesStorage(storage.ManifestStaticFilesStorage):
+    """
+    Static files under hashed names, which nginx caches for good. Files
+    missing from the manifest, as before collectstatic, keep their name.
+    """
+    def url(self, name, force=False):
+        try:
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        except ValueError:
+            if force:
+                raise
+            return storage.StaticFilesStorage.url(self, name)
@@ -1,9 +1,46 @@
-from datetime import datetime as dt
+import json
+import os
+import random
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime as dt, timedelta
+from functools import wraps
+from io import BytesIO, StringIO
+from unittest import mock
 
-from django.test import TestCase
-from django.utils.timezone import make_aware
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.db import DatabaseError, connection, connections
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.timezone import make_aware, localtime
+from openpyxl import Workbook, load_workbook
 
-from .models import CheckIn
+from .admin import CheckInAdmin
+from .anomalies import scan_anomalies
+from .cache import EmployeeCodeCache, EmployeeRecord, employee_cache, version_cache
+from .instrumentation import WORKERS_KEY, metrics
+from .helpers import (Range, morning_shift, evening_shift, from_epoch_us, get_each_day_in_range,
+                      local_days, minutes_to_hhmm, to_epoch_us)
+from .models import (ArchivedCheckIn, CheckIn, CheckInAnomaly, CheckInChange, CheckInEvent, DailyWorktime, Department,
+                     Employee, ReportJob, effective_checkins)
+from .reports import run_job, work
+from .roster import sync_roster
+from .shiftmath import shift_columns
+from .timesheets import VERSION_KEY, invalidate_timesheets, timesheet_keys
+from .views import REPORT_VIEWS, SummaryReportView, parse_report_specs, write_batch_archive
+from .workrules import CompiledRule, WorkRules, get_work_rules
+from .xlsx import save_workbook
 
 
 class TestNightShifts(TestCase):
@@ -48,3 +85,1163 @@ class TestNightShifts(TestCase):
             leaving_timestamp=make_aware(dt(2017, 1, 2, 10, 0))
         )
         self.assertEqual(checkin.night_shift_minutes, 720)
+
+
+def sheet_rows(fileobj):
+    return [[cell.value for cell in row] for row in load_workbook(BytesIO(fileobj.read())).active.rows]
+
+
+def reports_root(test):
+    @wraps(test)
+    def wrapper(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with self.settings(REPORTS_ROOT=root):
+            test(self)
+    return wrapper
+
+
+class TestWorkingTimeSummary(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.ivanov = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+        self.petrov = Employee.objects.create(surname='Петров', name='Пётр', code='2', department=department)
+        Employee.objects.create(surname='Сидоров', name='Сидор', code='3', department=department)
+        self.ivanov.checkin_set.create(
+            arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)),
+            leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)),
+        )
+        # "Last night" check-in crossing the end of the range.
+        self.ivanov.checkin_set.create(
+            arrival_timestamp=make_aware(dt(2017, 1, 31, 20, 0)),
+            leaving_timestamp=make_aware(dt(2017, 2, 1, 8, 0)),
+        )
+        self.petrov.checkin_set.create(
+            arrival_timestamp=make_aware(dt(2017, 1, 3, 9, 0)),
+            leaving_timestamp=make_aware(dt(2017, 1, 3, 13, 0)),
+        )
+        self.petrov.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 4, 9, 0)))
+        self.petrov.checkin_set.create(
+            arrival_timestamp=make_aware(dt(2017, 2, 3, 9, 0)),
+            leaving_timestamp=make_aware(dt(2017, 2, 3, 13, 0)),
+        )
+
+    def test_working_time_by_employee(self):
+        working_time = CheckIn.objects.working_time_by_employee('2017-01-01', '2017-02-01')
+        self.assertEqual(set(working_time), {self.ivanov.id, self.petrov.id})
+        self.assertEqual(working_time[self.ivanov.id].total, (540 - 60 - 15) + (720 - 60 - 45 + 240))
+        self.assertEqual(working_time[self.ivanov.id].wo_night_shift_bonus, (540 - 60 - 15) + (720 - 60 - 45))
+        self.assertEqual(working_time[self.petrov.id].total, 240)
+
+    def test_checkin_api_pages(self):
+        url = reverse('api-checkins-view', kwargs={'fmt': 'jsonl'})
+        rows, query = [], {'date_from': '2017-01-01', 'date_to': '2017-02-01', 'limit': 3}
+        while True:
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            rows += [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            if not response.has_header('X-Next-Cursor'):
+                break
+            self.assertIn('cursor=', response['Link'])
+            query['cursor'] = response['X-Next-Cursor']
+        self.assertEqual([row['arrival'][:10] for row in rows], ['2017-01-02', '2017-01-03', '2017-01-04', '2017-01-31'])
+        self.assertEqual(rows[3]['night_shift_bonus'], 240)
+        self.assertEqual(rows[2]['leaving'], None)
+        for cursor in ('x', '1:2:3', '{}:1'.format(10**20), '-{}:1'.format(10**17)):
+            query['cursor'] = cursor
+            self.assertEqual(self.client.get(url, query).status_code, 400)
+
+    def test_summary_api(self):
+        url = reverse('api-summary-view', kwargs={'fmt': 'csv'})
+        query = {'date_from': '2017-01-01', 'date_to': '2017-02-01'}
+        response = self.client.get(url, query, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(url, query)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'employee_id,code,surname,name,patronym,department,total_minutes,'
+                                   'wo_night_shift_bonus_minutes')
+        self.assertEqual(lines[1], '{},1,Иванов,Иван,,СК,1320,1080'.format(self.ivanov.pk))
+
+        self.assertEqual(self.client.get(url, query, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, query, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                         304)
+        self.ivanov.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 5, 9, 0)))
+        self.assertEqual(self.client.get(url, query, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url, {'date_from': '2017-02-01'}).status_code, 400)
+
+    def test_employee_summary(self):
+        self.assertEqual(self.ivanov.working_hours_summary_in_date_range('2017-01-01', '2017-02-01'), '22:00')
+        self.assertEqual(self.ivanov.working_hours_wo_night_shift_in_date_range('2017-01-01', '2017-02-01'), '18:00')
+        self.assertEqual(self.petrov.working_hours_summary_in_date_range('2017-02-01', '2017-03-01'), '4:00')
+
+    def test_summary_report_query_count(self):
+        with self.assertNumQueries(2):
+            SummaryReportView().build_workbook('2017-01-01', '2017-02-01')
+
+    @reports_root
+    def test_batch_export(self):
+        reports = ['summary:2017-01-01:2017-02-01', 'wo_night_shift:2017-01-01:2017-02-01',
+                   'summary:2017-02-01:2017-03-01', 'detailed:2017-01-01:2017-03-01', 'detailed:2017-02-01:2017-03-01']
+        # Employees, the daily rollup and the live and archived check-ins,
+        # once each, and the order of the employees to merge the check-ins by.
+        with self.assertNumQueries(5):
+            write_batch_archive(BytesIO(), parse_report_specs(reports))
+
+        response = self.client.get(reverse('report-batch-view'), {'report': reports})
+        job = ReportJob.objects.get(kind='batch')
+        self.assertRedirects(response, reverse('report-job-view', kwargs={'pk': job.pk}))
+        self.assertEqual((job.date_from, job.date_to), ('2017-01-01', '2017-03-01'))
+        work(once=True)
+        response = self.client.get(reverse('report-batch-view'), {'report': reports})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=sitapea_reports.zip')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        # Another selection over the same period is another job.
+        self.client.get(reverse('report-batch-view'), {'report': reports[:2]})
+        self.assertEqual(ReportJob.objects.filter(kind='batch', status=ReportJob.PENDING).count(), 1)
+
+        self.assertEqual(len(archive.namelist()), len(reports))
+        for kind, date_from, date_to in parse_report_specs(reports):
+            view = REPORT_VIEWS[kind]()
+            expected = BytesIO()
+            save_workbook(view.build_workbook(date_from, date_to), expected)
+            expected.seek(0)
+            self.assertEqual(sheet_rows(archive.open(view.name(date_from, date_to))), sheet_rows(expected))
+
+        response = self.client.get(reverse('report-batch-view'), {'report': 'summary:2017-02-01:2017-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    @reports_root
+    def test_detailed_report_layout(self):
+        url = reverse('report-range-download-view', kwargs={'date_from': '2017-01-01', 'date_to': '2017-02-01'})
+        self.client.get(url)
+        work(once=True)
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=sitapea_report_2017-01-01_2017-02-01.xlsx')
+        ws = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        rows = [[cell.value for cell in row] for row in ws.rows]
+        self.assertEqual(rows[0][:3], ['Отчёт за период', '2017-01-01', '2017-02-01'])
+        self.assertEqual(len(rows[1]), 13)
+        self.assertEqual([row[0] for row in rows[2:]], ['Иванов', 'Иванов', 'Петров', 'Петров'])
+        self.assertEqual(rows[2][4:8], [dt(2017, 1, 2, 9, 0), dt(2017, 1, 2, 18, 0), 465, '7:45'])
+        self.assertEqual(rows[2][9:13], [60, 15, 0, 540])
+        self.assertEqual(ws.column_dimensions['A'].width, 30)
+        self.assertTrue(ws.column_dimensions['J'].hidden)
+
+
+class TestDailyWorktime(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+
+    def days(self):
+        return dict(DailyWorktime.objects.values_list('date', 'net_minutes'))
+
+    def test_follows_checkin_changes(self):
+        checkin = self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)))
+        self.assertEqual(self.days(), {})
+        self.employee.leave(now=make_aware(dt(2017, 1, 2, 18, 0)))
+        self.assertEqual(self.days(), {dt(2017, 1, 2).date(): 540 - 60 - 15})
+        checkin.refresh_from_db()
+        checkin.arrival_timestamp = make_aware(dt(2017, 1, 3, 14, 0))
+        checkin.leaving_timestamp = make_aware(dt(2017, 1, 3, 18, 0))
+        checkin.save()
+        self.assertEqual(self.days(), {dt(2017, 1, 3).date(): 240})
+        checkin.delete()
+        self.assertEqual(self.days(), {})
+
+    def test_rebuild(self):
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)),
+                                         leaving_timestamp=make_aware(dt(2017, 1, 2, 13, 0)))
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 14, 0)),
+                                         leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)))
+        expected = self.days()
+        self.assertEqual(expected, {dt(2017, 1, 2).date(): 480})
+        DailyWorktime.objects.update(net_minutes=0)
+        self.assertEqual(DailyWorktime.objects.rebuild('2017-01-01', '2017-02-01'), 1)
+        self.assertEqual(self.days(), expected)
+
+
+    def test_night_shifts_count_on_their_arrival_date(self):
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 9, 22, 0)),
+                                         leaving_timestamp=make_aware(dt(2017, 1, 10, 6, 0)))
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 10, 22, 0)),
+                                         leaving_timestamp=make_aware(dt(2017, 1, 12, 0, 30)))
+        periods = [('2017-01-10', '2017-01-11'), ('2017-01-11', '2017-01-12'), ('2017-01-09', '2017-01-10'),
+                   ('2017-01-01', '2017-02-01')]
+        for period, rollup in zip(periods, DailyWorktime.objects.working_time_by_period(periods)):
+            self.assertEqual(CheckIn.objects.working_time_by_employee(*period), rollup, period)
+        self.assertEqual(DailyWorktime.objects.working_time_by_period(periods[:2])[1], {})
+
+
+class TestReportJobs(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+        self.checkin = self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)),
+                                                        leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)))
+        self.url = reverse('summary-report-download-view',
+                           kwargs={'date_from': '2017-01-01', 'date_to': '2017-02-01'})
+
+    def status(self, job):
+        url = reverse('report-job-view', kwargs={'pk': job.pk})
+        return self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+    @reports_root
+    def test_queued_then_served_from_artifact(self):
+        response = self.client.get(self.url)
+        job = ReportJob.objects.get()
+        self.assertRedirects(response, reverse('report-job-view', kwargs={'pk': job.pk}))
+        self.assertEqual(self.status(job), {'id': job.pk, 'status': 'pending', 'download_url': None})
+
+        work(once=True)
+        self.assertEqual(self.status(job)['status'], 'done')
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=sitapea_summary_report_2017-01-01_2017-02-01.xlsx')
+        self.assertEqual(b''.join(response.streaming_content), open(job.artifact_path, 'rb').read())
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    @reports_root
+    def test_changed_data_supersedes_artifact(self):
+        self.client.get(self.url)
+        work(once=True)
+        old_job = ReportJob.objects.get()
+
+        self.checkin.comment = 'Отгул'
+        self.checkin.save()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        work(once=True)
+        job = ReportJob.objects.get()
+        self.assertNotEqual(job.data_version, old_job.data_version)
+        self.assertFalse(old_job.artifact_exists())
+        self.assertTrue(job.artifact_exists())
+
+    @reports_root
+    def test_newer_pending_job_is_kept(self):
+        self.client.get(self.url)
+        old_job = ReportJob.objects.get()
+        self.checkin.comment = 'Отгул'
+        self.checkin.save()
+        self.client.get(self.url)
+        run_job(ReportJob.objects.claim())
+        job = ReportJob.objects.exclude(pk=old_job.pk).get()
+        self.assertEqual(self.status(job)['status'], 'pending')
+        work(once=True)
+        self.assertEqual(self.status(job)['status'], 'done')
+        self.assertFalse(ReportJob.objects.filter(pk=old_job.pk).exists())
+
+    @reports_root
+    def test_failed_job_is_requeued(self):
+        self.client.get(self.url)
+        with mock.patch('main.reports.save_workbook', side_effect=RuntimeError):
+            work(once=True)
+        job = ReportJob.objects.get()
+        self.assertEqual(job.status, ReportJob.FAILED)
+        self.assertEqual(os.listdir(settings.REPORTS_ROOT), [])
+        self.client.get(self.url)
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.PENDING)
+
+    def test_claim(self):
+        job = ReportJob.objects.request('summary', '2017-01-01', '2017-02-01', 'report.xlsx')
+        self.assertEqual(ReportJob.objects.claim(), job)
+        self.assertIsNone(ReportJob.objects.claim())
+        ReportJob.objects.update(started=timezone.now() - timedelta(hours=1))
+        self.assertEqual(ReportJob.objects.claim(), job)
+
+
+class TestBenchmarks(TestCase):
+    def test_generate_and_run(self):
+        call_command('generate_synthetic_data', departments=2, employees=5, days=10, missing_share=0.2,
+                     stdout=StringIO())
+        self.assertEqual(Employee.objects.count(), 5)
+        self.assertTrue(CheckIn.objects.filter(arrival_timestamp=None).exists())
+        self.assertTrue(CheckIn.objects.filter(leaving_timestamp=None).exists())
+        self.assertTrue(DailyWorktime.objects.exists())
+        checkins = CheckIn.objects.count()
+
+        stdout = StringIO()
+        call_command('run_benchmarks', runs=2, report_runs=1, label='test', stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(results['label'], 'test')
+        self.assertEqual(results['dataset']['checkins'], checkins)
+        self.assertEqual(results['results']['checkin_leaving']['runs'], 2)
+        self.assertIn('report_summary_year', results['results'])
+        self.assertIn('admin_checkin_changelist', results['results'])
+        self.assertEqual(CheckIn.objects.count(), checkins)
+
+
+def two_day_split(datetime_range):
+    # get_each_day_in_range as it was, valid for ranges within two days.
+    if datetime_range.start.day == datetime_range.end.day:
+        return [datetime_range]
+    return [Range(start=datetime_range.start, end=make_aware(dt.combine(datetime_range.start.date(), dt.max.time()))),
+            Range(start=make_aware(dt.combine(datetime_range.end.date(), dt.min.time())), end=datetime_range.end)]
+
+
+def original_overlap(r1, r2):
+    # get_overlap_of_ranges as it was.
+    latest_start = max(r1.start, r2.start)
+    earliest_end = min(r1.end, r2.end)
+    return round((earliest_end - latest_start).seconds / 60) if earliest_end > latest_start else 0
+
+
+def reference_shift(arrival, leaving):
+    raw = int((leaving - arrival).total_seconds() // 60)
+    dinners = (raw + 7*60) // 12 // 60 * 60 if raw else None
+    coffee = (raw // (12*60) * 7*60 + max(raw % (12*60) - 5*60, 0)) // 135 * 15 if raw else None
+    night = 0
+    if raw and arrival > make_aware(dt(2017, 1, 1)):
+        for day in two_day_split(Range(start=localtime(arrival), end=localtime(leaving))):
+            night += original_overlap(day, morning_shift(day.start.date()))
+            night += original_overlap(day, evening_shift(day.start.date()))
+    bonus = int(night * 0.5)
+    workday = raw - dinners - coffee + bonus if raw else 0
+    return raw, dinners, coffee, night, bonus, workday
+
+
+class TestShiftMath(TestCase):
+    def test_matches_datetime_implementation(self):
+        rng = random.Random(42)
+        arrivals, leavings = [], []
+        for _ in range(2000):
+            arrival = make_aware(dt(2016, 12, 25)) + timedelta(microseconds=rng.randrange(20 * 24 * 3600 * 10**6))
+            # Ranges spanning at most two calendar days, including reversed ones.
+            leaving = arrival + timedelta(microseconds=rng.randrange(-3600 * 10**6, 26 * 3600 * 10**6))
+            if localtime(leaving).date() - localtime(arrival).date() > timedelta(days=1):
+                continue
+            arrivals.append(arrival)
+            leavings.append(leaving)
+        columns = shift_columns([to_epoch_us(a) for a in arrivals], [to_epoch_us(l) for l in leavings])
+        for i, (arrival, leaving) in enumerate(zip(arrivals, leavings)):
+            self.assertEqual(
+                (columns.workday_duration_raw[i], columns.dinners_duration[i], columns.coffee_duration[i],
+                 columns.night_shift_minutes[i], columns.night_shift_bonus[i], columns.workday_duration[i]),
+                reference_shift(arrival, leaving),
+                msg='{} - {}'.format(arrival, leaving))
+
+    def test_missing_timestamps(self):
+        columns = shift_columns([None, to_epoch_us(make_aware(dt(2017, 1, 1, 9)))],
+                                [to_epoch_us(make_aware(dt(2017, 1, 1, 18))), None])
+        self.assertEqual(columns.workday_duration_raw, [None, None])
+        self.assertEqual(columns.dinners_duration, [None, None])
+        self.assertEqual(columns.night_shift_minutes, [0, 0])
+        self.assertEqual(columns.workday_duration, [0, 0])
+
+    def test_properties_follow_timestamp_changes(self):
+        checkin = CheckIn(arrival_timestamp=make_aware(dt(2017, 1, 1, 9, 0)),
+                          leaving_timestamp=make_aware(dt(2017, 1, 1, 18, 0)))
+        self.assertEqual(checkin.workday_duration, 465)
+        checkin.leaving_timestamp = make_aware(dt(2017, 1, 1, 23, 0))
+        self.assertEqual(checkin.workday_duration_raw, 840)
+        self.assertEqual(checkin.night_shift_bonus, 30)
+
+
+class TestLocalDays(TestCase):
+    def random_ranges(self, rng, start, days, max_hours, count=2000):
+        for _ in range(count):
+            arrival = start + timedelta(microseconds=rng.randrange(days * 24 * 3600 * 10**6))
+            yield arrival, arrival + timedelta(microseconds=rng.randrange(1, max_hours * 3600 * 10**6))
+
+    def test_matches_two_day_split(self):
+        rng = random.Random(15)
+        for arrival, leaving in self.random_ranges(rng, make_aware(dt(2016, 12, 25)), 20, 26):
+            span = Range(start=localtime(arrival), end=localtime(leaving))
+            if span.end.date() - span.start.date() > timedelta(days=1):
+                continue
+            self.assertEqual(get_each_day_in_range(span), two_day_split(span), msg=str(span))
+
+    def test_splits_any_span_across_dst(self):
+        rng = random.Random(15)
+        with timezone.override('Europe/Berlin'):
+            days = local_days(timezone.get_current_timezone())
+            for arrival, leaving in self.random_ranges(rng, make_aware(dt(2016, 3, 20)), 240, 24 * 5, 500):
+                pieces = days.split(to_epoch_us(arrival), to_epoch_us(leaving))
+                self.assertEqual(pieces[0][1], to_epoch_us(arrival))
+                self.assertEqual(pieces[-1][2], to_epoch_us(leaving))
+                for (day, start, end), following in zip(pieces, pieces[1:] + [None]):
+                    local_start = localtime(from_epoch_us(start))
+                    self.assertEqual(local_start.date(), dt(1970, 1, 1).date() + timedelta(days=day))
+                    self.assertEqual(localtime(from_epoch_us(end - 1)).date(), local_start.date())
+                    if following:
+                        self.assertEqual(following[1], end)
+                        self.assertEqual(localtime(from_epoch_us(end)).time(), dt.min.time())
+            lengths = {(localtime(from_epoch_us(start)).date(), end - start)
+                       for day, start, end in days.split(to_epoch_us(make_aware(dt(2016, 3, 26))),
+                                                         to_epoch_us(make_aware(dt(2016, 3, 28))))}
+            self.assertEqual(lengths, {(dt(2016, 3, 26).date(), 24 * 3600 * 10**6),
+                                       (dt(2016, 3, 27).date(), 23 * 3600 * 10**6)})
+
+    def test_night_minutes_of_long_shifts(self):
+        columns = shift_columns([to_epoch_us(make_aware(dt(2017, 3, 1, 20)))],
+                                [to_epoch_us(make_aware(dt(2017, 3, 4, 20)))])
+        self.assertEqual(columns.night_shift_minutes, [120 + 480 + 480 + 360])
+
+
+class TestWorkRules(TestCase):
+    def setUp(self):
+        self.warehouse = Department.objects.create(name='Склад', acronym='СК')
+        self.office = Department.objects.create(name='Офис', acronym='ОФ')
+        self.stock = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=self.warehouse)
+        self.clerk = Employee.objects.create(surname='Петров', name='Пётр', code='2', department=self.office)
+
+    def test_tables_match_formulas(self):
+        rule = CompiledRule({'break_cycle': 600, 'break_after': 240, 'dinner': 30, 'coffee_every': 100})
+        for raw in range(0, 3 * 24 * 60, 7):
+            self.assertEqual(rule.dinners(raw), rule.compute_dinners(raw))
+            self.assertEqual(rule.coffee_breaks(raw), rule.compute_coffee(raw))
+
+    def test_version_starts_after_midnight(self):
+        rules = get_work_rules()
+        since = to_epoch_us(make_aware(dt(2017, 1, 1)))
+        self.assertFalse(rules.rule_at(None, since).night_windows)
+        self.assertTrue(rules.rule_at(None, since + 1).night_windows)
+
+    def test_rules_are_part_of_versions(self):
+        version = ReportJob.objects.data_version('2017-01-01', '2017-02-01')
+        keys = timesheet_keys([self.stock.pk], [dt(2017, 1, 1).date()])
+        with override_settings(WORK_RULES=[{'since': '2017-01-01', 'coffee': 10}]):
+            self.assertNotEqual(ReportJob.objects.data_version('2017-01-01', '2017-02-01'), version)
+            self.assertNotEqual(timesheet_keys([self.stock.pk], [dt(2017, 1, 1).date()]), keys)
+        self.assertEqual(ReportJob.objects.data_version('2017-01-01', '2017-02-01'), version)
+        self.assertEqual(WorkRules([{'since': '2017-01-01', 'coffee': '15'}]).digest,
+                         WorkRules([{'since': '2017-01-01', 'coffee': 15}]).digest)
+
+    def test_department_version(self):
+        with override_settings(WORK_RULES=[
+            {'since': '2017-01-01', 'night_windows': [('00:00', '06:00'), ('22:00', '24:00')], 'night_bonus': '1/2'},
+            {'since': '2017-02-01', 'departments': [self.warehouse.pk], 'night_windows': [('21:00', '24:00')],
+             'night_bonus': 1},
+        ]):
+            for employee in (self.stock, self.clerk):
+                employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 2, 2, 20, 0)),
+                                            leaving_timestamp=make_aware(dt(2017, 2, 3, 2, 0)))
+            stock, clerk = CheckIn.objects.get(employee=self.stock), CheckIn.objects.get(employee=self.clerk)
+            self.assertEqual((stock.night_shift_minutes, stock.night_shift_bonus), (180, 180))
+            self.assertEqual((clerk.night_shift_minutes, clerk.night_shift_bonus), (240, 120))
+            working_time = CheckIn.objects.working_time_by_employee('2017-02-02', '2017-02-04')
+            self.assertEqual(working_time[self.stock.pk].total, 360 - 60 + 180)
+            self.assertEqual(working_time[self.clerk.pk].total, 360 - 60 + 120)
+            days = dict(DailyWorktime.objects.values_list('employee_id', 'net_minutes'))
+            self.assertEqual(days, {self.stock.pk: 480, self.clerk.pk: 420})
+            DailyWorktime.objects.rebuild()
+            self.assertEqual(dict(DailyWorktime.objects.values_list('employee_id', 'net_minutes')), days)
+            # Earlier check-ins keep the rules of their time.
+            january = to_epoch_us(make_aware(dt(2017, 1, 15)))
+            self.assertIs(get_work_rules().rule_at(self.warehouse.pk, january),
+                          get_work_rules().rule_at(self.office.pk, january))
+
+    def test_invalid_rules(self):
+        for versions in ([{'sinse': '2017-01-01'}], [{'since': '2017-13-01'}],
+                         [{'night_windows': [('22:00', '06:00')]}], [{'break_after': 800}]):
+            with self.assertRaises(ImproperlyConfigured):
+                WorkRules(versions)
+
+
+class TestEffectiveTimestamp(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+
+    def test_kept_up_to_date_on_save(self):
+        checkin = self.employee.checkin_set.create(leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)))
+        self.assertEqual(checkin.effective_timestamp, checkin.leaving_timestamp)
+        checkin.arrival_timestamp = make_aware(dt(2017, 1, 2, 9, 0))
+        checkin.save(update_fields=['arrival_timestamp'])
+        checkin.refresh_from_db()
+        self.assertEqual(checkin.effective_timestamp, make_aware(dt(2017, 1, 2, 9, 0)))
+
+    def test_last_checkin(self):
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)),
+                                         leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)))
+        last = self.employee.checkin_set.create(leaving_timestamp=make_aware(dt(2017, 1, 3, 18, 0)))
+        self.assertEqual(self.employee.get_last_checkin(), last)
+
+    def test_effective_in_date_range(self):
+        early = self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 0, 0)))
+        late = self.employee.checkin_set.create(leaving_timestamp=make_aware(dt(2017, 1, 2, 23, 59)))
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 3, 0, 0)))
+        self.assertEqual(set(CheckIn.objects.effective_in_date_range('2017-01-2')), {early, late})
+        self.assertEqual(CheckIn.objects.effective_in_date_range('2017-01-01', '2017-01-04').count(), 3)
+
+
+
+class TestCheckInPath(TransactionTestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+
+    def tap(self, action, code='1'):
+        url = reverse('checkin-view', kwargs={'code': code, 'action': action})
+        return self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+    def test_first_taps(self):
+        self.assertEqual(self.tap('arrival'), {
+            'employee_name': 'Иван', 'employee_surname': 'Иванов', 'action': 'arrival'})
+        self.assertNotIn('warning', self.tap('leaving'))
+        checkin = self.employee.checkin_set.get()
+        self.assertIsNotNone(checkin.arrival_timestamp)
+        self.assertIsNotNone(checkin.leaving_timestamp)
+
+    def test_warnings(self):
+        self.assertEqual(self.tap('leaving')['warning'], 'forgot_to_leave_and_arrive')
+        self.tap('arrival')
+        self.assertEqual(self.tap('arrival')['warning'], 'forgot_to_leave')
+        self.assertEqual(self.tap('arrival', code='2'), {'error': 'employee_does_not_exist'})
+
+    def test_round_trips(self):
+        # Code lookup on a cold cache, BEGIN, the write, its change log
+        # entry, and for an arrival the previous check-in. A leaving also
+        # refreshes its day in the rollup: the closed check-in, the day's
+        # check-ins and the rollup write.
+        with self.assertNumQueries(5):
+            self.tap('arrival')
+        with self.assertNumQueries(6):
+            self.tap('leaving')
+
+    def test_concurrent_leave_taps(self):
+        self.employee.arrive(now=make_aware(dt(2017, 1, 2, 9, 0)))
+        # Racing taps both target the open check-in; the one applied
+        # second must not overwrite the leaving time of the first.
+        self.assertTrue(self.employee.checkin_set.close_last(make_aware(dt(2017, 1, 2, 18, 0))))
+        self.assertFalse(self.employee.checkin_set.close_last(make_aware(dt(2017, 1, 2, 18, 0, 1))))
+        with self.assertRaisesMessage(ValueError, 'forgot_to_leave_and_arrive'):
+            self.employee.leave(now=make_aware(dt(2017, 1, 2, 18, 0, 1)))
+        self.assertEqual(
+            list(self.employee.checkin_set.order_by('id').values_list('arrival_timestamp', 'leaving_timestamp')),
+            [(make_aware(dt(2017, 1, 2, 9, 0)), make_aware(dt(2017, 1, 2, 18, 0))),
+             (None, make_aware(dt(2017, 1, 2, 18, 0, 1)))])
+
+    def test_concurrent_taps_from_threads(self):
+        self.employee.arrive(now=timezone.now() - timedelta(hours=9))
+        results = []
+
+        def leave():
+            try:
+                self.employee.leave()
+            except ValueError as e:
+                results.append(str(e))
+            else:
+                results.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=leave) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results, key=str), [None] + ['forgot_to_leave_and_arrive'] * 3)
+        self.assertEqual(self.employee.checkin_set.count(), 4)
+
+    def test_round_trips_do_not_grow_with_history(self):
+        # Timing is left to run_benchmarks; the queries of a tap are what a
+        # test can hold steady. The code is cached by now, and the rollup
+        # write of these empty shifts is a delete.
+        for _ in range(20):
+            self.tap('arrival')
+            self.tap('leaving')
+        with self.assertNumQueries(4):
+            self.tap('arrival')
+        with self.assertNumQueries(6):
+            self.tap('leaving')
+
+
+class TestCheckInChanges(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+
+    def feed(self, after=0, **params):
+        response = self.client.get(reverse('api-changes-view', kwargs={'fmt': 'jsonl'}), dict(params, after=after))
+        return response, [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_feed_after_watermark(self):
+        self.employee.arrive(now=make_aware(dt(2017, 1, 2, 9, 0)))
+        self.employee.leave(now=make_aware(dt(2017, 1, 2, 18, 0)))
+        response, changes = self.feed()
+        self.assertEqual([change['action'] for change in changes], ['created', 'updated'])
+        self.assertEqual(changes[1]['leaving'], localtime(make_aware(dt(2017, 1, 2, 18, 0))).isoformat())
+        watermark = int(response['X-Last-Seq'])
+
+        checkin = self.employee.checkin_set.get()
+        checkin.comment = 'Забыл отметиться'
+        checkin.save()
+        checkin.delete()
+        response, changes = self.feed(watermark, limit=1)
+        self.assertEqual([(change['action'], change['comment']) for change in changes],
+                         [('updated', 'Забыл отметиться')])
+        self.assertIn('after={}'.format(response['X-Last-Seq']), response['Link'])
+        response, changes = self.feed(response['X-Last-Seq'])
+        self.assertEqual([change['action'] for change in changes], ['deleted'])
+        self.assertEqual(self.feed(response['X-Last-Seq'])[1], [])
+
+        out = StringIO()
+        call_command('checkin_changes', str(watermark), stdout=out)
+        self.assertEqual([json.loads(line)['action'] for line in out.getvalue().splitlines()],
+                         ['updated', 'deleted'])
+
+    def test_log_needs_serialized_writers(self):
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            with self.assertRaises(ImproperlyConfigured):
+                self.employee.arrive(now=make_aware(dt(2017, 1, 2, 9, 0)))
+        self.assertFalse(CheckInChange.objects.exists())
+
+    def test_admin_author(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        checkin = self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)))
+        self.client.post(reverse('admin:main_checkin_delete', args=[checkin.pk]), {'post': 'yes'})
+        self.assertEqual(list(CheckInChange.objects.values_list('action', 'author')),
+                         [('created', ''), ('deleted', 'admin')])
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.ivanov = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+        self.petrov = Employee.objects.create(surname='Петров', name='Пётр', code='2', department=department)
+        for day, employee in [(2, self.ivanov), (3, self.petrov), (31, self.ivanov)]:
+            employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, day, 9, 0)),
+                                        leaving_timestamp=make_aware(dt(2017, 1, day, 18, 0)))
+        self.petrov.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 2, 1, 22, 0)),
+                                       leaving_timestamp=make_aware(dt(2017, 2, 2, 6, 0)))
+
+    def report_rows(self):
+        expected = BytesIO()
+        save_workbook(REPORT_VIEWS['detailed']().build_workbook('2017-01-01', '2017-03-01'), expected)
+        expected.seek(0)
+        return sheet_rows(expected)
+
+    def test_archived_checkins_stay_in_reports(self):
+        rows = self.report_rows()
+        days = dict(DailyWorktime.objects.values_list('date', 'net_minutes'))
+        summary = self.ivanov.working_hours_summary_in_date_range('2017-01-01', '2017-03-01')
+        changes = CheckInChange.objects.count()
+        version = ReportJob.objects.data_version('2017-01-01', '2017-03-01')
+
+        out = StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=make_aware(dt(2017, 3, 15, 12, 0))):
+            call_command('archive_checkins', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Archived 3 check-ins effective before 2017-02-01.')
+        self.assertEqual(CheckIn.objects.count(), 1)
+        self.assertEqual(sorted(ArchivedCheckIn.objects.values_list('id', flat=True)),
+                         sorted(set(range(1, 5)) - set(CheckIn.objects.values_list('id', flat=True))))
+        self.assertEqual(CheckInChange.objects.count(), changes)
+        self.assertNotEqual(ReportJob.objects.data_version('2017-01-01', '2017-03-01'), version)
+
+        self.assertEqual(self.report_rows(), rows)
+        self.assertEqual(self.ivanov.working_hours_summary_in_date_range('2017-01-01', '2017-03-01'), summary)
+        DailyWorktime.objects.update(net_minutes=0)
+        DailyWorktime.objects.rebuild()
+        self.assertEqual(dict(DailyWorktime.objects.values_list('date', 'net_minutes')), days)
+
+    def test_namesakes_are_not_interleaved(self):
+        namesake = Employee.objects.create(surname='Иванов', name='Иван', code='3',
+                                           department=self.ivanov.department)
+        for day in (2, 31):
+            namesake.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, day, 8, 0)),
+                                        leaving_timestamp=make_aware(dt(2017, 1, day, 17, 0)))
+        namesake.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 2, 2, 8, 0)))
+        with mock.patch('django.utils.timezone.now', return_value=make_aware(dt(2017, 3, 15, 12, 0))):
+            call_command('archive_checkins', stdout=StringIO())
+        employees = [checkin.employee_id for checkin in effective_checkins('2017-01-01', '2017-03-01')]
+        self.assertEqual(employees, [self.ivanov.pk] * 2 + [namesake.pk] * 3 + [self.petrov.pk] * 2)
+
+    def test_current_month_is_not_archived(self):
+        with mock.patch('django.utils.timezone.now', return_value=make_aware(dt(2017, 2, 10, 12, 0))):
+            with self.assertRaises(CommandError):
+                call_command('archive_checkins', '2017-03-01', stdout=StringIO())
+            call_command('archive_checkins', '2017-02-01', stdout=StringIO())
+        self.assertEqual(ArchivedCheckIn.objects.count(), 3)
+
+
+class TestTimesheets(TestCase):
+    def setUp(self):
+        invalidate_timesheets()
+        self.department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=self.department)
+        self.checkin = self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 2, 9, 0)),
+                                                        leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)))
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, 31, 22, 0)),
+                                         leaving_timestamp=make_aware(dt(2017, 2, 1, 6, 0)))
+        self.employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 2, 2, 9, 0)))
+        patcher = mock.patch('django.utils.timezone.now', return_value=make_aware(dt(2017, 2, 15, 12, 0)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def timesheet(self, month):
+        url = reverse('api-timesheet-view', kwargs={'employee_id': self.employee.pk, 'month': month, 'fmt': 'json'})
+        return json.loads(self.client.get(url).content.decode())['employees'][0]
+
+    def test_closed_month_is_cached(self):
+        timesheet = self.timesheet('2017-01')
+        self.assertEqual([(day['date'], day['net_minutes'], day['night_bonus_minutes']) for day in timesheet['days']],
+                         [('2017-01-02', 465, 0), ('2017-01-31', 645, 240)])
+        self.assertEqual(timesheet['days'][1]['leaving'], localtime(make_aware(dt(2017, 2, 1, 6, 0))).isoformat())
+        self.assertEqual(minutes_to_hhmm(timesheet['total_minutes']),
+                         self.employee.working_hours_summary_in_date_range('2017-01-01', '2017-02-01'))
+
+        url = reverse('api-timesheet-view', kwargs={'employee_id': self.employee.pk, 'month': '2017-01',
+                                                    'fmt': 'json'})
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        self.checkin.leaving_timestamp = make_aware(dt(2017, 1, 2, 13, 0))
+        self.checkin.save()
+        self.assertEqual(self.timesheet('2017-01')['days'][0]['net_minutes'], 240)
+
+        # A bulk update bypasses the signals, the rebuild has to catch up.
+        CheckIn.objects.filter(pk=self.checkin.pk).update(leaving_timestamp=make_aware(dt(2017, 1, 2, 18, 0)))
+        call_command('rebuild_worktime', stdout=StringIO())
+        self.assertEqual(self.timesheet('2017-01')['total_minutes'], 465 + 645)
+
+    def test_culling_keeps_versions(self):
+        invalidate_timesheets()
+        versions = [version_cache().get(key) for key in (VERSION_KEY, EmployeeCodeCache.version_key)]
+        # Culling the default cache drops timesheets, never the stamps that
+        # tell which of them are stale.
+        django_cache.clear()
+        self.assertEqual([version_cache().get(key) for key in (VERSION_KEY, EmployeeCodeCache.version_key)],
+                         versions)
+        self.assertIsNotNone(versions[0])
+
+    def test_open_month_and_department_page(self):
+        self.assertEqual([(day['date'], day['net_minutes']) for day in self.timesheet('2017-02')['days']],
+                         [('2017-02-02', 0)])
+        response = self.client.get(reverse('department-timesheet-view',
+                                           kwargs={'department_id': self.department.pk, 'month': '2017-01'}))
+        self.assertContains(response, 'Иванов Иван')
+        self.assertContains(response, '7:45')
+        self.assertEqual(self.client.get('/timesheet/{}/2017-13/'.format(self.employee.pk)).status_code, 404)
+
+
+class TestAnomalies(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+        self.other = Employee.objects.create(surname='Петров', name='Пётр', code='2', department=department)
+
+    def checkin(self, arrival, leaving, employee=None):
+        return (employee or self.employee).checkin_set.create(
+            arrival_timestamp=make_aware(dt(2017, 1, *arrival)) if arrival else None,
+            leaving_timestamp=make_aware(dt(2017, 1, *leaving)) if leaving else None)
+
+    def anomalies(self):
+        return sorted(CheckInAnomaly.objects.values_list('checkin_id', 'kind'))
+
+    def scan(self, day, full=False):
+        return scan_anomalies(full=full, now=make_aware(dt(2017, 1, day, 12, 0)))
+
+    def test_leave_after_limit_is_not_matched(self):
+        self.employee.arrive(now=make_aware(dt(2017, 1, 2, 9, 0)))
+        with self.assertRaisesMessage(ValueError, 'forgot_to_leave_and_arrive'):
+            self.employee.leave(now=make_aware(dt(2017, 1, 3, 12, 0)))
+        self.assertEqual(self.employee.checkin_set.filter(leaving_timestamp__isnull=True).count(), 1)
+
+    def test_incremental_scan(self):
+        forgot_to_leave = self.checkin((2, 9, 0), None)
+        self.checkin((3, 9, 0), (3, 18, 0))
+        forgot_to_arrive = self.checkin(None, (4, 18, 0))
+        overlong = self.checkin((5, 9, 0), (6, 14, 0))
+        overlapping = self.checkin((6, 13, 0), (6, 20, 0))
+        self.checkin((6, 13, 0), (6, 20, 0), employee=self.other)
+        self.assertEqual(self.scan(7).found, 4)
+        self.assertEqual(self.anomalies(), [
+            (forgot_to_leave.pk, CheckInAnomaly.MISSING_LEAVING),
+            (forgot_to_arrive.pk, CheckInAnomaly.MISSING_ARRIVAL),
+            (overlong.pk, CheckInAnomaly.OVERLONG),
+            (overlapping.pk, CheckInAnomaly.OVERLAP),
+        ])
+
+        overlong.leaving_timestamp = make_aware(dt(2017, 1, 5, 18, 0))
+        overlong.save()
+        scan = self.scan(7)
+        # Rechecked from a workday before the change only.
+        self.assertEqual((scan.employees, scan.found), (1, 1))
+        self.assertEqual(self.anomalies(), [
+            (forgot_to_leave.pk, CheckInAnomaly.MISSING_LEAVING),
+            (forgot_to_arrive.pk, CheckInAnomaly.MISSING_ARRIVAL),
+        ])
+
+        still_working = self.checkin((10, 9, 0), None, employee=self.other)
+        self.assertEqual(self.scan(10).found, 0)
+        scan = self.scan(12)
+        self.assertEqual((scan.employees, scan.found), (1, 1))
+        self.assertIn((still_working.pk, CheckInAnomaly.MISSING_LEAVING), self.anomalies())
+        self.assertEqual(self.scan(12, full=True).found, 3)
+
+    def test_admin_report(self):
+        self.checkin(None, (4, 18, 0))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post(reverse('admin:main_checkinanomaly_scan'), follow=True)
+        self.assertContains(response, 'найдено ошибок: 1')
+        self.assertContains(response, 'Нет прихода')
+        out = StringIO()
+        call_command('scan_anomalies', stdout=out)
+        self.assertIn('0 anomalies found, 1 in total', out.getvalue())
+
+
+class TestRoster(TestCase):
+    def setUp(self):
+        self.warehouse = Department.objects.create(name='Склад', acronym='СК')
+        self.ivanov = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=self.warehouse)
+        Employee.objects.create(surname='Петров', name='Пётр', code='2', department=self.warehouse)
+
+    def test_sync_csv(self):
+        self.assertEqual(employee_cache.get('3'), None)
+        roster = ('Код;Фамилия;Имя;Отчество;Отдел;Название отдела\n'
+                  '1;Иванов;Иван;Иванович;ОФ;Офис\n'
+                  '3;Сидоров;Сидор;;склад;\n'
+                  '3;Сидоров;Сидор;;СК;\n'
+                  '4;Смирнов;;;СК;\n'
+                  '12 34;Кузнецов;Сергей;;СК;\n'
+                  '1234567;Кузнецов;Сергей;;СК;\n')
+        with tempfile.NamedTemporaryFile(suffix='.csv') as f:
+            f.write(roster.encode('utf-8-sig'))
+            f.flush()
+            call_command('sync_roster', f.name, '--dry-run', stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(Employee.objects.count(), 2)
+            out, err = StringIO(), StringIO()
+            call_command('sync_roster', f.name, stdout=out, stderr=err)
+        self.assertIn('Created 1, updated 1 (1 moved to another department), unchanged 0 employees; '
+                      'created 1 departments. 1 employees are not in the roster, 4 rows skipped.', out.getvalue())
+        self.assertEqual(err.getvalue().splitlines(), [
+            'Line 4: duplicate code 3', 'Line 5: empty name', 'Line 6: bad code 12 34: the kiosk takes 1 to 6 digits',
+            'Line 7: bad code 1234567: the kiosk takes 1 to 6 digits'])
+        self.ivanov.refresh_from_db()
+        self.assertEqual((self.ivanov.patronym, self.ivanov.department.name), ('Иванович', 'Офис'))
+        sidorov = Employee.objects.get(code='3')
+        self.assertEqual(sidorov.department, self.warehouse)
+        self.assertEqual(employee_cache.get('3').id, sidorov.pk)
+
+    def test_blank_patronyms_are_unchanged(self):
+        Employee.objects.filter(code='2').update(patronym=None)
+        self.ivanov.patronym = ''
+        self.ivanov.save()
+        modified = self.ivanov.modified
+        rows = [(2, {'code': '1', 'surname': 'Иванов', 'name': 'Иван', 'patronym': '', 'department': 'СК'}),
+                (3, {'code': '2', 'surname': 'Петров', 'name': 'Пётр', 'department': 'СК'})]
+        summary = sync_roster(rows)
+        self.assertEqual((summary.updated, summary.unchanged), (0, 2))
+        self.ivanov.refresh_from_db()
+        self.assertEqual((self.ivanov.patronym, self.ivanov.modified), ('', modified))
+
+    def test_admin_upload(self):
+        wb = Workbook()
+        wb.active.append(('Код', 'Фамилия', 'Имя', 'Отдел'))
+        wb.active.append((5, 'Кузнецов', 'Сергей', 'СК'))
+        xlsx = BytesIO()
+        wb.save(xlsx)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:main_employee_roster')
+        self.assertEqual(self.client.get(reverse('admin:main_employee_changelist')).status_code, 200)
+        response = self.client.post(url, {'roster': SimpleUploadedFile('roster.xlsx', xlsx.getvalue())}, follow=True)
+        self.assertContains(response, 'Добавлено: 1')
+        self.assertEqual(Employee.objects.get(code='5').department, self.warehouse)
+        response = self.client.post(url, {'roster': SimpleUploadedFile('roster.txt', b'code')})
+        self.assertContains(response, 'Roster must be a .csv or .xlsx file')
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True, SLOW_REQUEST_MS=0, METRICS_TOKEN='secret')
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        metrics.reset()
+        django_cache.delete(WORKERS_KEY)
+        department = Department.objects.create(name='Склад', acronym='СК')
+        Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+
+    def test_slow_log_and_metrics(self):
+        url = reverse('checkin-view', kwargs={'code': '1', 'action': 'arrival'})
+        with self.assertLogs('main.instrumentation', 'WARNING') as logs:
+            self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            b''.join(self.client.get(reverse('api-summary-view', kwargs={'fmt': 'csv'}),
+                                     {'date_from': '2017-01-01', 'date_to': '2017-02-01'}).streaming_content)
+        self.assertRegex(logs.output[0], r'Slow request POST /checkin/1/arrival/ \(checkin-view\): [\d.]+ ms, '
+                                         r'\d+ queries in [\d.]+ ms, \d+ rows\n')
+        self.assertRegex(logs.output[0], r'\n  [\d.]+ ms: INSERT INTO "main_checkin"')
+        self.assertIn('(api-summary-view)', logs.output[1])
+        self.assertFalse(connection.force_debug_cursor)
+
+        with self.assertLogs('main.instrumentation', 'WARNING') as logs:
+            self.assertEqual(self.client.get(reverse('metrics-view')).status_code, 403)
+            response = self.client.get(reverse('metrics-view'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('Slow request GET /metrics (metrics-view)', logs.output[1])
+        lines = response.content.decode().splitlines()
+        self.assertIn('sitapea_request_seconds_count{view="checkin-view"} 1', lines)
+        self.assertIn('sitapea_request_rows_count{view="api-summary-view"} 1', lines)
+        self.assertIn('sitapea_slow_requests_total{view="checkin-view"} 1', lines)
+        self.assertTrue(any(line.startswith('sitapea_request_queries{view="checkin-view",quantile="0.99"}')
+                            for line in lines))
+
+    def test_disabled(self):
+        with override_settings(INSTRUMENTATION_ENABLED=False):
+            self.assertEqual(self.client.get(reverse('metrics-view'), HTTP_AUTHORIZATION='Bearer secret')
+                             .status_code, 404)
+
+
+class TestDatabase(TransactionTestCase):
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_copy_database(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+        employee.arrive(now=make_aware(dt(2017, 1, 2, 9, 0)))
+        employee.leave(now=make_aware(dt(2017, 1, 2, 18, 0)))
+        Employee.objects.filter(pk=employee.pk).update(modified=make_aware(dt(2017, 1, 1)))
+
+        target = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        target.close()
+        connections.databases['copy_target'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': target.name}
+        connections.ensure_defaults('copy_target')
+        try:
+            call_command('migrate', database='copy_target', verbosity=0)
+            out = StringIO()
+            call_command('copy_database', 'default', target='copy_target', batch_size=1, interactive=False,
+                         stdout=out)
+            self.assertIn('main.CheckIn: 1 rows', out.getvalue())
+            self.assertIn('tables match', out.getvalue())
+            self.assertEqual(Employee.objects.using('copy_target').get().modified, make_aware(dt(2017, 1, 1)))
+            self.assertEqual(CheckInChange.objects.using('copy_target').count(), 2)
+
+            CheckIn.objects.using('copy_target').update(comment='Изменено')
+            with self.assertRaisesMessage(CommandError, 'Tables differ: main.CheckIn'):
+                call_command('copy_database', 'default', target='copy_target', verify_only=True, stdout=StringIO())
+        finally:
+            connections['copy_target'].close()
+            del connections.databases['copy_target']
+            os.remove(target.name)
+
+
+class TestEmployeeCodeCache(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1',
+                                                department=self.department)
+        self.cache = EmployeeCodeCache(max_size=2)
+
+    def test_hit(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get('1'), EmployeeRecord(self.employee.id, 'Иван', 'Иванов'))
+            self.assertEqual(self.cache.get('1').surname, 'Иванов')
+
+    def test_invalidated_on_save_and_delete(self):
+        self.cache.get('1')
+        self.employee.surname = 'Петров'
+        self.employee.save()
+        self.assertEqual(self.cache.get('1').surname, 'Петров')
+        self.employee.delete()
+        self.assertIsNone(self.cache.get('1'))
+
+    def test_version_stamp_from_another_worker(self):
+        self.cache.get('1')
+        Employee.objects.filter(pk=self.employee.pk).update(name='Пётр')
+        self.assertEqual(self.cache.get('1').name, 'Иван')
+        version_cache().set(EmployeeCodeCache.version_key, 'changed elsewhere')
+        self.assertEqual(self.cache.get('1').name, 'Пётр')
+
+    def test_unknown_codes_are_negatively_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.get('404'))
+            self.assertIsNone(self.cache.get('404'))
+        with mock.patch('main.cache.time.monotonic', return_value=time.monotonic() + 31):
+            with self.assertNumQueries(1):
+                self.cache.get('404')
+        Employee.objects.create(surname='Петров', name='Пётр', code='404', department=self.department)
+        self.assertEqual(self.cache.get('404').name, 'Пётр')
+
+    def test_lru_eviction(self):
+        Employee.objects.create(surname='Петров', name='Пётр', code='2', department=self.department)
+        self.cache.get('1')
+        self.cache.get('2')
+        self.cache.get('1')
+        self.cache.get('3')
+        self.assertEqual(list(self.cache.entries), ['1', '3'])
+
+
+class TestKiosk(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1234', department=department)
+
+    def test_no_code_directory(self):
+        # Kiosks get names only in the answers to the taps.
+        response = self.client.get(reverse('index-view'))
+        self.assertNotContains(response, 'Иванов')
+        self.assertEqual(self.client.get('/checkin/names/').status_code, 404)
+
+    def test_page_has_no_jquery(self):
+        response = self.client.get(reverse('index-view'))
+        self.assertContains(response, '/static/main/js/main.js')
+        self.assertNotContains(response, 'jquery')
+
+
+class TestCheckInAdmin(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(user)
+        department = Department.objects.create(name='Склад', acronym='СК')
+        for code in '12':
+            employee = Employee.objects.create(surname='Иванов', name='Иван', code=code, department=department)
+            for day in range(1, 6):
+                employee.checkin_set.create(arrival_timestamp=make_aware(dt(2017, 1, day, 9, 0)),
+                                            leaving_timestamp=make_aware(dt(2017, 1, day, 18, 0)))
+        self.url = reverse('admin:main_checkin_changelist')
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.client.get(self.url)
+        # Session, user and the page itself; the count is cached and the
+        # filters load their options lazily.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context['cl'].result_list), 10)
+
+    def test_keyset_pages(self):
+        expected = list(CheckIn.objects.order_by('-effective_timestamp', '-pk').values_list('pk', flat=True))
+        seen = []
+        url = self.url
+        with mock.patch.object(CheckInAdmin, 'list_per_page', 4):
+            while url:
+                cl = self.client.get(url).context['cl']
+                seen.extend(checkin.pk for checkin in cl.result_list)
+                url = cl.next_cursor_url and self.url + cl.next_cursor_url
+        self.assertEqual(seen, expected)
+        # A bad cursor shows the first page.
+        for cursor in ('x', '{}:1'.format(10**20)):
+            cl = self.client.get(self.url, {'cursor': cursor}).context['cl']
+            self.assertEqual(len(cl.result_list), 10)
+
+    def test_filters(self):
+        employee = Employee.objects.get(code='2')
+        cl = self.client.get(self.url, {'date_from': '2017-01-02', 'date_to': '2017-01-04',
+                                        'employee': employee.pk}).context['cl']
+        self.assertEqual(sorted(localtime(checkin.arrival_timestamp).day for checkin in cl.result_list), [2, 3])
+        self.assertEqual({checkin.employee_id for checkin in cl.result_list}, {employee.pk})
+        cl = self.client.get(self.url, {'department': employee.department_id}).context['cl']
+        self.assertEqual(len(cl.result_list), 10)
+
+    def test_dates_without_leading_zeros(self):
+        response = self.client.get(self.url, {'date_from': '2017-1-2', 'date_to': '2017-1-4'})
+        self.assertEqual(len(response.context['cl'].result_list), 4)
+        self.assertContains(response, reverse('report-range-download-view',
+                                              kwargs={'date_from': '2017-01-02', 'date_to': '2017-01-04'}))
+
+        response = self.client.get(self.url, {'date_from': '2017-13-01'})
+        self.assertRedirects(response, self.url + '?e=1', fetch_redirect_response=False)
+
+    def test_autocomplete(self):
+        Employee.objects.filter(code='2').update(surname='Петров')
+        url = reverse('admin:main_checkin_autocomplete', kwargs={'model_name': 'employee'})
+        results = self.client.get(url, {'term': 'Пет'}).json()['results']
+        self.assertEqual([result['text'] for result in results], ['Петров Иван None'])
+
+
+class TestCheckInBatch(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        self.employee = Employee.objects.create(surname='Иванов', name='Иван', code='1', department=department)
+
+    def post(self, events):
+        return self.client.post(reverse('checkin-batch-view'), json.dumps({'events': events}),
+                                content_type='application/json')
+
+    def test_applies_events_in_order_with_their_time(self):
+        leaving = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        arrival = leaving - timedelta(hours=9)
+        response = self.post([
+            {'id': 'a', 'code': '1', 'action': 'arrival', 'timestamp': to_epoch_us(arrival) // 1000},
+            {'id': 'b', 'code': '1', 'action': 'leaving', 'timestamp': to_epoch_us(leaving) // 1000},
+            {'id': 'c', 'code': '2', 'action': 'leaving', 'timestamp': to_epoch_us(leaving) // 1000},
+        ])
+        self.assertEqual(response.json()['results'], [
+            {'id': 'a', 'employee_name': 'Иван', 'employee_surname': 'Иванов', 'action': 'arrival'},
+            {'id': 'b', 'employee_name': 'Иван', 'employee_surname': 'Иванов', 'action': 'leaving'},
+            {'id': 'c', 'error': 'employee_does_not_exist'},
+        ])
+        checkin = self.employee.checkin_set.get()
+        self.assertEqual((checkin.arrival_timestamp, checkin.leaving_timestamp), (arrival, leaving))
+
+    def test_idempotent_by_event_id(self):
+        arrival = to_epoch_us(timezone.now() - timedelta(hours=2)) // 1000
+        events = [{'id': 'a', 'code': '1', 'action': 'arrival', 'timestamp': arrival}]
+        first = self.post(events).json()
+        events.append({'id': 'b', 'code': '1', 'action': 'arrival', 'timestamp': arrival + 3600000})
+        second = self.post(events).json()
+        self.assertEqual(second['results'][0], first['results'][0])
+        self.assertEqual(second['results'][1]['warning'], 'forgot_to_leave')
+        self.assertEqual(self.employee.checkin_set.count(), 2)
+        self.assertEqual(CheckInEvent.objects.count(), 2)
+
+    def test_out_of_order_events(self):
+        # Another kiosk has sent a later arrival before this one's queue.
+        now = timezone.now().replace(microsecond=0)
+        self.employee.arrive(now - timedelta(hours=1))
+        response = self.post([
+            {'id': 'a', 'code': '1', 'action': 'arrival', 'timestamp': to_epoch_us(now - timedelta(hours=5)) // 1000},
+            {'id': 'b', 'code': '1', 'action': 'leaving', 'timestamp': to_epoch_us(now - timedelta(hours=3)) // 1000},
+            {'id': 'c', 'code': '1', 'action': 'leaving', 'timestamp': to_epoch_us(now - timedelta(hours=2)) // 1000},
+        ])
+        self.assertEqual([result.get('warning') for result in response.json()['results']],
+                         [None, None, 'forgot_to_leave_and_arrive'])
+        self.assertEqual(
+            list(self.employee.checkin_set.order_by('effective_timestamp')
+                 .values_list('arrival_timestamp', 'leaving_timestamp')),
+            [(now - timedelta(hours=5), now - timedelta(hours=3)), (None, now - timedelta(hours=2)),
+             (now - timedelta(hours=1), None)])
+
+    def test_timestamps_from_the_future_are_clamped(self):
+        self.post([{'id': 'a', 'code': '1', 'action': 'arrival', 'timestamp': 32503680000000}])
+        self.assertLessEqual(self.employee.checkin_set.get().arrival_timestamp, timezone.now())
+
+    def test_stale_timestamps_are_rejected(self):
+        with self.assertLogs('main.views', 'WARNING'):
+            response = self.post([{'id': 'a', 'code': '1', 'action': 'arrival', 'timestamp': 0}])
+        self.assertEqual(response.json()['results'], [{'id': 'a', 'error': 'stale_timestamp'}])
+        self.assertFalse(self.employee.checkin_set.exists())
+        self.assertEqual(self.post([{'id': 'a', 'code': '1', 'action': 'arrival', 'timestamp': 0}]).json(),
+                         response.json())
+
+    def test_bad_request(self):
+        response = self.client.post(reverse('checkin-batch-view'), 'nonsense', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post([{'id': 'a', 'code': '1', 'action': 'lunch'}]).json()['results'],
+                         [{'id': 'a', 'error': 'bad_request'}])
+
+
+class TestDeployment(LiveServerTestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Склад', acronym='СК')
+        for code in ('1', '2'):
+            Employee.objects.create(surname='Иванов', name='Иван', code=code, department=department)
+
+    def test_health(self):
+        response = self.client.get(reverse('health-view'))
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertIn('no-cache', response['Cache-Control'])
+        with mock.patch('django.db.backends.utils.CursorWrapper.execute', side_effect=DatabaseError):
+            self.assertEqual(self.client.get(reverse('health-view')).status_code, 503)
+
+    def test_gunicorn_pools(self):
+        path = os.path.join(settings.BASE_DIR, '..', 'config', 'gunicorn.conf.py')
+        with mock.patch.dict(os.environ, {'SITAPEA_POOL': 'kiosk'}):
+            kiosk = runpy.run_path(path)
+        with mock.patch.dict(os.environ, {'SITAPEA_POOL': 'reports', 'SITAPEA_REPORTS_WORKERS': '4'}):
+            reports = runpy.run_path(path)
+        self.assertEqual((kiosk['bind'], kiosk['worker_class'], kiosk['threads']), ('localhost:8000', 'gthread', 16))
+        self.assertEqual((reports['bind'], reports['worker_class'], reports['workers']), ('localhost:8001', 'sync', 4))
+        with mock.patch.dict(os.environ, {'SITAPEA_POOL': 'all'}), self.assertRaises(RuntimeError):
+            runpy.run_path(path)
+
+    def test_loadtest(self):
+        out = StringIO()
+        call_command('loadtest', kiosk_url=self.live_server_url, kiosks=2, taps=2, report_clients=1, stdout=out)
+        self.assertIn('Taps alone: 4 taps', out.getvalue())
+        self.assertIn('Taps under report load: 4 taps', out.getvalue())
+        self.assertIn('p95 slowdown under report load', out.getvalue())
+        self.assertEqual(CheckInEvent.objects.count(), 8)
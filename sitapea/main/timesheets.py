@@ -0,0 +1,139 @@
+"""
+Month timesheets of employees.
+
+A timesheet has a row per local day with the first arrival, the last
+leaving, the net and the night bonus minutes of the check-ins arriving
+that day, and the month totals. Timesheets of closed months are kept in
+Django's shared cache by employee and month; saving or deleting a
+check-in drops the months it falls in, and a rebuild of the rollup drops
+them all by replacing the version stamp in their keys. The keys also
+carry the digest of the work rules they were computed under.
+"""
+import datetime
+from collections import namedtuple
+from itertools import chain
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from main.cache import version_cache
+from main.helpers import minutes_to_hhmm, start_of_day
+from main.models import ArchivedCheckIn, CheckIn, DailyWorktime, WorkingTime
+from main.workrules import get_work_rules
+
+TIMESHEET_TIMEOUT = 60 * 60 * 24 * 31
+VERSION_KEY = 'main:timesheet-version'
+TIMESHEET_KEY = 'main:timesheet:{}:{}:{}:{:%Y-%m}'
+
+
+class TimesheetDay(namedtuple('TimesheetDay', ['date', 'arrival', 'leaving', 'net_minutes', 'night_bonus_minutes'])):
+    @property
+    def net_hhmm(self):
+        return minutes_to_hhmm(self.net_minutes)
+
+
+class Timesheet(namedtuple('Timesheet', ['employee_id', 'month', 'days', 'total', 'wo_night_shift_bonus'])):
+    @property
+    def total_hhmm(self):
+        return minutes_to_hhmm(self.total)
+
+    @property
+    def wo_night_shift_bonus_hhmm(self):
+        return minutes_to_hhmm(self.wo_night_shift_bonus)
+
+
+def parse_month(value):
+    """First day of a YYYY-MM month, ValueError if bad."""
+    return datetime.datetime.strptime(value, '%Y-%m').date()
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=31)).replace(day=1)
+
+
+def is_closed(month):
+    return month < timezone.localtime(timezone.now()).date().replace(day=1)
+
+
+def build_timesheets(employee_ids, month):
+    """Timesheets of a month by employee id, read from the rollup and the check-ins."""
+    date_from, date_to = month, next_month(month)
+    sources = [CheckIn, ArchivedCheckIn] if is_closed(month) else [CheckIn]
+    days = {}
+    for employee_id, date, net, bonus in DailyWorktime.objects\
+            .filter(employee_id__in=employee_ids, date__gte=date_from, date__lt=date_to)\
+            .values_list('employee_id', 'date', 'net_minutes', 'night_bonus_minutes'):
+        days[employee_id, date] = [None, None, net, bonus]
+
+    checkins = chain(*[
+        model.objects
+        .filter(employee_id__in=employee_ids,
+                effective_timestamp__gte=start_of_day(date_from),
+                effective_timestamp__lt=start_of_day(date_to))
+        .values_list('employee_id', 'effective_timestamp', 'arrival_timestamp', 'leaving_timestamp')
+        for model in sources
+    ])
+    for employee_id, effective, arrival, leaving in checkins:
+        # Days are those of the arrival, as in the rollup.
+        day = days.setdefault((employee_id, timezone.localtime(effective).date()), [None, None, 0, 0])
+        if arrival and (day[0] is None or arrival < day[0]):
+            day[0] = arrival
+        if leaving and (day[1] is None or leaving > day[1]):
+            day[1] = leaving
+
+    working_time = {}
+    for model in sources:
+        totals = model.objects.filter(employee_id__in=employee_ids)\
+            .working_time_by_employee(str(date_from), str(date_to))
+        for employee_id, time in totals.items():
+            working_time[employee_id] = WorkingTime(*map(sum, zip(working_time.get(employee_id, (0, 0)), time)))
+
+    return {
+        employee_id: Timesheet(
+            employee_id=employee_id,
+            month=month,
+            days=[TimesheetDay(date, *values) for (day_employee_id, date), values in sorted(days.items())
+                  if day_employee_id == employee_id],
+            total=working_time.get(employee_id, WorkingTime(0, 0)).total,
+            wo_night_shift_bonus=working_time.get(employee_id, WorkingTime(0, 0)).wo_night_shift_bonus,
+        )
+        for employee_id in employee_ids
+    }
+
+
+def timesheet_keys(employee_ids, months):
+    """Cache keys by (employee_id, month)."""
+    version = version_cache().get(VERSION_KEY) or ''
+    rules = get_work_rules().digest
+    return {(employee_id, month): TIMESHEET_KEY.format(version, rules, employee_id, month)
+            for employee_id, month in zip(employee_ids, months)}
+
+
+def get_timesheets(employee_ids, month):
+    """Timesheets of a month by employee id, closed months from the cache where possible."""
+    if not is_closed(month):
+        return build_timesheets(employee_ids, month)
+    keys = timesheet_keys(employee_ids, [month] * len(employee_ids))
+    cached = cache.get_many(list(keys.values()))
+    timesheets = {employee_id: cached[key] for (employee_id, _), key in keys.items() if key in cached}
+    missing = [employee_id for employee_id in employee_ids if employee_id not in timesheets]
+    if missing:
+        built = build_timesheets(missing, month)
+        cache.set_many({keys[employee_id, month]: timesheet for employee_id, timesheet in built.items()},
+                       TIMESHEET_TIMEOUT)
+        timesheets.update(built)
+    return timesheets
+
+
+def get_timesheet(employee_id, month):
+    return get_timesheets([employee_id], month)[employee_id]
+
+
+def invalidate_timesheets(months=None):
+    """Drop the cached timesheets of (employee_id, month) pairs, or all of them."""
+    if months is None:
+        version_cache().set(VERSION_KEY, uuid4().hex, None)
+        return
+    employee_ids, months = zip(*months) if months else ((), ())
+    cache.delete_many(list(timesheet_keys(employee_ids, months).values()))
@@ -1,43 +1,192 @@
-from django.db.models.functions import Coalesce
-from django.utils.timezone import localtime
-from django.http import JsonResponse, HttpResponse
+import csv
+import hashlib
+import json
+import logging
+import re
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.timezone import localtime, utc
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse, \
+    StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.core.urlresolvers import reverse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView, View
-from openpyxl import Workbook
-from main.models import Employee, CheckIn
+from main.cache import employee_cache
+from main.instrumentation import render_metrics
+from django.utils.dateparse import parse_date
+from main.helpers import EPOCH, minutes_to_hhmm, start_of_day, to_epoch_us
+from main.models import Department, Employee, CheckIn, CheckInChange, CheckInEvent, DailyWorktime, ReportJob, \
+    effective_checkins
+from main.timesheets import get_timesheets, parse_month
+from main.xlsx import save_workbook, write_only_workbook
 
 
 class IndexView(TemplateView):
     template_name = 'main/index.html'
 
 
+@method_decorator(never_cache, name='get')
+class HealthView(View):
+    """Whether this server and its database answer, for nginx, supervisors and monitoring."""
+    def get(self, request):
+        try:
+            with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except DatabaseError:
+            return JsonResponse({'status': 'error', 'database': 'unavailable'}, status=503)
+        return JsonResponse({'status': 'ok', 'database': 'ok', 'time': api_timestamp(timezone.now())})
+
+
+CHECKIN_ACTIONS = ('arrival', 'leaving')
+CHECKIN_BATCH_MAX_SIZE = 100
+# Queued taps older than this come from a kiosk whose clock has reset,
+# or would land in a closed month; they are logged and not applied.
+CHECKIN_EVENT_MAX_AGE = timedelta(days=7)
+
+logger = logging.getLogger(__name__)
+
+
+def check_in(code, action, now=None):
+    record = employee_cache.get(code)
+    if record is None:
+        return {'error': 'employee_does_not_exist'}
+    employee = Employee(pk=record.id, name=record.name, surname=record.surname)
+    json_response = {
+        'employee_name': employee.name,
+        'employee_surname': employee.surname,
+        'action': action,
+    }
+    try:
+        if action == 'arrival':
+            employee.arrive(now)
+        elif action == 'leaving':
+            employee.leave(now)
+    except ValueError as e:
+        json_response['warning'] = str(e)
+    return json_response
+
+
 class CheckInView(View):
     def post(self, request, code, action):
         if request.is_ajax:
-            try:
-                employee = Employee.objects.get(code=code)
-                json_response = {
-                    'employee_name': employee.name,
-                    'employee_surname': employee.surname,
-                    'action': action,
-                }
-                try:
-                    if action == 'arrival':
-                        employee.arrive()
-                    elif action == 'leaving':
-                        employee.leave()
-                except ValueError as e:
-                    json_response['warning'] = str(e)
-                finally:
-                    return JsonResponse(json_response)
-            except Employee.DoesNotExist:
-                return JsonResponse({'error': 'employee_does_not_exist'})
+            return JsonResponse(check_in(code, action))
+
+
+class CheckInBatchView(View):
+    """
+    Applies the taps queued by a kiosk, in their original order and with
+    their original time, in one transaction. Events already applied are
+    answered with their stored result, so a batch can be resent safely.
+    """
+    def post(self, request):
+        try:
+            events = json.loads(request.body.decode('utf-8'))['events']
+            events = [(str(event['id']), str(event['code']), event['action'], event.get('timestamp'))
+                      for event in events[:CHECKIN_BATCH_MAX_SIZE]]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'bad_request'}, status=400)
+
+        # Everything is read before the transaction, whose first statement
+        # is then a write (see Employee.leave).
+        applied = {
+            event.event_id: json.loads(event.result)
+            for event in CheckInEvent.objects.filter(event_id__in=[event[0] for event in events])
+        }
+        for event_id, code, action, timestamp in events:
+            if event_id not in applied:
+                employee_cache.get(code)
+
+        now = timezone.now()
+        new_events = []
+        try:
+            with transaction.atomic():
+                for event_id, code, action, timestamp in events:
+                    if event_id in applied:
+                        continue
+                    if action not in CHECKIN_ACTIONS:
+                        applied[event_id] = {'error': 'bad_request'}
+                        continue
+                    timestamp = client_timestamp(timestamp, now)
+                    if timestamp < now - CHECKIN_EVENT_MAX_AGE:
+                        logger.warning('Stale kiosk event %s: %s %s at %s', event_id, code, action,
+                                       timestamp.isoformat())
+                        applied[event_id] = {'error': 'stale_timestamp'}
+                    else:
+                        applied[event_id] = check_in(code, action, timestamp)
+                    new_events.append(CheckInEvent(event_id=event_id, code=code, action=action,
+                                                   timestamp=timestamp, result=json.dumps(applied[event_id])))
+                CheckInEvent.objects.bulk_create(new_events)
+        except IntegrityError:
+            # The same events were applied by a concurrent request.
+            return JsonResponse({'error': 'conflict'}, status=409)
+        return JsonResponse({'results': [dict(applied[event[0]], id=event[0]) for event in events]})
+
+
+def client_timestamp(milliseconds, now):
+    # Kiosk clocks are trusted for queued taps, but never into the future;
+    # see CHECKIN_EVENT_MAX_AGE for the past.
+    try:
+        timestamp = datetime.fromtimestamp(milliseconds / 1000, utc)
+    except (TypeError, ValueError, OverflowError):
+        return now
+    return min(timestamp, now)
+
+
+def report_response(kind, date_from, date_to, filename, specs=''):
+    # Reports are built by the report_worker command; a period whose data
+    # has not changed since the last build is served from the stored file.
+    job = ReportJob.objects.request(kind, date_from, date_to, filename, specs)
+    if job.status == ReportJob.DONE:
+        return artifact_response(job)
+    return redirect('report-job-view', pk=job.pk)
+
+
+def artifact_response(job):
+    content_type = 'application/zip' if job.specs else "application/ms-excel"
+    response = FileResponse(open(job.artifact_path, 'rb'), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename={}'.format(job.name)
+    return response
 
 
 class ReportDownloadView(View):
+    report_name = 'sitapea_report'
+    report_kind = 'detailed'
+
     def get(self, request, date_from, date_to=None):
+        return report_response(self.report_kind, date_from, date_to, self.name(date_from, date_to))
+
+    def name(self, date_from, date_to):
+        return '{}_{}{}.xlsx'.format(self.report_name, date_from, '_'+date_to if date_to else '')
 
-        wb = Workbook()
-        ws = wb.active
+    def build_workbook(self, date_from, date_to):
+        wb, ws = self.start_workbook(date_from, date_to)
+        for checkin in effective_checkins(date_from, date_to):
+            ws.append(self.checkin_row(checkin))
+        return wb
+
+    def start_workbook(self, date_from, date_to):
+        wb, ws = write_only_workbook()
+        ws.column_dimensions['A'].width = 30
+        ws.column_dimensions['B'].width = 20
+        ws.column_dimensions['C'].width = 20
+        ws.column_dimensions['D'].width = 20
+        ws.column_dimensions['E'].width = 20
+        ws.column_dimensions['F'].width = 20
+        ws.column_dimensions['I'].width = 60
+        ws.column_dimensions.group('J', 'M', hidden=True)
 
         ws.append(('Отчёт за период', date_from, date_to))
         titles = (
@@ -56,54 +205,32 @@ class ReportDownloadView(View):
             'Чистая разница',  # M
         )
         ws.append(titles)
-        ws.column_dimensions['A'].width = 30
-        ws.column_dimensions['B'].width = 20
-        ws.column_dimensions['C'].width = 20
-        ws.column_dimensions['D'].width = 20
-        ws.column_dimensions['E'].width = 20
-        ws.column_dimensions['F'].width = 20
-        ws.column_dimensions['I'].width = 60
-        ws.column_dimensions.group('J', 'M', hidden=True)
-        qs = CheckIn.objects\
-            .annotate(arrival_or_leaving=Coalesce('arrival_timestamp', 'leaving_timestamp'))\
-            .order_by('employee__surname', 'employee__name', 'arrival_or_leaving')\
-            .select_related('employee', 'employee__department')
-        if date_to:
-            qs = qs.filter(arrival_or_leaving__date__gte=date_from)
-            qs = qs.filter(arrival_or_leaving__date__lt=date_to)
-        else:
-            qs = qs.filter(arrival_or_leaving__date=date_from)
-
-        for checkin in qs:
-            row = (
-                checkin.employee.surname,
-                checkin.employee.name,
-                checkin.employee.patronym,
-                checkin.employee.department.acronym,
-                localtime(checkin.arrival_timestamp).replace(tzinfo=None) if checkin.arrival_timestamp else None,
-                localtime(checkin.leaving_timestamp).replace(tzinfo=None) if checkin.leaving_timestamp else None,
-                checkin.workday_duration,
-                checkin.workday_duration_in_hhmm,
-                checkin.comment,
-                checkin.dinners_duration,
-                checkin.coffee_duration,
-                checkin.night_shift_bonus,
-                checkin.workday_duration_raw,
-            )
-            ws.append(row)
-
-        response = HttpResponse(content_type="application/ms-excel")
-        filename = 'sitapea_report_{}{}.xlsx'.format(date_from, '_'+date_to if date_to else '')
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
-        wb.save(response)
-        return response
+        return wb, ws
+
+    def checkin_row(self, checkin):
+        return (
+            checkin.employee.surname,
+            checkin.employee.name,
+            checkin.employee.patronym,
+            checkin.employee.department.acronym,
+            localtime(checkin.arrival_timestamp).replace(tzinfo=None) if checkin.arrival_timestamp else None,
+            localtime(checkin.leaving_timestamp).replace(tzinfo=None) if checkin.leaving_timestamp else None,
+            checkin.workday_duration,
+            checkin.workday_duration_in_hhmm,
+            checkin.comment,
+            checkin.dinners_duration,
+            checkin.coffee_duration,
+            checkin.night_shift_bonus,
+            checkin.workday_duration_raw,
+        )
 
 
 class ReportView(View):
     report_name = 'sitepea_report'
+    working_time_field = 'total'
 
-    def employee_time(self, employee, date_from, date_to):
-        return employee.working_hours_summary_in_date_range(date_from, date_to)
+    def employee_time(self, working_time):
+        return minutes_to_hhmm(getattr(working_time, self.working_time_field) if working_time else 0)
 
     def name(self, date_from, date_to):
         return '{}_{}{}.xlsx'.format(self.report_name, date_from, '_'+date_to if date_to else '')
@@ -111,10 +238,28 @@ class ReportView(View):
 
 class SummaryReportView(ReportView):
     report_name = 'sitapea_summary_report'
+    report_kind = 'summary'
+
     def get(self, request, date_from, date_to):
+        return report_response(self.report_kind, date_from, date_to, self.name(date_from, date_to))
 
-        wb = Workbook()
-        ws = wb.active
+    def build_workbook(self, date_from, date_to):
+        wb, ws = self.start_workbook(date_from, date_to)
+        qs = Employee.objects\
+            .order_by('surname', 'name')\
+            .select_related('department')
+        working_time = DailyWorktime.objects.working_time_by_employee(date_from, date_to)
+
+        for employee in qs.iterator():
+            ws.append(self.employee_row(employee, working_time.get(employee.id)))
+        return wb
+
+    def start_workbook(self, date_from, date_to):
+        wb, ws = write_only_workbook()
+        ws.column_dimensions['A'].width = 30
+        ws.column_dimensions['B'].width = 20
+        ws.column_dimensions['C'].width = 20
+        ws.column_dimensions['D'].width = 20
 
         ws.append(('Суммарный отчёт за период', date_from, date_to))
         titles = (
@@ -125,35 +270,385 @@ class SummaryReportView(ReportView):
             'Отработано часов:минут',
         )
         ws.append(titles)
-        ws.column_dimensions['A'].width = 30
-        ws.column_dimensions['B'].width = 20
-        ws.column_dimensions['C'].width = 20
-        ws.column_dimensions['D'].width = 20
+        return wb, ws
+
+    def employee_row(self, employee, working_time):
+        return (
+            employee.surname,
+            employee.name,
+            employee.patronym,
+            employee.department.acronym,
+            self.employee_time(working_time),
+        )
+
+
+class ReportWONightShiftView(SummaryReportView):
+    report_name = 'sitapea_report_wo_night_shift'
+    report_kind = 'wo_night_shift'
+    working_time_field = 'wo_night_shift_bonus'
+
+
+REPORT_VIEWS = {view.report_kind: view for view in (ReportDownloadView, SummaryReportView, ReportWONightShiftView)}
+BATCH_REPORTS_MAX = 50
+BATCH_REPORT_KIND = 'batch'
+REPORT_SPEC_RE = re.compile(r'^(?P<kind>\w+):(?P<date_from>\d{4}-\d{2}-\d{2}):(?P<date_to>\d{4}-\d{2}-\d{2})$')
+
+
+def parse_report_specs(specs):
+    """[(kind, date_from, date_to)] from 'kind:YYYY-MM-DD:YYYY-MM-DD' strings, ValueError if one is bad."""
+    reports = []
+    for spec in specs:
+        match = REPORT_SPEC_RE.match(spec)
+        if not match or match.group('kind') not in REPORT_VIEWS:
+            raise ValueError('Bad report: {}'.format(spec))
+        if parse_date(match.group('date_from')) >= parse_date(match.group('date_to')):
+            raise ValueError('Empty period: {}'.format(spec))
+        reports.append((match.group('kind'), match.group('date_from'), match.group('date_to')))
+    return reports
+
+
+def build_batch(reports):
+    """
+    Named workbooks of several (kind, date_from, date_to) reports, built
+    from one scan of the check-ins and one of the daily rollup over the
+    union of the periods.
+    """
+    books, detailed, summaries = [], [], []
+    for kind, date_from, date_to in reports:
+        view = REPORT_VIEWS[kind]()
+        wb, ws = view.start_workbook(date_from, date_to)
+        books.append((view.name(date_from, date_to), wb))
+        if kind == ReportDownloadView.report_kind:
+            detailed.append((start_of_day(date_from), start_of_day(date_to), view, ws))
+        else:
+            summaries.append((view, ws))
+    date_from = min(report[1] for report in reports)
+    date_to = max(report[2] for report in reports)
+
+    if detailed:
+        for checkin in effective_checkins(date_from, date_to):
+            row = None
+            for start, end, view, ws in detailed:
+                if start <= checkin.effective_timestamp < end:
+                    row = row or view.checkin_row(checkin)
+                    ws.append(row)
+
+    if summaries:
+        periods = [(report[1], report[2]) for report in reports if report[0] != ReportDownloadView.report_kind]
+        working_time = DailyWorktime.objects.working_time_by_period(periods)
         qs = Employee.objects\
             .order_by('surname', 'name')\
             .select_related('department')
+        for employee in qs.iterator():
+            for (view, ws), period_time in zip(summaries, working_time):
+                ws.append(view.employee_row(employee, period_time.get(employee.id)))
+    return books
+
+
+def write_batch_archive(fileobj, reports):
+    # The workbooks are zip archives already, so they are stored as is.
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED) as archive:
+        for name, wb in build_batch(reports):
+            with tempfile.NamedTemporaryFile(suffix='.xlsx') as book:
+                save_workbook(wb, book)
+                book.flush()
+                archive.write(book.name, name)
+
+
+def batch_specs(reports):
+    """The specs of a ReportJob of the batch kind."""
+    return '\n'.join('{}:{}:{}'.format(*report) for report in reports)
+
+
+class BatchReportView(View):
+    """
+    Several reports in one ZIP, e.g. ?report=summary:2017-01-01:2017-02-01&report=detailed:...
+    Queued and served like the single reports, over the union of their periods.
+    """
+    def get(self, request):
+        try:
+            reports = parse_report_specs(request.GET.getlist('report'))
+        except ValueError:
+            reports = None
+        if not reports or len(reports) > BATCH_REPORTS_MAX:
+            return JsonResponse({'error': 'bad_request'}, status=400)
+        date_from = min(report[1] for report in reports)
+        date_to = max(report[2] for report in reports)
+        return report_response(BATCH_REPORT_KIND, date_from, date_to, 'sitapea_reports.zip', batch_specs(reports))
+
+
+class ReportJobView(View):
+    def get(self, request, pk):
+        job = get_object_or_404(ReportJob, pk=pk)
+        download_url = reverse('report-job-download-view', kwargs={'pk': job.pk})
+        if request.is_ajax():
+            return JsonResponse({
+                'id': job.pk,
+                'status': job.status,
+                'download_url': download_url if job.status == ReportJob.DONE else None,
+            })
+        if job.status == ReportJob.DONE:
+            return redirect(download_url)
+        return render(request, 'main/report_job.html', {'job': job})
+
+
+class ReportJobDownloadView(View):
+    def get(self, request, pk):
+        job = get_object_or_404(ReportJob, pk=pk, status=ReportJob.DONE)
+        if not job.artifact_exists():
+            raise Http404
+        return artifact_response(job)
+
+
+API_PAGE_SIZE = 5000
+API_PAGE_MAX = 50000
+API_CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class Echo(object):
+    def write(self, value):
+        return value
+
+
+def api_lines(fmt, fields, rows):
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+def api_timestamp(value):
+    return localtime(value).isoformat() if value else None
+
+
+def api_period(request):
+    """(date_from, date_to) of the request, ValueError if missing or bad."""
+    date_from, date_to = parse_date(request.GET.get('date_from', '')), parse_date(request.GET.get('date_to', ''))
+    if not date_from or not date_to or date_from >= date_to:
+        raise ValueError('Bad period')
+    return str(date_from), str(date_to)
 
-        for employee in qs:
-            working_hours_summary = self.employee_time(employee, date_from, date_to)
-            row = (
-                employee.surname,
-                employee.name,
-                employee.patronym,
-                employee.department.acronym,
-                working_hours_summary,
-            )
-            ws.append(row)
-
-        response = HttpResponse(content_type="application/ms-excel")
-        filename = self.name(date_from, date_to)
-        response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
-        wb.save(response)
+
+def api_state(request):
+    # Shared by the ETag and Last-Modified functions of a request.
+    if not hasattr(request, '_api_state'):
+        try:
+            date_from, date_to = api_period(request)
+        except ValueError:
+            request._api_state = (None, None)
+        else:
+            version, modified = ReportJob.objects.data_state(date_from, date_to)
+            etag = hashlib.md5('{}:{}'.format(version, request.get_full_path()).encode('utf-8')).hexdigest()
+            request._api_state = (etag, modified)
+    return request._api_state
+
+
+api_conditions = [
+    gzip_page,
+    condition(etag_func=lambda request, *args, **kwargs: api_state(request)[0],
+              last_modified_func=lambda request, *args, **kwargs: api_state(request)[1]),
+]
+
+
+@method_decorator(api_conditions, name='get')
+class CheckInApiView(View):
+    """
+    Check-ins of a period with their shift columns as JSON Lines or CSV,
+    ordered by effective timestamp. Pages continue after the cursor given
+    in the Link header of the previous one (also X-Next-Cursor), so that
+    a sync can resume from the last check-in it has seen.
+    """
+    fields = (
+        'id', 'employee_id', 'code', 'surname', 'name', 'patronym', 'department', 'arrival', 'leaving',
+        'effective', 'comment', 'workday_duration_raw', 'dinners_duration', 'coffee_duration',
+        'night_shift_minutes', 'night_shift_bonus', 'workday_duration', 'modified',
+    )
+
+    def get(self, request, fmt):
+        try:
+            date_from, date_to = api_period(request)
+            limit = int(request.GET.get('limit', API_PAGE_SIZE))
+            cursor = request.GET.get('cursor')
+            if cursor:
+                epoch_us, pk = (int(part) for part in cursor.split(':'))
+                effective_timestamp = EPOCH + timedelta(microseconds=epoch_us)
+        except (ValueError, OverflowError):
+            return JsonResponse({'error': 'bad_request'}, status=400)
+        if not 0 < limit <= API_PAGE_MAX:
+            return JsonResponse({'error': 'bad_request'}, status=400)
+
+        qs = CheckIn.objects\
+            .effective_in_date_range(date_from, date_to)\
+            .order_by('effective_timestamp', 'pk')
+        if cursor:
+            qs = qs.filter(Q(effective_timestamp__gt=effective_timestamp) |
+                           Q(effective_timestamp=effective_timestamp, pk__gt=pk))
+
+        # The page ends at the last key seen here, so that check-ins added
+        # meanwhile make it longer rather than skip past the cursor.
+        keys = list(qs.values_list('effective_timestamp', 'pk')[limit - 1:limit + 1])
+        next_cursor = None
+        if keys:
+            last_timestamp, last_pk = keys[0]
+            qs = qs.filter(Q(effective_timestamp__lt=last_timestamp) |
+                           Q(effective_timestamp=last_timestamp, pk__lte=last_pk))
+            if len(keys) > 1:
+                next_cursor = '{}:{}'.format(to_epoch_us(last_timestamp), last_pk)
+        rows = (self.checkin_row(checkin)
+                for checkin in qs.select_related('employee', 'employee__department').iterator_with_shift())
+
+        response = StreamingHttpResponse(api_lines(fmt, self.fields, rows), content_type=API_CONTENT_TYPES[fmt])
+        if next_cursor:
+            query = request.GET.copy()
+            query['cursor'] = next_cursor
+            response['Link'] = '<{}>; rel="next"'.format(request.build_absolute_uri('?' + query.urlencode()))
+            response['X-Next-Cursor'] = next_cursor
         return response
 
+    def checkin_row(self, checkin):
+        return (
+            checkin.pk,
+            checkin.employee_id,
+            checkin.employee.code,
+            checkin.employee.surname,
+            checkin.employee.name,
+            checkin.employee.patronym,
+            checkin.employee.department.acronym,
+            api_timestamp(checkin.arrival_timestamp),
+            api_timestamp(checkin.leaving_timestamp),
+            api_timestamp(checkin.effective_timestamp),
+            checkin.comment,
+            checkin.workday_duration_raw,
+            checkin.dinners_duration,
+            checkin.coffee_duration,
+            checkin.night_shift_minutes,
+            checkin.night_shift_bonus,
+            checkin.workday_duration,
+            api_timestamp(checkin.modified),
+        )
 
-class ReportWONightShiftView(SummaryReportView):
-    report_name = 'sitapea_report_wo_night_shift'
 
-    def employee_time(self, employee, date_from, date_to):
-        return employee.working_hours_wo_night_shift_in_date_range(date_from, date_to)
+@method_decorator(api_conditions, name='get')
+class SummaryApiView(View):
+    """Minutes worked by every employee in a period as JSON Lines or CSV."""
+    fields = ('employee_id', 'code', 'surname', 'name', 'patronym', 'department', 'total_minutes',
+              'wo_night_shift_bonus_minutes')
+
+    def get(self, request, fmt):
+        try:
+            date_from, date_to = api_period(request)
+        except ValueError:
+            return JsonResponse({'error': 'bad_request'}, status=400)
+        working_time = DailyWorktime.objects.working_time_by_employee(date_from, date_to)
+        qs = Employee.objects\
+            .order_by('surname', 'name', 'pk')\
+            .select_related('department')
+        rows = (self.employee_row(employee, working_time.get(employee.pk)) for employee in qs.iterator())
+        return StreamingHttpResponse(api_lines(fmt, self.fields, rows), content_type=API_CONTENT_TYPES[fmt])
+
+    def employee_row(self, employee, working_time):
+        return (
+            employee.pk,
+            employee.code,
+            employee.surname,
+            employee.name,
+            employee.patronym,
+            employee.department.acronym,
+            working_time.total if working_time else 0,
+            working_time.wo_night_shift_bonus if working_time else 0,
+        )
+
+
+class TimesheetView(View):
+    """
+    Day by day timesheet of an employee for a YYYY-MM month, as a page or
+    as JSON.
+    """
+    template_name = 'main/timesheet.html'
+
+    def get(self, request, employee_id, month, fmt=None):
+        employees = [get_object_or_404(Employee.objects.select_related('department'), pk=employee_id)]
+        return self.timesheet_response(request, employees, month, fmt, {'employee': employees[0]})
+
+    def timesheet_response(self, request, employees, month, fmt, context):
+        try:
+            month = parse_month(month)
+        except ValueError:
+            raise Http404
+        timesheets = get_timesheets([employee.pk for employee in employees], month)
+        rows = [(employee, timesheets[employee.pk]) for employee in employees]
+        if fmt == 'json':
+            return JsonResponse({
+                'month': '{:%Y-%m}'.format(month),
+                'employees': [self.timesheet_json(employee, timesheet) for employee, timesheet in rows],
+            })
+        return render(request, self.template_name, dict(context, month=month, timesheets=rows))
+
+    def timesheet_json(self, employee, timesheet):
+        return {
+            'employee_id': employee.pk,
+            'code': employee.code,
+            'surname': employee.surname,
+            'name': employee.name,
+            'department': employee.department.acronym,
+            'total_minutes': timesheet.total,
+            'wo_night_shift_bonus_minutes': timesheet.wo_night_shift_bonus,
+            'days': [{
+                'date': str(day.date),
+                'arrival': api_timestamp(day.arrival),
+                'leaving': api_timestamp(day.leaving),
+                'net_minutes': day.net_minutes,
+                'night_bonus_minutes': day.night_bonus_minutes,
+            } for day in timesheet.days],
+        }
+
+
+class DepartmentTimesheetView(TimesheetView):
+    def get(self, request, department_id, month, fmt=None):
+        department = get_object_or_404(Department, pk=department_id)
+        employees = department.employee_set.order_by('surname', 'name', 'pk').select_related('department')
+        return self.timesheet_response(request, list(employees), month, fmt, {'department': department})
+
+
+@method_decorator(gzip_page, name='get')
+class CheckInChangeFeedView(View):
+    """
+    Check-in changes after the seq given as ?after=, oldest first. The
+    X-Last-Seq header carries the watermark to pass on the next call.
+    """
+    def get(self, request, fmt):
+        try:
+            after = int(request.GET.get('after', 0))
+            limit = int(request.GET.get('limit', API_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'bad_request'}, status=400)
+        if after < 0 or not 0 < limit <= API_PAGE_MAX:
+            return JsonResponse({'error': 'bad_request'}, status=400)
+        changes = list(CheckInChange.objects.after(after)[:limit])
+        response = StreamingHttpResponse(api_lines(fmt, CheckInChange.FEED_FIELDS,
+                                                   (change.feed_row() for change in changes)),
+                                         content_type=API_CONTENT_TYPES[fmt])
+        response['X-Last-Seq'] = changes[-1].seq if changes else after
+        if len(changes) == limit:
+            query = request.GET.copy()
+            query['after'] = changes[-1].seq
+            response['Link'] = '<{}>; rel="next"'.format(request.build_absolute_uri('?' + query.urlencode()))
+        return response
+
 
+class MetricsView(View):
+    def get(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise Http404
+        token = request.META.get('HTTP_AUTHORIZATION', '')
+        if not (settings.METRICS_TOKEN and constant_time_compare(token, 'Bearer ' + settings.METRICS_TOKEN)
+                or request.user.is_staff):
+            return HttpResponseForbidden()
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
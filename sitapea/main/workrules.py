@@ -0,0 +1,168 @@
+"""
+Work rules: breaks, night shift windows and the night shift bonus.
+
+settings.WORK_RULES is a list of rule versions. A version applies to the
+check-ins arriving after the local midnight starting its 'since' date,
+until a later version starts; with 'departments' it only applies to the
+departments of those ids, and wins over a general version starting the
+same day. Keys left out take their DEFAULT_RULE values, which are also
+the rules before the first version.
+
+The versions are compiled once into CompiledRule objects: break
+deductions become lookup tables indexed by minutes worked and night
+windows minute offsets into the local day.
+"""
+import hashlib
+from bisect import bisect_left
+from fractions import Fraction
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.dateparse import parse_date
+
+from main.helpers import US_PER_MINUTE, start_of_day, to_epoch_us
+
+DEFAULT_RULE = {
+    'since': None,
+    'departments': None,
+    # Every started break_cycle minutes of work past its first break_after
+    # minutes give a dinner; the minutes past break_after of each cycle
+    # give a coffee break per coffee_every of them.
+    'break_cycle': 12 * 60,
+    'break_after': 5 * 60,
+    'dinner': 60,
+    'coffee_every': 135,
+    'coffee': 15,
+    'night_windows': (),
+    'night_bonus': 0,
+}
+
+DEFAULT_WORK_RULES = [
+    {
+        'since': '2017-01-01',
+        'night_windows': [('00:00', '06:00'), ('22:00', '24:00')],
+        'night_bonus': '1/2',
+    },
+]
+
+TABLE_MINUTES = 48 * 60
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_minute(value):
+    hours, minutes = (int(part) for part in value.split(':'))
+    minute = hours * 60 + minutes
+    if not 0 <= minute <= MINUTES_PER_DAY or not 0 <= minutes < 60:
+        raise ValueError(value)
+    return minute
+
+
+class CompiledRule(object):
+    def __init__(self, rule):
+        unknown = set(rule) - set(DEFAULT_RULE)
+        if unknown:
+            raise ImproperlyConfigured('Unknown WORK_RULES keys: {}'.format(', '.join(sorted(unknown))))
+        rule = dict(DEFAULT_RULE, **rule)
+        try:
+            self.break_cycle = int(rule['break_cycle'])
+            self.break_after = int(rule['break_after'])
+            self.dinner = int(rule['dinner'])
+            self.coffee_every = int(rule['coffee_every'])
+            self.coffee = int(rule['coffee'])
+            # (start, end) minutes of the local day, the end of 24:00
+            # meaning the last microsecond of the day.
+            self.night_windows = tuple((parse_minute(start), parse_minute(end))
+                                       for start, end in rule['night_windows'])
+            bonus = Fraction(str(rule['night_bonus']))
+        except (TypeError, ValueError) as e:
+            raise ImproperlyConfigured('Bad WORK_RULES version {!r}: {}'.format(rule, e))
+        if not 0 <= self.break_after < self.break_cycle or self.coffee_every <= 0:
+            raise ImproperlyConfigured('Bad WORK_RULES break cycle in {!r}'.format(rule))
+        if any(start >= end for start, end in self.night_windows):
+            raise ImproperlyConfigured('Bad WORK_RULES night window in {!r}'.format(rule))
+        self.bonus_numerator, self.bonus_denominator = bonus.numerator, bonus.denominator
+        self.night_offsets = self.night_window_offsets()
+
+        self.dinners_table = [self.compute_dinners(raw) for raw in range(TABLE_MINUTES)]
+        self.coffee_table = [self.compute_coffee(raw) for raw in range(TABLE_MINUTES)]
+
+    @property
+    def key(self):
+        """The compiled values, equal for rules computing the same columns."""
+        return (self.break_cycle, self.break_after, self.dinner, self.coffee_every, self.coffee,
+                self.night_windows, self.bonus_numerator, self.bonus_denominator)
+
+    def compute_dinners(self, raw):
+        return (raw + self.break_cycle - self.break_after) // self.break_cycle * self.dinner
+
+    def compute_coffee(self, raw):
+        paid = raw // self.break_cycle * (self.break_cycle - self.break_after) + \
+            max(raw % self.break_cycle - self.break_after, 0)
+        return paid // self.coffee_every * self.coffee
+
+    def dinners(self, raw):
+        return self.dinners_table[raw] if 0 <= raw < TABLE_MINUTES else self.compute_dinners(raw)
+
+    def coffee_breaks(self, raw):
+        return self.coffee_table[raw] if 0 <= raw < TABLE_MINUTES else self.compute_coffee(raw)
+
+    def night_bonus(self, night_minutes):
+        return night_minutes * self.bonus_numerator // self.bonus_denominator
+
+    def night_window_offsets(self):
+        """(start, end) of the night windows in microseconds into the local day."""
+        return [(start * US_PER_MINUTE, end * US_PER_MINUTE - (end == MINUTES_PER_DAY))
+                for start, end in self.night_windows]
+
+
+class WorkRules(object):
+    def __init__(self, versions):
+        base = CompiledRule({})
+        general, by_department = [], {}
+        for version in versions:
+            since = version.get('since')
+            try:
+                since_us = to_epoch_us(start_of_day(parse_date(since))) if since else float('-inf')
+            except (TypeError, ValueError):
+                raise ImproperlyConfigured('Bad WORK_RULES since: {!r}'.format(since))
+            entry = (since_us, CompiledRule(version))
+            if version.get('departments'):
+                for department_id in version['departments']:
+                    by_department.setdefault(department_id, []).append(entry)
+            else:
+                general.append(entry)
+        self.by_department = bool(by_department)
+
+        def timeline(general_entries, department_entries):
+            # Department versions sort after general ones of the same day.
+            entries = sorted([(since, 0, i, rule) for i, (since, rule) in enumerate(general_entries)] +
+                             [(since, 1, i, rule) for i, (since, rule) in enumerate(department_entries)],
+                             key=lambda entry: entry[:3])
+            return [float('-inf')] + [entry[0] for entry in entries], [base] + [entry[3] for entry in entries]
+        self.timelines = {department_id: timeline(general, entries) for department_id, entries in by_department.items()}
+        self.default_timeline = timeline(general, [])
+        # Part of the versions of reports and timesheets built under the rules.
+        timelines = [(None, self.default_timeline)] + sorted(self.timelines.items())
+        state = [(department_id, sinces, [rule.key for rule in rules])
+                 for department_id, (sinces, rules) in timelines]
+        self.digest = hashlib.md5(repr(state).encode('utf-8')).hexdigest()
+
+    def rule_at(self, department_id, arrival_us):
+        """Rule of a check-in by its department and arrival in epoch microseconds."""
+        sinces, rules = self.timelines.get(department_id, self.default_timeline)
+        # A version covers arrivals after its start, not at it.
+        return rules[max(bisect_left(sinces, arrival_us) - 1, 0)]
+
+
+@lru_cache(maxsize=None)
+def get_work_rules():
+    return WorkRules(getattr(settings, 'WORK_RULES', DEFAULT_WORK_RULES))
+
+
+@receiver(setting_changed)
+def reset_work_rules(setting, **kwargs):
+    if setting in ('WORK_RULES', 'TIME_ZONE'):
+        get_work_rules.cache_clear()
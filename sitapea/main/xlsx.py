@@ -0,0 +1,31 @@
+"""
+Constant-memory XLSX output.
+
+Reports are written into openpyxl write-only workbooks whose worksheets are
+spooled to temporary files row by row. StreamingExcelWriter copies those
+files into the archive instead of reading them back into memory.
+"""
+from openpyxl import Workbook
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.writer.write_only import DumpCommentWriter
+from openpyxl.xml.constants import PACKAGE_WORKSHEETS
+
+
+class StreamingExcelWriter(ExcelWriter):
+    comment_writer = DumpCommentWriter
+
+    def _write_worksheets(self, archive):
+        for i, sheet in enumerate(self.workbook.worksheets, 1):
+            sheet.close()
+            archive.write(sheet.filename, PACKAGE_WORKSHEETS + '/sheet%d.xml' % i)
+            sheet._cleanup()
+
+
+def write_only_workbook():
+    wb = Workbook(write_only=True)
+    return wb, wb.create_sheet()
+
+
+def save_workbook(wb, fileobj):
+    StreamingExcelWriter(wb).save(fileobj)
+
@@ -7,5 +7,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, '..', '..', 'dev_db.sqlite3'),
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, '..', '..', 'test_db.sqlite3'),
+        },
     }
-}
\ No newline at end of file
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'main.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,15 +75,106 @@ WSGI_APPLICATION = 'sitapea.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
+# SQLite by default. SITAPEA_DB_ENGINE=postgresql (with psycopg2 installed)
+# and SITAPEA_DB_NAME, _USER, _PASSWORD, _HOST, _PORT select PostgreSQL,
+# whose connections are kept for SITAPEA_DB_CONN_MAX_AGE seconds. See
+# the copy_database command for moving the data over. No other engine is
+# supported: the check-in change log needs its writers serialized, which
+# main.models.CheckInChangeQuerySet.lock_log does on these two.
+
+DB_ENGINE = os.environ.get('SITAPEA_DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SITAPEA_DB_NAME', os.path.join(BASE_DIR, '..', '..', 'db.sqlite3')),
+            # A file rather than shared-cache memory, so that concurrent tests
+            # see the same locking as production.
+            'TEST': {
+                'NAME': os.path.join(BASE_DIR, '..', '..', 'test_db.sqlite3'),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.' + DB_ENGINE,
+            'NAME': os.environ.get('SITAPEA_DB_NAME', 'sitapea'),
+            'USER': os.environ.get('SITAPEA_DB_USER', ''),
+            'PASSWORD': os.environ.get('SITAPEA_DB_PASSWORD', ''),
+            'HOST': os.environ.get('SITAPEA_DB_HOST', ''),
+            'PORT': os.environ.get('SITAPEA_DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('SITAPEA_DB_CONN_MAX_AGE', 600)),
+        }
+    }
+
+# Applied to every new SQLite connection, see main.signals. WAL lets the
+# report reads go on while a kiosk tap writes; busy_timeout makes writers
+# wait for each other instead of failing with "database is locked".
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('busy_timeout', 20000),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),
+    ('temp_store', 'MEMORY'),
+)
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# Shared by all gunicorn workers, see main.cache.
+
+# The default cache holds a timesheet per employee and closed month, so it
+# is sized for the employees times the months looked at. The version
+# stamps that invalidate its entries are kept apart, where no cull of the
+# default cache can drop them and bring invalidated entries back.
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, '..', '..', 'db.sqlite3'),
-    }
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '..', '..', 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SITAPEA_CACHE_MAX_ENTRIES', 100000)),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '..', '..', 'cache', 'versions'),
+    },
 }
 
 
+# Reports
+# Finished XLSX files of main.ReportJob, written by the report_worker command.
+
+REPORTS_ROOT = os.path.join(BASE_DIR, '..', '..', 'reports')
+
+
+# Instrumentation
+# Per view request timing, query counts and a slow request log, see
+# main.instrumentation. /metrics answers requests bearing METRICS_TOKEN
+# (Authorization: Bearer ...) or from staff users.
+
+INSTRUMENTATION_ENABLED = False
+SLOW_REQUEST_MS = 500
+METRICS_TOKEN = None
+
+
+# Work rules
+# Breaks and night shifts by date and department, see main.workrules.
+# Changes apply to stored rollups after `manage.py rebuild_worktime`.
+
+WORK_RULES = [
+    {
+        'since': '2017-01-01',
+        'night_windows': [('00:00', '06:00'), ('22:00', '24:00')],
+        'night_bonus': '1/2',
+    },
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -121,3 +213,4 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = '/home/nerv/sitapea/static_content/static/'
+STATICFILES_STORAGE = 'main.storage.ManifestStaticFilesStorage'
@@ -16,10 +16,17 @@ Including another URLconf
 """
 from django.conf.urls import include, url
 from django.contrib import admin
-from main.views import CheckInView, IndexView, ReportDownloadView, SummaryReportView, ReportWONightShiftView
+from main.views import (CheckInView, CheckInBatchView, IndexView, ReportDownloadView, SummaryReportView,
+                        ReportWONightShiftView, ReportJobView, ReportJobDownloadView, BatchReportView,
+                        CheckInApiView, SummaryApiView, CheckInChangeFeedView, MetricsView, TimesheetView,
+                        DepartmentTimesheetView, HealthView)
+
+MONTH = r'(?P<month>[0-9]{4}-(0[1-9]|1[0-2]))'
+
 
 urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^checkin/batch/$', CheckInBatchView.as_view(), name='checkin-batch-view'),
     url(r'^checkin/(?P<code>\d*)/(?P<action>arrival|leaving)/$', CheckInView.as_view(), name='checkin-view'),
     url(r'^report/(?P<date_from>([0-9]{4})-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1]|[1-9])).*'
         r'/(?P<date_to>([0-9]{4})-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1]|[1-9])).*/$',
@@ -30,5 +37,20 @@ urlpatterns = [
     url(r'^report_wo_night_shift/(?P<date_from>([0-9]{4})-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1]|[1-9])).*'
         r'/(?P<date_to>([0-9]{4})-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1]|[1-9])).*/$',
         ReportWONightShiftView.as_view(), name='report_wo_night_shift-download-view'),
+    url(r'^report/batch/$', BatchReportView.as_view(), name='report-batch-view'),
+    url(r'^report/job/(?P<pk>\d+)/$', ReportJobView.as_view(), name='report-job-view'),
+    url(r'^report/job/(?P<pk>\d+)/download/$', ReportJobDownloadView.as_view(), name='report-job-download-view'),
+    url(r'^api/checkins\.(?P<fmt>jsonl|csv)$', CheckInApiView.as_view(), name='api-checkins-view'),
+    url(r'^api/changes\.(?P<fmt>jsonl|csv)$', CheckInChangeFeedView.as_view(), name='api-changes-view'),
+    url(r'^api/summary\.(?P<fmt>jsonl|csv)$', SummaryApiView.as_view(), name='api-summary-view'),
+    url(r'^timesheet/(?P<employee_id>\d+)/' + MONTH + r'/$', TimesheetView.as_view(), name='timesheet-view'),
+    url(r'^timesheet/department/(?P<department_id>\d+)/' + MONTH + r'/$', DepartmentTimesheetView.as_view(),
+        name='department-timesheet-view'),
+    url(r'^api/timesheet/(?P<employee_id>\d+)/' + MONTH + r'\.(?P<fmt>json)$', TimesheetView.as_view(),
+        name='api-timesheet-view'),
+    url(r'^api/timesheet/department/(?P<department_id>\d+)/' + MONTH + r'\.(?P<fmt>json)$',
+        DepartmentTimesheetView.as_view(), name='api-department-timesheet-view'),
+    url(r'^health/$', HealthView.as_view(), name='health-view'),
+    url(r'^metrics$', MetricsView.as_view(), name='metrics-view'),
     url(r'^$', IndexView.as_view(), name='index-view'),
 ]